@@ -1,12 +1,17 @@
 from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.mixins import ListModelMixin
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 from rest_framework.viewsets import GenericViewSet, ReadOnlyModelViewSet
 
 from palanaeum.api.serializers import EntrySerializer, EventSerializer, TagsSerializer
 from palanaeum.models import Entry, Event, Tag
-from palanaeum.search import execute_filters, get_search_results, init_filters
+from palanaeum.related import find_related
+from palanaeum.search import get_search_results, init_filters, SearchPaginator
 
 
 class VariantPagination(PageNumberPagination):
@@ -15,6 +20,57 @@ class VariantPagination(PageNumberPagination):
     max_page_size = 250
 
 
+class SearchPagination(VariantPagination):
+    """
+    Paginates search results by page numbers or by keyset cursors.
+    Links to the next and previous pages use cursors whenever possible.
+    """
+    django_paginator_class = SearchPaginator
+    cursor_query_param = 'cursor'
+    facets_query_param = 'facets'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Facets are counted together with the results, before the paginator asks for the count
+        self.facets = queryset.get_facets() if request.query_params.get(self.facets_query_param) else None
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        paginator = self.django_paginator_class(queryset, self.get_page_size(request))
+        try:
+            self.page = paginator.page_from_cursor(cursor)
+        except ValueError:
+            raise NotFound(_('Invalid cursor.'))
+        return list(self.page)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.facets is not None:
+            response.data['facets'] = self.facets
+        return response
+
+    def get_next_link(self):
+        if not self.page.has_next():
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.page.next_cursor)
+
+    def get_previous_link(self):
+        if not self.page.has_previous():
+            return None
+        url = self.request.build_absolute_uri()
+        cursor = self.page.previous_cursor
+        if cursor:
+            url = remove_query_param(url, self.page_query_param)
+            return replace_query_param(url, self.cursor_query_param, cursor)
+        url = remove_query_param(url, self.cursor_query_param)
+        page_number = self.page.previous_page_number()
+        if page_number == 1:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, page_number)
+
+
 class EventViewSet(ReadOnlyModelViewSet):
     queryset = Event.all_visible.all()
     serializer_class = EventSerializer
@@ -44,19 +100,42 @@ class EntryViewSet(ReadOnlyModelViewSet):
     serializer_class = EntrySerializer
     pagination_class = VariantPagination
 
+    @action(detail=True)
+    def related(self, request, pk=None):
+        """
+        Return entries most similar to this one, with their similarity.
+        """
+        entry = self.get_object()
+        related = find_related(entry.id)
+        entries_map = Entry.prefetch_entries([related_id for related_id, similarity in related])
+        results = []
+        for related_id, similarity in related:
+            if related_id in entries_map:
+                data = self.get_serializer(entries_map[related_id]).data
+                data['similarity'] = similarity
+                results.append(data)
+        return Response(results)
+
 
 class SearchEntryViewSet(ListModelMixin, GenericViewSet):
     queryset = Entry.all_visible.all()
     serializer_class = EntrySerializer
-    pagination_class = VariantPagination
+    pagination_class = SearchPagination
 
     def get_queryset(self):
         ordering = self.request.query_params.get('ordering', 'rank')
         filters = init_filters(self.request)
-        scores = execute_filters(filters)
-        entries_ids = scores.keys()
-        entries_map = Entry.prefetch_entries(entries_ids)
-        return [entries_map[i[0]] for i in get_search_results(scores, ordering)]
+        return get_search_results(filters, ordering)
+
+    def paginate_queryset(self, queryset):
+        """
+        Load only the entries that are displayed on the requested page.
+        """
+        page = super().paginate_queryset(queryset)
+        if page is None:
+            return None
+        entries_map = Entry.prefetch_entries([entry_id for entry_id, rank in page])
+        return [entries_map[entry_id] for entry_id, rank in page if entry_id in entries_map]
 
 
 class RandomEntryViewSet(ListModelMixin, GenericViewSet):
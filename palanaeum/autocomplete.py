@@ -0,0 +1,161 @@
+"""
+In-memory autocomplete of tag names and speakers.
+
+Names are kept in sorted arrays of lowercase keys, one key for every word a name starts with,
+so a lookup is a binary search for the typed prefix. Usage counts (numbers of entries
+and events using a name) are precomputed and updated from the TagIndexChange log.
+All tags are suggested, even the unused ones. The list of tags with their event counts isn't logged,
+it's read again on every refresh.
+"""
+import heapq
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.db import connection
+
+from palanaeum.tag_index import ChangeLogIndex, SharedIndex, VARIANTS
+
+# Suggestions are based on versions visible to everybody
+POINTER = VARIANTS['approved']
+# Suggestions lag behind the changes made by other processes for at most that many seconds
+AUTOCOMPLETE_REFRESH_INTERVAL = 30
+
+ENTRY_TAGS_SQL = """\
+    SELECT e.id, t.name
+    FROM palanaeum_entry e
+    JOIN palanaeum_entryversion_tags evt ON evt.entryversion_id = e.{pointer}
+    JOIN palanaeum_tag t ON t.id = evt.tag_id
+    """.format(pointer=POINTER)
+ENTRY_SPEAKERS_SQL = """\
+    SELECT DISTINCT e.id, trim(l.speaker)
+    FROM palanaeum_entry e
+    JOIN palanaeum_entryline l ON l.entry_version_id = e.{pointer}
+    WHERE trim(l.speaker) <> ''
+    """.format(pointer=POINTER)
+EVENT_TAGS_SQL = """\
+    SELECT t.name, COUNT(et.event_id)
+    FROM palanaeum_tag t
+    LEFT JOIN palanaeum_event_tags et ON et.tag_id = t.id
+    GROUP BY t.name
+    """
+KINDS = ('tags', 'speakers')
+
+
+def _prefix_keys(name: str) -> list:
+    """
+    Return keys, under which the name can be found: the name itself and its suffixes starting with every word.
+    """
+    words = name.lower().split()
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+
+class AutocompleteIndex(ChangeLogIndex):
+    """
+    Tag names and speakers of entries with their usage counts.
+    """
+    def __init__(self):
+        super().__init__()
+        self.entry_names = {kind: {} for kind in KINDS}
+        self.counts = {kind: Counter() for kind in KINDS}
+        # Numbers of events using every tag, including the unused tags
+        self.event_tag_counts = Counter()
+        self._prefixes = {}
+
+    def _fetch(self, entries_ids=None) -> dict:
+        names = {kind: defaultdict(set) for kind in KINDS}
+        where = "" if entries_ids is None else " AND e.id = ANY(%s)"
+        params = [] if entries_ids is None else [entries_ids]
+        with connection.cursor() as cursor:
+            cursor.execute(ENTRY_TAGS_SQL + " WHERE True" + where, params)
+            for entry_id, name in cursor.fetchall():
+                names['tags'][entry_id].add(name)
+            cursor.execute(ENTRY_SPEAKERS_SQL + where, params)
+            for entry_id, name in cursor.fetchall():
+                names['speakers'][entry_id].add(name)
+        return names
+
+    def load_entries(self):
+        for kind, entry_names in self._fetch().items():
+            self.entry_names[kind] = {entry_id: frozenset(names) for entry_id, names in entry_names.items()}
+            self.counts[kind] = Counter(name for names in entry_names.values() for name in names)
+        self.event_tag_counts = Counter()
+        self._prefixes = {}
+        self.update_tags()
+
+    def update_tags(self):
+        """
+        Read the list of tags with their event counts again.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(EVENT_TAGS_SQL)
+            event_tag_counts = Counter(dict(cursor.fetchall()))
+
+        counts = self.counts['tags']
+        names = set(counts)
+        counts.subtract(self.event_tag_counts)
+        counts.update(event_tag_counts)
+        self.event_tag_counts = event_tag_counts
+        for name in [name for name, count in counts.items() if count <= 0 and name not in event_tag_counts]:
+            del counts[name]
+        if set(counts) != names:
+            self._prefixes.pop('tags', None)
+
+    def refresh(self):
+        super().refresh()
+        self.update_tags()
+
+    def update_entries(self, entries_ids: list):
+        for kind, new_names in self._fetch(entries_ids).items():
+            entry_names = self.entry_names[kind]
+            counts = self.counts[kind]
+            for entry_id in entries_ids:
+                old = entry_names.pop(entry_id, frozenset())
+                new = frozenset(new_names.get(entry_id, ()))
+                if new:
+                    entry_names[entry_id] = new
+                for name in old - new:
+                    counts[name] -= 1
+                    # Existing tags are suggested even when they're not used anymore
+                    if counts[name] <= 0 and (kind != 'tags' or name not in self.event_tag_counts):
+                        del counts[name]
+                        self._prefixes.pop(kind, None)
+                for name in new - old:
+                    if name not in counts:
+                        self._prefixes.pop(kind, None)
+                    counts[name] += 1
+
+    def _get_prefixes(self, kind: str) -> tuple:
+        """
+        Return sorted lists of keys and names they belong to. They're rebuilt only when names are added or removed.
+        """
+        if kind not in self._prefixes:
+            pairs = sorted((key, name) for name in self.counts[kind] for key in _prefix_keys(name))
+            self._prefixes[kind] = [key for key, name in pairs], [name for key, name in pairs]
+        return self._prefixes[kind]
+
+    def lookup(self, kind: str, query: str, limit: int = 20) -> list:
+        """
+        Return up to `limit` most used (name, count) pairs with a word starting with the query.
+        """
+        keys, names = self._get_prefixes(kind)
+        query = " ".join(query.lower().split())
+        start = bisect_left(keys, query)
+        end = bisect_left(keys, query + '\uffff', start)
+        counts = self.counts[kind]
+        matches = {names[i] for i in range(start, end)}
+        return heapq.nsmallest(limit, ((name, counts[name]) for name in matches),
+                               key=lambda match: (-match[1], match[0].lower()))
+
+
+_autocomplete_index = SharedIndex(AutocompleteIndex, 'autocomplete_snapshot', AUTOCOMPLETE_REFRESH_INTERVAL)
+
+
+def autocomplete(kind: str, query: str, limit: int = 20) -> list:
+    """
+    Return (name, usage count) pairs of tags or speakers matching the typed query.
+    """
+    return _autocomplete_index.get().lookup(kind, query, limit)
+
+
+def reset_autocomplete():
+    _autocomplete_index.reset()
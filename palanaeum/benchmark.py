@@ -0,0 +1,316 @@
+"""
+Synthetic archive and search benchmarks.
+
+generate_archive bulk-creates events with entries, their versions, lines, tags and URL sources, with words
+drawn from a Zipf distribution over a vocabulary resembling the real archive, and builds their search vectors.
+run_benchmarks times the search pipeline on the current database, stage by stage, and counts the queries
+executed by every call. See generate_test_archive and benchmark_search commands.
+"""
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode
+
+import numpy as np
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from palanaeum.models import Entry, EntryLine, EntrySearchVector, EntryVersion, Event, Speaker, Tag, URLSource
+from palanaeum.search import bump_search_generation, execute_filters, get_search_results, init_filters, \
+    paginate_search_results
+
+EVENT_PREFIX = 'Benchmark event'
+URL_PREFIX = 'https://example.com/benchmark/'
+# Frequencies of words in natural language follow Zipf's law with an exponent close to 1
+ZIPF_EXPONENT = 1.1
+
+# Topic words come first, so they are the most frequent ones after the common words are interleaved
+TOPIC_WORDS = """
+    hoid cosmere shard spren surgebinding allomancy feruchemy hemalurgy investiture radiant stormlight
+    odium honor cultivation preservation ruin adonalsium kaladin shallan dalinar szeth vin kelsier sazed
+    wax wayne marasi elend vivenna siri vasher nightblood awakening breath roshar scadrial nalthis sel
+    taldain threnody yolen shadesmar cognitive realm spiritual physical connection identity fortune
+    worldhopper seon splinter vessel intent highstorm fabrial gemheart chasmfiend parshendi listener
+    singer fused herald honorblade shardblade shardplate oathpact bondsmith windrunner lightweaver
+    skybreaker dustbringer edgedancer truthwatcher willshaper stoneward elsecaller mistborn misting
+    ferring kandra koloss inquisitor atium lerasium harmonium metal pewter tin steel iron bronze copper
+    zinc brass aluminum duralumin electrum cadmium bendalloy gold chromium nicrosil mistwraith mist
+    drab returned lifeless dawnshard aether sand elantris aon dor stormfather nightwatcher sibling
+    cusicesh trell autonomy dominion devotion mercy whimsy valor endowment ambition invested book
+    series sequel draft chapter character magic system wob signing tour reading convention stream
+""".split()
+COMMON_WORDS = """
+    the be to of and a in that have it for not on with he as you do at this but his by from they we say
+    her she or an will my one all would there their what so up out if about who get which go me when
+    make can like time no just him know take people into year your good some could them see other than
+    then now look only come its over think also back after use two how our work first well way even new
+    want because any these give day most us is are was were been has had did does said asked answer
+    question why where much many very more really never always still yet again maybe probably actually
+""".split()
+SPEAKERS = ['Brandon Sanderson', 'Questioner', 'Peter Ahlstrom', 'Audience member', 'Isaac Stewart',
+            'Karen Ahlstrom', 'Dan Wells', 'Howard Tayler', 'Mary Robinette Kowal']
+
+
+def get_vocabulary() -> tuple:
+    """
+    Return the array of words and the probabilities of drawing them.
+    """
+    words = []
+    for i in range(max(len(TOPIC_WORDS), len(COMMON_WORDS))):
+        words.extend(COMMON_WORDS[i:i + 1] + TOPIC_WORDS[i:i + 1])
+    probabilities = 1 / np.arange(1, len(words) + 1) ** ZIPF_EXPONENT
+    return np.array(words), probabilities / probabilities.sum()
+
+
+class ArchiveGenerator:
+    """
+    Creates a synthetic archive in batches. The same seed gives the same archive.
+    """
+    def __init__(self, seed: int = 0, entries_per_event: int = 50, versions: float = 1.5, lines: float = 4,
+                 tags: int = 300, url_share: float = 0.2, unapproved_share: float = 0.05):
+        self.rng = np.random.RandomState(seed)
+        self.words, self.probabilities = get_vocabulary()
+        self.entries_per_event = entries_per_event
+        self.versions = versions
+        self.lines = lines
+        self.url_share = url_share
+        self.unapproved_share = unapproved_share
+        self.tags_ids = self._create_tags(tags)
+        self.tag_probabilities = 1 / np.arange(1, len(self.tags_ids) + 1) ** ZIPF_EXPONENT
+        self.tag_probabilities /= self.tag_probabilities.sum()
+        self.events_count = Event.objects.filter(name__startswith=EVENT_PREFIX).count()
+        # Events are filled up across batches
+        self.event = None
+        self.event_entries = 0
+
+    def _create_tags(self, count: int) -> list:
+        names = TOPIC_WORDS[:count]
+        names += ['{} {}'.format(first, second) for first in TOPIC_WORDS for second in TOPIC_WORDS
+                  if first != second][:max(count - len(names), 0)]
+        Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+        tags_ids = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+        return [tags_ids[name] for name in names]
+
+    def sentence(self, min_words: int = 5, max_words: int = 40) -> str:
+        words = self.rng.choice(self.words, self.rng.randint(min_words, max_words + 1), p=self.probabilities)
+        text = " ".join(words)
+        return text[0].upper() + text[1:] + self.rng.choice(['.', '?', '!'], p=[0.6, 0.35, 0.05])
+
+    def create_batch(self, count: int) -> list:
+        """
+        Create `count` entries with their events and return their ids.
+        """
+        events = []
+        entries = []
+        for _i in range(count):
+            if self.event is None or self.event_entries == self.entries_per_event:
+                self.events_count += 1
+                event_date = date(2006, 1, 1) + timedelta(days=int(self.rng.randint(0, 15 * 365)))
+                self.event = Event(name='{} {}'.format(EVENT_PREFIX, self.events_count), date=event_date,
+                                   location=self.sentence(1, 3)[:-1])
+                self.event_entries = 0
+                events.append(self.event)
+            entries.append(Entry(event=self.event, order=self.event_entries,
+                                 searchable=bool(self.rng.rand() > 0.02)))
+            self.event_entries += 1
+        Event.objects.bulk_create(events)
+        entries = Entry.objects.bulk_create(entries)
+
+        versions = []
+        versions_lines = []
+        for entry in entries:
+            texts = [(self.rng.choice(SPEAKERS, p=[0.45, 0.4] + [0.15 / (len(SPEAKERS) - 2)] * (len(SPEAKERS) - 2)),
+                      self.sentence()) for _i in range(1 + self.rng.poisson(self.lines - 1))]
+            versions_count = 1 + self.rng.poisson(self.versions - 1)
+            created = timezone.make_aware(datetime.combine(entry.event.date, datetime.min.time()))
+            for number in range(versions_count):
+                last = number == versions_count - 1
+                versions.append(EntryVersion(
+                    entry=entry, entry_date=entry.event.date, date=created + timedelta(days=number),
+                    note=self.sentence() if self.rng.rand() < 0.1 else '',
+                    is_approved=not (last and number > 0 and self.rng.rand() < self.unapproved_share),
+                    paraphrased=bool(self.rng.rand() < 0.2)
+                ))
+                versions_lines.append(list(texts))
+                # Later versions fix or extend the transcription
+                if self.rng.rand() < 0.5:
+                    line = self.rng.randint(len(texts))
+                    texts[line] = (texts[line][0], self.sentence())
+                else:
+                    texts.append((SPEAKERS[0], self.sentence()))
+        versions = EntryVersion.objects.bulk_create(versions)
+
+        EntryLine.objects.bulk_create([
+            EntryLine(entry_version=version, order=order, speaker=speaker, text=text)
+            for version, lines in zip(versions, versions_lines) for order, (speaker, text) in enumerate(lines)
+        ])
+        EntryVersion.tags.through.objects.bulk_create([
+            EntryVersion.tags.through(entryversion_id=version.id, tag_id=int(tag_id))
+            for version in versions
+            for tag_id in set(self.rng.choice(self.tags_ids, self.rng.poisson(1.5), p=self.tag_probabilities))
+        ])
+        self._create_url_sources(entries, versions)
+
+        entries_ids = [entry.id for entry in entries]
+        Entry.update_all_version_pointers(Entry.objects.filter(id__in=entries_ids))
+        Entry.update_source_flags(Entry.objects.filter(id__in=entries_ids))
+        EntrySearchVector.update_entries(entries_ids)
+        return entries_ids
+
+    def _create_url_sources(self, entries: list, versions: list):
+        sources = {}
+        for entry in entries:
+            if self.rng.rand() < self.url_share:
+                sources[entry.id] = URLSource(url='{}{}/{}'.format(URL_PREFIX, entry.event_id, entry.id),
+                                              text=self.sentence(2, 6)[:160])
+        URLSource.objects.bulk_create(sources.values())
+        EntryVersion.url_sources.through.objects.bulk_create([
+            EntryVersion.url_sources.through(entryversion_id=version.id, urlsource_id=sources[version.entry_id].id)
+            for version in versions if version.entry_id in sources
+        ])
+
+
+def generate_archive(entries: int, batch_size: int = 1000, progress=None, **options) -> int:
+    """
+    Create a synthetic archive of the given number of entries, see ArchiveGenerator for the options.
+    `progress` is called with the number of entries created so far after every batch.
+    """
+    generator = ArchiveGenerator(**options)
+    created = 0
+    while created < entries:
+        with transaction.atomic():
+            created += len(generator.create_batch(min(batch_size, entries - created)))
+        if progress is not None:
+            progress(created)
+    return created
+
+
+def clear_archive() -> int:
+    """
+    Delete the synthetic archive. Return the number of deleted entries.
+    """
+    with transaction.atomic():
+        speakers_ids = list(Speaker.objects.values_list('id', flat=True))
+        entries = Entry.objects.filter(event__name__startswith=EVENT_PREFIX)
+        URLSource.objects.filter(url__startswith=URL_PREFIX).delete()
+        deleted = entries.count()
+        entries.delete()
+        Event.objects.filter(name__startswith=EVENT_PREFIX).delete()
+        Speaker.recount(speakers_ids)
+        bump_search_generation()
+    return deleted
+
+
+# Searches of the benchmark, as GET params of the search page
+SEARCHES = {
+    'frequent_word': {'query': 'hoid'},
+    'rare_word': {'query': 'whimsy'},
+    'phrase': {'query': '"cognitive realm"'},
+    'prefix': {'query': 'surge*'},
+    'boolean': {'query': 'spren -kaladin OR (vin AND elend)'},
+    'speaker': {'speaker': 'ahlstrom'},
+    'tags': {'tags': ['hoid', 'cosmere']},
+    'combined': {'query': 'shard', 'tags': ['cosmere'], 'antitag': ['hoid'],
+                 'date_from': '2010-01-01', 'date_to': '2015-12-31'},
+}
+Measurement = namedtuple('Measurement', 'scenario search calls queries p50 p95')
+
+
+def _search_request(params: dict):
+    request = RequestFactory().get('/adv_search/?' + urlencode(params, doseq=True))
+    request.user = AnonymousUser()
+    # Page length is read from the session, the benchmark doesn't measure sessions
+    request.session = {}
+    return request
+
+
+def _execute_filters(client, params: dict):
+    execute_filters(init_filters(_search_request(params)))
+
+
+def _get_search_results(client, params: dict):
+    results = get_search_results(init_filters(_search_request(params)), 'rank')
+    results.count()
+    list(results[:20])
+
+
+def _paginate_search_results(client, params: dict):
+    request = _search_request(params)
+    paginate_search_results(request, get_search_results(init_filters(request), 'rank'))
+
+
+def _api_search(client, params: dict):
+    client.get('/api/search_entry/?' + urlencode(params, doseq=True))
+
+
+def _view_event(client, params: dict):
+    client.get(params['url'])
+
+
+# scenario: (function, whether it's run for every search)
+SCENARIOS = {
+    'execute_filters': (_execute_filters, True),
+    'get_search_results': (_get_search_results, True),
+    'paginate_search_results': (_paginate_search_results, True),
+    'api_search': (_api_search, True),
+    'view_event': (_view_event, False),
+}
+
+
+def measure(function, repeat: int, cold: bool = True) -> tuple:
+    """
+    Call the function `repeat` times. Return the largest number of queries executed by a call
+    and the median and 95th percentile of call durations in milliseconds.
+    With `cold` set, cached search results are invalidated before every call.
+    """
+    durations = []
+    queries = 0
+    for _i in range(repeat):
+        if cold:
+            bump_search_generation()
+        # The log of queries is limited, a full one wouldn't grow anymore
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            function()
+            durations.append((time.perf_counter() - start) * 1000)
+        queries = max(queries, len(context.captured_queries))
+    return queries, float(np.percentile(durations, 50)), float(np.percentile(durations, 95))
+
+
+def run_benchmarks(repeat: int = 20, scenarios=None, searches=None, cold: bool = True) -> list:
+    """
+    Measure the scenarios (all by default) with the searches (all by default). Return a list of Measurements.
+    The event with the most entries is used by view_event.
+    """
+    client = Client()
+    event = Event.all_visible.annotate(entries_number=Count('entries')).order_by('-entries_number', 'id').first()
+    measurements = []
+    for scenario in scenarios or SCENARIOS:
+        function, per_search = SCENARIOS[scenario]
+        if per_search:
+            cases = [(name, SEARCHES[name]) for name in searches or SEARCHES]
+        else:
+            cases = [('-', {'url': event.get_absolute_url()})] if event is not None else []
+        for name, params in cases:
+            # The first call warms up the connection and the in-memory indexes
+            function(client, params)
+            queries, p50, p95 = measure(lambda: function(client, params), repeat, cold)
+            measurements.append(Measurement(scenario, name, repeat, queries, p50, p95))
+    return measurements
+
+
+def format_measurements(measurements: list) -> str:
+    """
+    Return a plain text table of measurements.
+    """
+    lines = ["{:<24} {:<14} {:>7} {:>9} {:>9}".format('scenario', 'search', 'queries', 'p50 ms', 'p95 ms')]
+    for measurement in measurements:
+        lines.append("{:<24} {:<14} {:>7} {:>9.1f} {:>9.1f}".format(
+            measurement.scenario, measurement.search, measurement.queries, measurement.p50, measurement.p95
+        ))
+    return "\n".join(lines)
@@ -0,0 +1,171 @@
+"""
+Query and latency budgets of the main pages.
+
+A fixed set of requests is replayed against the database, usually filled with the synthetic archive
+(see palanaeum.benchmark). Every request records the number of queries, the number of repeated queries
+(same SQL with different parameters, the usual sign of an N+1 pattern) and the wall time.
+The results are compared with the budgets checked in to performance_budgets.json, so a view
+that starts doing more queries than it used to fails the tests. Budgets are measured with dummy caches,
+that's the worst case of a cold cache. After an intended change run the test_budgets tests with
+UPDATE_BUDGETS=1 environment variable to store the new numbers.
+"""
+import json
+import os
+import time
+from collections import Counter, namedtuple
+
+import numpy as np
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.text import slugify
+
+from palanaeum.models import Entry, Event
+from palanaeum.profiling import get_signature
+
+BUDGETS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'performance_budgets.json')
+# The dataset the budgets are measured on, arguments of benchmark.generate_archive
+BUDGET_DATASET = {'entries': 200, 'entries_per_event': 40, 'seed': 0}
+# Wall time budgets are multiplied by this, since machines differ
+TIME_TOLERANCE = 1.5
+
+
+def _event(client) -> str:
+    event = Event.all_visible.annotate(entries_number=Count('entries')).order_by('-entries_number', 'id').first()
+    return event.get_absolute_url()
+
+
+def _event_feed(client) -> str:
+    event = Event.all_visible.order_by('id').first()
+    return reverse('event_feed', args=(event.id, slugify(event.name)))
+
+
+def _entry(client) -> str:
+    return '/api/entry/{}/'.format(Entry.all_visible.order_by('id').values_list('id', flat=True).first())
+
+
+def _api_event(client) -> str:
+    return '/api/events/{}/'.format(Event.all_visible.order_by('id').values_list('id', flat=True).first())
+
+
+# name: (URL or a function returning it, whether it's requested by a staff member)
+REQUESTS = {
+    'index': ('/', False),
+    'events': ('/events/', False),
+    'event': (_event, False),
+    'event_staff': (_event, True),
+    'search': ('/adv_search/?query=hoid', False),
+    'search_tags': ('/adv_search/?tags=hoid&tags=cosmere&ordering=-date', False),
+    'recent': ('/recent/', False),
+    'recent_staff': ('/recent/', True),
+    'tags': ('/tags/', False),
+    'recent_feed': ('/recent/feed/', False),
+    'event_feed': (_event_feed, False),
+    'sitemap': ('/sitemap.xml', False),
+    'api_events': ('/api/events/', False),
+    'api_event': (_api_event, False),
+    'api_entry': (_entry, False),
+    'api_search': ('/api/search_entry/?query=hoid', False),
+}
+RequestMeasurement = namedtuple('RequestMeasurement', 'name url status queries duplicates ms repeated')
+
+
+def count_duplicates(queries: list) -> Counter:
+    """
+    Return signatures of queries executed more than once, with the number of their executions.
+    """
+    signatures = Counter(get_signature(query['sql']) for query in queries)
+    return Counter({signature: count for signature, count in signatures.items() if count > 1})
+
+
+def replay_requests(names=None, repeat: int = 1, staff_user=None) -> list:
+    """
+    Request the pages (all by default) and return RequestMeasurements. Queries are counted in the last call,
+    the wall time is the median of `repeat` calls. Every page is requested once more before that, so the numbers
+    don't depend on indexes loaded by the process. Staff requests are skipped without a staff user.
+    """
+    anonymous = Client()
+    staff = Client()
+    if staff_user is not None:
+        staff.force_login(staff_user)
+
+    measurements = []
+    for name in names or REQUESTS:
+        url, is_staff = REQUESTS[name]
+        if is_staff and staff_user is None:
+            continue
+        client = staff if is_staff else anonymous
+        url = url(client) if callable(url) else url
+        durations = []
+        client.get(url)
+        for _i in range(repeat):
+            # The log of queries is limited, a full one wouldn't grow anymore
+            connection.queries_log.clear()
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = client.get(url)
+                durations.append((time.perf_counter() - start) * 1000)
+        duplicates = count_duplicates(context.captured_queries)
+        measurements.append(RequestMeasurement(
+            name, url, response.status_code, len(context.captured_queries),
+            sum(duplicates.values()) - len(duplicates), float(np.median(durations)), duplicates.most_common(3)
+        ))
+    return measurements
+
+
+def load_budgets(path: str = BUDGETS_FILE) -> dict:
+    with open(path) as budgets_file:
+        return json.load(budgets_file)
+
+
+def save_budgets(measurements: list, path: str = BUDGETS_FILE):
+    """
+    Store the measurements as the new budgets. Time budgets are rounded up to tens of milliseconds.
+    """
+    budgets = {measurement.name: {'queries': measurement.queries, 'duplicates': measurement.duplicates,
+                                  'ms': int(-(-measurement.ms // 10) * 10)}
+               for measurement in measurements}
+    with open(path, 'w') as budgets_file:
+        json.dump(budgets, budgets_file, indent=2, sort_keys=True)
+        budgets_file.write('\n')
+
+
+def check_budgets(measurements: list, budgets: dict, timings: bool = True) -> list:
+    """
+    Return descriptions of budgets exceeded by the measurements. Requests without a budget exceed it.
+    """
+    violations = []
+    for measurement in measurements:
+        budget = budgets.get(measurement.name)
+        if budget is None:
+            violations.append("{}: no budget".format(measurement.name))
+            continue
+        if measurement.status != 200:
+            violations.append("{}: status {}".format(measurement.name, measurement.status))
+        if measurement.queries > budget['queries']:
+            violations.append("{}: {} queries, budget {}".format(measurement.name, measurement.queries,
+                                                                budget['queries']))
+        if measurement.duplicates > budget['duplicates']:
+            violations.append("{}: {} repeated queries, budget {}. Most repeated: {}".format(
+                measurement.name, measurement.duplicates, budget['duplicates'],
+                "; ".join("{}x {}".format(count, signature[:200]) for signature, count in measurement.repeated)
+            ))
+        if timings and measurement.ms > budget['ms'] * TIME_TOLERANCE:
+            violations.append("{}: {:.0f} ms, budget {} ms".format(measurement.name, measurement.ms, budget['ms']))
+    return violations
+
+
+def format_request_measurements(measurements: list, budgets: dict) -> str:
+    """
+    Return a plain text table of measurements next to their budgets.
+    """
+    lines = ["{:<14} {:>6} {:>13} {:>13} {:>15}".format('request', 'status', 'queries', 'repeated', 'ms')]
+    for measurement in measurements:
+        budget = budgets.get(measurement.name, {})
+        lines.append("{:<14} {:>6} {:>6}/{:<6} {:>6}/{:<6} {:>7.1f}/{:<7}".format(
+            measurement.name, measurement.status, measurement.queries, budget.get('queries', '-'),
+            measurement.duplicates, budget.get('duplicates', '-'), measurement.ms, budget.get('ms', '-')
+        ))
+    return "\n".join(lines)
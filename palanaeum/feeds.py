@@ -3,13 +3,32 @@ from django.core.exceptions import PermissionDenied
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from django.utils.feedgenerator import Enclosure
+from django.utils.translation import gettext as _
 
 from palanaeum.configuration import get_config
+from palanaeum.fragments import FEED_TEMPLATE, render_entries
+from palanaeum.middleware import get_request
 from palanaeum.models import Entry, Event
+from palanaeum.read_models import load_entries
 
 class EntryFeed(Feed):
-    title_template = "palanaeum/feeds/entry_title.html"
-    description_template = "palanaeum/feeds/entry_description.html"
+    """
+    Feed of entries (EntryData). Titles and descriptions are made of the loaded data, without
+    any queries per entry.
+    """
+    def item_title(self, entry):
+        title_attributes = []
+        if entry.paraphrased:
+            title_attributes.append(_('paraphrased'))
+        if entry.snippet_count > 0:
+            title_attributes.append(_('contains snippet'))
+        title = '[{}] Entry #{}'.format(entry.event.name, entry.id)
+        if title_attributes:
+            title += ' ({})'.format(', '.join(title_attributes))
+        return title
+
+    def item_description(self, entry):
+        return entry.fragment
 
     def item_pubdate(self, entry):
         return entry.created
@@ -17,19 +36,6 @@ class EntryFeed(Feed):
     def item_updateddate(self, entry):
         return entry.modified
 
-    def get_context_data(self, **kwargs):
-        entry = kwargs.get('item')
-        contains_snippet = entry.snippets.filter(is_visible=True).exists()
-        title_attributes = []
-        if entry.paraphrased:
-            title_attributes.append('paraphrased')
-        if contains_snippet:
-            title_attributes.append('contains snippet')
-        return {
-            'entry': entry,
-            'title_attributes': title_attributes
-        }
-
 
 class RecentEntriesFeed(EntryFeed):
     title = "%s - Recent Entries" % get_config('page_title')
@@ -37,18 +43,17 @@ class RecentEntriesFeed(EntryFeed):
 
     def items(self):
         entry_ids = Entry.all_visible.order_by('-created').values_list('id', flat=True)[:10]
-        entries_map = Entry.prefetch_entries(entry_ids, show_unapproved=False)
-        return [
+        entries_map = load_entries(entry_ids, show_unapproved=False)
+        entries = [
             entry
-            for entry in (entries_map[entry_id] for entry_id in entry_ids)
-            if entry.last_version is not None
+            for entry in (entries_map[entry_id] for entry_id in entry_ids if entry_id in entries_map)
+            if entry.version_id is not None
         ]
+        render_entries(entries, get_request(), FEED_TEMPLATE)
+        return entries
 
 
 class EventEntriesFeed(EntryFeed):
-    title_template = "palanaeum/feeds/entry_title.html"
-    description_template = "palanaeum/feeds/entry_description.html"
-
     def get_object(self, request, event_id):
         event = get_object_or_404(Event, pk=event_id)
 
@@ -65,12 +70,14 @@ class EventEntriesFeed(EntryFeed):
 
     def items(self, event):
         entry_ids = Entry.all_visible.filter(event=event).values_list('id', flat=True)
-        entries_map = Entry.prefetch_entries(entry_ids, show_unapproved=False)
-        return sorted(
+        entries_map = load_entries(entry_ids, show_unapproved=False, events={event.id: event})
+        entries = sorted(
             (
                 entry
-                for entry in (entries_map[entry_id] for entry_id in entry_ids)
-                if entry.last_version is not None
+                for entry in (entries_map[entry_id] for entry_id in entry_ids if entry_id in entries_map)
+                if entry.version_id is not None
             ),
             key=lambda e: e.order
         )
+        render_entries(entries, get_request(), FEED_TEMPLATE)
+        return entries
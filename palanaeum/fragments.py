@@ -0,0 +1,82 @@
+"""
+Cache of rendered entries.
+
+Entries look the same on the event page, in search results, recent entries, collections and feeds,
+apart from the header with their number and options for the user. The rest of the entry (sources, lines
+and footer) is rendered once and cached for every viewer class: anonymous users, contributors
+and staff members see different sources.
+
+Keys contain everything the fragment depends on: the current version (its id and date, which changes with every
+edit), the sources version of the entry (see Entry.update_source_flags), the review state of the event,
+the viewer class and the language. Edits, approvals, visibility toggles and linking of sources make new keys,
+old fragments expire.
+"""
+from django.core.cache import caches
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
+
+FRAGMENTS_CACHE = caches['fragments']
+FRAGMENTS_CACHE_TTL = 7 * 24 * 60 * 60
+
+BODY_TEMPLATE = 'palanaeum/elements/entry_body.html'
+FEED_TEMPLATE = 'palanaeum/feeds/entry_description.html'
+TEMPLATE_NAMES = {BODY_TEMPLATE: 'body', FEED_TEMPLATE: 'feed'}
+
+
+def get_viewer_class(request) -> str:
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return 'anonymous'
+    if user.is_staff:
+        return 'staff'
+    return 'contributor'
+
+
+def has_private_sources(entry) -> bool:
+    """
+    Check if the entry (EntryData) has unapproved sources, which contributors see only if they've added them.
+    """
+    return not all(source.is_approved for source in entry.snippets + entry.image_sources)
+
+
+def get_fragment_key(entry, template_name: str, viewer_class: str):
+    """
+    Return the cache key of the rendered entry (EntryData), None if it can't be cached.
+    """
+    if entry.version_id is None:
+        return None
+    # Contributors see unapproved sources they've added, those entries are rendered for every user
+    if viewer_class == 'contributor' and has_private_sources(entry):
+        return None
+    return 'entry_{}_{}_{}_{}_{}_{}_{}_{}'.format(
+        TEMPLATE_NAMES[template_name], entry.id, entry.version_id, int(entry.version_date.timestamp() * 1000),
+        entry.sources_version, getattr(entry.event, 'review_state', ''), viewer_class, get_language()
+    )
+
+
+def render_entries(entries, request, template_name: str = BODY_TEMPLATE):
+    """
+    Set the `fragment` of entries (EntryData) to their rendered HTML. Cached fragments are fetched
+    with a single cache call, missing ones are rendered and stored with another.
+    """
+    viewer_class = get_viewer_class(request)
+    keys = {}
+    for entry in entries:
+        key = get_fragment_key(entry, template_name, viewer_class)
+        if key is not None:
+            keys[entry.id] = key
+    cached = FRAGMENTS_CACHE.get_many(keys.values()) if keys else {}
+
+    template = get_template(template_name)
+    rendered = {}
+    for entry in entries:
+        key = keys.get(entry.id)
+        if key in cached:
+            entry.fragment = mark_safe(cached[key])
+            continue
+        entry.fragment = template.render({'entry': entry})
+        if key is not None:
+            rendered[key] = str(entry.fragment)
+    if rendered:
+        FRAGMENTS_CACHE.set_many(rendered, FRAGMENTS_CACHE_TTL)
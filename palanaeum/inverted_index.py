@@ -0,0 +1,440 @@
+"""
+Inverted index of the current versions of entries, stored in files mapped into memory.
+
+The build_inverted_index command exports lexemes of the search vectors, speakers and tags of entries
+into NumPy arrays: for every field a sorted array of terms, offsets of their postings, and postings
+(entry ids) with weights. All worker processes map the same files, so the pages are shared and
+nothing is copied when the index is loaded. Changes made after the build are read from the
+TagIndexChange log and kept in a small in-memory overlay, that takes precedence over the files.
+
+The index is used by search filters instead of the database when SEARCH_BACKEND setting is
+'inverted_index'. Without a fresh build the filters fall back to the database.
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from palanaeum.scoring import ScoredEntries
+from palanaeum.tag_index import ChangeLogIndex, LAST_CHANGE_SQL, TAG_INDEX_MAX_AGE, VARIANTS
+
+logger = logging.getLogger('palanaeum.inverted_index')
+
+BACKEND_NAME = 'inverted_index'
+CURRENT_LINK = 'current'
+# Longer lexemes (like URLs) are not indexed
+MAX_TERM_LENGTH = 64
+# How often processes look for new changes in the log
+REFRESH_INTERVAL = 1
+# The log is cleaned after that many seconds, older builds would miss some changes
+MAX_BUILD_AGE = 2 * TAG_INDEX_MAX_AGE
+WORD_REGEXP = re.compile(r'\w+')
+
+# Weights of lexemes in the search vectors, like the defaults of ts_rank
+WEIGHTS_SQL = "CASE w WHEN 'A' THEN 1.0 WHEN 'B' THEN 0.4 WHEN 'C' THEN 0.2 ELSE 0.1 END"
+FIELDS_SQL = {
+    'text': """\
+        SELECT esv.entry_id, u.lexeme, SUM({weights})
+        FROM palanaeum_entrysearchvector esv
+        CROSS JOIN LATERAL unnest(esv.text_vector) u
+        CROSS JOIN LATERAL unnest(COALESCE(u.weights, '{{D}}')) w
+        WHERE {where}
+        GROUP BY esv.entry_id, u.lexeme
+        """,
+    'speakers': """\
+        SELECT es.entry_id, u.lexeme, 1.0
+        FROM palanaeum_entryspeaker es
+        JOIN palanaeum_speaker s ON s.id = es.speaker_id
+        CROSS JOIN LATERAL unnest(to_tsvector('english', s.name || ' ' || array_to_string(s.aliases, ' '))) u
+        WHERE es.{variant} AND {where}
+        GROUP BY es.entry_id, u.lexeme
+        """,
+    'tags': """\
+        SELECT e.id, evt.tag_id::text, 1.0
+        FROM palanaeum_entry e
+        JOIN palanaeum_entryversion_tags evt ON evt.entryversion_id = e.{pointer}
+        WHERE {where}
+        """,
+}
+ENTRY_COLUMNS = {'text': 'esv.entry_id', 'speakers': 'es.entry_id', 'tags': 'e.id'}
+DOCS_SQL = "SELECT id, searchable FROM palanaeum_entry WHERE {where}"
+# Surface forms of words found in entries, with the lexemes they're turned into
+FORMS_SQL = """\
+    SELECT word, COALESCE((SELECT MIN(lexeme) FROM unnest(to_tsvector('english', word))), '')
+    FROM (
+        SELECT DISTINCT lower(word) AS word
+        FROM palanaeum_entrysearchvector esv
+        CROSS JOIN LATERAL regexp_split_to_table(esv.text || ' ' || esv.speakers, '\\W+') AS word
+        WHERE octet_length(word) BETWEEN 1 AND {max_length}
+    ) words
+    """.format(max_length=MAX_TERM_LENGTH)
+
+
+def get_field_names() -> list:
+    """
+    Return names of all fields of the index. Fields depending on the version are stored for every variant.
+    """
+    return ['text'] + ['{}_{}'.format(field, variant) for field in ('speakers', 'tags') for variant in VARIANTS]
+
+
+def fetch_field(name: str, entries_ids=None) -> list:
+    """
+    Return (entry_id, term, weight) rows of the field, for all or for given entries.
+    """
+    field, _, variant = name.partition('_')
+    where, params = ("True", []) if entries_ids is None else ("{} = ANY(%s)".format(ENTRY_COLUMNS[field]),
+                                                               [list(entries_ids)])
+    sql = FIELDS_SQL[field].format(weights=WEIGHTS_SQL, variant=variant, pointer=VARIANTS.get(variant), where=where)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row for row in cursor.fetchall() if len(row[1].encode()) <= MAX_TERM_LENGTH]
+
+
+def fetch_docs(entries_ids=None) -> list:
+    """
+    Return (entry_id, searchable) rows of all or of given entries.
+    """
+    where, params = ("True", []) if entries_ids is None else ("id = ANY(%s)", [list(entries_ids)])
+    with connection.cursor() as cursor:
+        cursor.execute(DOCS_SQL.format(where=where), params)
+        return cursor.fetchall()
+
+
+def _save(path: str, name: str, array: np.ndarray):
+    np.save(os.path.join(path, name + '.npy'), array, allow_pickle=False)
+
+
+def _save_field(path: str, name: str, rows: list):
+    """
+    Save postings of the field, sorted by terms and entry ids.
+    """
+    if rows:
+        entries_ids, terms, weights = zip(*rows)
+    else:
+        entries_ids, terms, weights = (), (), ()
+    unique_terms, term_numbers = np.unique(np.array([term.encode() for term in terms], dtype=bytes),
+                                           return_inverse=True)
+    entries_ids = np.array(entries_ids, dtype=np.int32)
+    order = np.lexsort((entries_ids, term_numbers))
+    offsets = np.zeros(len(unique_terms) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_numbers, minlength=len(unique_terms)), out=offsets[1:])
+
+    _save(path, name + '.terms', unique_terms.astype('S{}'.format(max(MAX_TERM_LENGTH, 1))))
+    _save(path, name + '.offsets', offsets)
+    _save(path, name + '.postings', entries_ids[order])
+    _save(path, name + '.weights', np.array(weights, dtype=np.float32)[order])
+
+
+def build_index(path: str = None) -> str:
+    """
+    Export the current versions of entries into a new build of the index and make it the current one.
+    Return the directory of the build.
+    """
+    path = path or settings.INVERTED_INDEX_DIR
+    os.makedirs(path, exist_ok=True)
+    with connection.cursor() as cursor:
+        # Changes logged during the export are applied again by the processes using the build
+        cursor.execute(LAST_CHANGE_SQL)
+        checked_date, last_change_id = cursor.fetchone()
+
+    name = 'build-{}'.format(int(time.time() * 1000))
+    build_path = os.path.join(path, name)
+    os.makedirs(build_path)
+    for field in get_field_names():
+        _save_field(build_path, field, fetch_field(field))
+
+    docs = np.array(sorted(fetch_docs()), dtype=np.int64).reshape(-1, 2)
+    _save(build_path, 'docs.ids', docs[:, 0].astype(np.int32))
+    _save(build_path, 'docs.searchable', docs[:, 1].astype(bool))
+
+    with connection.cursor() as cursor:
+        cursor.execute(FORMS_SQL)
+        forms = sorted(cursor.fetchall())
+    _save(build_path, 'forms.words', np.array([word.encode() for word, lexeme in forms], dtype=bytes)
+          .astype('S{}'.format(MAX_TERM_LENGTH)))
+    _save(build_path, 'forms.lexemes', np.array([lexeme.encode() for word, lexeme in forms], dtype=bytes)
+          .astype('S{}'.format(MAX_TERM_LENGTH)))
+
+    with open(os.path.join(build_path, 'meta.json'), 'w') as meta:
+        json.dump({'built': time.time(), 'checked_date': checked_date.isoformat(),
+                   'last_change_id': last_change_id}, meta)
+
+    # Switching the link is atomic, processes notice the new build at their next refresh
+    link = os.path.join(path, CURRENT_LINK)
+    temporary_link = link + '.new'
+    if os.path.lexists(temporary_link):
+        os.remove(temporary_link)
+    os.symlink(name, temporary_link)
+    os.replace(temporary_link, link)
+
+    # The previous build is kept, processes may be still loading it. Mapped files survive removal anyway.
+    builds = sorted(entry for entry in os.listdir(path) if entry.startswith('build-'))
+    for old_build in builds[:-2]:
+        shutil.rmtree(os.path.join(path, old_build), ignore_errors=True)
+    return build_path
+
+
+def get_current_build(path: str = None):
+    """
+    Return the directory of the current build, or None if the index wasn't built.
+    """
+    link = os.path.join(path or settings.INVERTED_INDEX_DIR, CURRENT_LINK)
+    try:
+        return os.path.join(os.path.dirname(link), os.readlink(link))
+    except OSError:
+        return None
+
+
+@lru_cache(maxsize=10000)
+def _stem(word: str) -> str:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT COALESCE((SELECT MIN(lexeme) FROM unnest(to_tsvector('english', %s))), '')", [word])
+        return cursor.fetchone()[0]
+
+
+class Field:
+    """
+    Postings of one field, mapped from the files of a build.
+    """
+    def __init__(self, path: str, name: str):
+        def load(part):
+            return np.load(os.path.join(path, '{}.{}.npy'.format(name, part)), mmap_mode='r')
+
+        self.terms = load('terms')
+        self.offsets = load('offsets')
+        self.postings = load('postings')
+        self.weights = load('weights')
+
+    def get_range(self, first: bytes, last: bytes) -> tuple:
+        """
+        Return entry ids and weights of postings of terms between first and last (inclusive).
+        """
+        start = np.searchsorted(self.terms, first, 'left')
+        end = np.searchsorted(self.terms, last, 'right')
+        start, end = self.offsets[start], self.offsets[end]
+        return self.postings[start:end], self.weights[start:end]
+
+
+class InvertedIndex(ChangeLogIndex):
+    """
+    A build of the index with the overlay of changes logged since the build.
+    """
+    def __init__(self):
+        super().__init__()
+        self.build = None
+        self.built = 0
+        self.fields = {}
+        self.docs_ids = None
+        self.docs_searchable = None
+        self.forms = None
+        # field -> term -> entry_id -> weight, for entries changed since the build
+        self.overlay = {}
+        self.overlay_entries = {}
+        self.overlay_searchable = {}
+        self.changed_ids = np.array([], dtype=np.int32)
+
+    def load(self, build: str = None):
+        """
+        Map the files of the build, the current one by default.
+        """
+        self.build = build or get_current_build()
+        with open(os.path.join(self.build, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        self.built = meta['built']
+        self.last_change_id = meta['last_change_id']
+        self.checked_date = datetime.fromisoformat(meta['checked_date'])
+        self.load_entries()
+        self.loaded = time.time()
+
+    def load_entries(self):
+        self.fields = {name: Field(self.build, name) for name in get_field_names()}
+        self.docs_ids = np.load(os.path.join(self.build, 'docs.ids.npy'), mmap_mode='r')
+        self.docs_searchable = np.load(os.path.join(self.build, 'docs.searchable.npy'), mmap_mode='r')
+        self.forms = (np.load(os.path.join(self.build, 'forms.words.npy'), mmap_mode='r'),
+                      np.load(os.path.join(self.build, 'forms.lexemes.npy'), mmap_mode='r'))
+        self.overlay = {name: defaultdict(dict) for name in self.fields}
+        self.overlay_entries = {name: {} for name in self.fields}
+
+    def update_entries(self, entries_ids: list):
+        for name in self.fields:
+            new_terms = defaultdict(dict)
+            for entry_id, term, weight in fetch_field(name, entries_ids):
+                new_terms[entry_id][term] = float(weight)
+
+            overlay = self.overlay[name]
+            entries = self.overlay_entries[name]
+            for entry_id in entries_ids:
+                for term in entries.pop(entry_id, ()):
+                    overlay[term].pop(entry_id, None)
+                entries[entry_id] = new_terms.get(entry_id, {})
+                for term, weight in entries[entry_id].items():
+                    overlay[term][entry_id] = weight
+
+        searchable = dict(fetch_docs(entries_ids))
+        for entry_id in entries_ids:
+            # Deleted entries are never searchable
+            self.overlay_searchable[entry_id] = searchable.get(entry_id, False)
+        self.changed_ids = np.array(sorted(self.overlay_searchable), dtype=np.int32)
+
+    def get_field(self, name: str, variant: str) -> str:
+        """
+        Return the name of the field in the variant of current versions.
+        """
+        return name if name in self.fields else '{}_{}'.format(name, variant)
+
+    def lookup(self, field: str, first: str, last: str = None) -> ScoredEntries:
+        """
+        Return entries having terms between first and last (by default just the first one) in the field,
+        with their weights summed.
+        """
+        last = first if last is None else last
+        ids, weights = self.fields[field].get_range(first.encode(), last.encode())
+        if len(self.changed_ids):
+            # Postings of changed entries come from the overlay
+            keep = ~np.isin(ids, self.changed_ids)
+            ids, weights = ids[keep], weights[keep]
+        pairs = [(entry_id, weight) for term, postings in self.overlay[field].items() if first <= term <= last
+                 for entry_id, weight in postings.items()]
+        if pairs:
+            overlay_ids, overlay_weights = zip(*pairs)
+            ids = np.concatenate([ids, overlay_ids])
+            weights = np.concatenate([weights, overlay_weights])
+        return ScoredEntries._accumulate(np.asarray(ids, dtype=np.int64), np.asarray(weights, dtype=np.float64))
+
+    def all_entries(self, searchable: bool = False) -> ScoredEntries:
+        """
+        Return all entries known to the index, or just the searchable ones.
+        """
+        ids = np.asarray(self.docs_ids)
+        if searchable:
+            ids = ids[np.asarray(self.docs_searchable)]
+        ids = ids[~np.isin(ids, self.changed_ids)]
+        changed = [entry_id for entry_id, is_searchable in self.overlay_searchable.items()
+                   if is_searchable or not searchable]
+        return ScoredEntries.from_ids(np.concatenate([ids, np.array(changed, dtype=ids.dtype)]))
+
+    def stem(self, word: str) -> str:
+        """
+        Return the lexeme of a word, like to_tsvector does. Words not found in entries are stemmed by the database.
+        """
+        word = word.lower()
+        words, lexemes = self.forms
+        encoded = word.encode()
+        position = np.searchsorted(words, encoded)
+        if position < len(words) and words[position] == encoded:
+            return lexemes[position].decode()
+        return _stem(word)
+
+    def _evaluate(self, field: str, node):
+        """
+        Return entries matching the node of a query tree, or None if the node has no terms (like stop words).
+        """
+        kind = node[0]
+        if kind == 'word':
+            lexeme = self.stem(node[1])
+            return self.lookup(field, lexeme) if lexeme else None
+        if kind == 'prefix':
+            prefix = self.stem(node[1])
+            return self.lookup(field, prefix, prefix + '\uffff') if prefix else None
+        if kind == 'phrase':
+            # Positions are not stored, phrases match entries containing all their words
+            words = [('word', word) for word in WORD_REGEXP.findall(node[1])]
+            return self._evaluate(field, ('and', words))
+        if kind == 'not':
+            matched = self._evaluate(field, node[1])
+            return None if matched is None else self.all_entries().difference(matched)
+
+        results = [result for result in (self._evaluate(field, child) for child in node[1]) if result is not None]
+        if not results:
+            return None
+        if kind == 'or':
+            return ScoredEntries.union_all(results)
+        combined = results[0]
+        for result in results[1:]:
+            combined = combined.intersection(result)
+        return combined
+
+    def search(self, field: str, query_tree, variant: str) -> ScoredEntries:
+        """
+        Return searchable entries matching the query tree, with ranks similar to ts_rank(..., 32) + 1.
+        """
+        matched = self._evaluate(self.get_field(field, variant), query_tree) if query_tree else None
+        if matched is None or not matched:
+            return ScoredEntries()
+        matched = matched.intersection(self.all_entries(searchable=True))
+        return ScoredEntries(matched.ids, matched.scores / (matched.scores + 1) + 1)
+
+    def entries_with_term(self, field: str, term: str, variant: str, score: float = 0) -> ScoredEntries:
+        """
+        Return all entries having the term in the field, with the given score.
+        """
+        entries = self.lookup(self.get_field(field, variant), term)
+        return ScoredEntries.from_ids(entries.ids, score)
+
+
+class MappedIndexHolder:
+    """
+    Holds the index of this process, switching to new builds when they appear.
+    """
+    def __init__(self):
+        self._index = None
+        self._refreshed = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Return the index up to date with the changes logged so far, or None if there is no usable build.
+        """
+        with self._lock:
+            build = get_current_build()
+            if build is None:
+                self._index = None
+                return None
+            if self._index is None or self._index.build != build:
+                start = time.time()
+                index = InvertedIndex()
+                index.load(build)
+                logger.info("Inverted index %s mapped in %.3f s.", build, time.time() - start)
+                self._index = index
+                self._refreshed = 0
+            if time.time() - self._index.built > MAX_BUILD_AGE:
+                logger.warning("Inverted index %s is too old to be used.", build)
+                return None
+            if time.time() - self._refreshed >= REFRESH_INTERVAL:
+                self._index.refresh()
+                self._refreshed = time.time()
+            return self._index
+
+    def reset(self):
+        with self._lock:
+            self._index = None
+
+
+_inverted_index = MappedIndexHolder()
+
+
+def is_enabled() -> bool:
+    return getattr(settings, 'SEARCH_BACKEND', 'postgres') == BACKEND_NAME
+
+
+def get_inverted_index():
+    """
+    Return the inverted index of this process if it's enabled and built, None otherwise.
+    """
+    if not is_enabled():
+        return None
+    return _inverted_index.get()
+
+
+def reset_inverted_index():
+    _inverted_index.reset()
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from palanaeum.models import Entry
+
+
+class Command(BaseCommand):
+    help = 'Recalculate newest version pointers of all entries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of entries updated in a single query.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = Entry.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        updated = 0
+
+        for start in range(0, last_id + 1, batch_size):
+            updated += Entry.update_all_version_pointers(
+                Entry.objects.filter(id__gte=start, id__lt=start + batch_size)
+            )
+            self.stdout.write("\r{:4.2%}".format(min(start + batch_size, last_id) / max(last_id, 1)), ending='')
+
+        self.stdout.write("\rVersion pointers of {} entries updated.".format(updated))
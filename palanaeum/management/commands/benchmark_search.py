@@ -0,0 +1,26 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from palanaeum.benchmark import SCENARIOS, SEARCHES, format_measurements, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Measure latency and number of queries of search on the current database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Number of measured calls of every case.')
+        parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                            help='Measure only this scenario, can be repeated.')
+        parser.add_argument('--search', action='append', choices=sorted(SEARCHES),
+                            help='Measure only this search, can be repeated.')
+        parser.add_argument('--warm', action='store_true', help="Don't invalidate cached results between calls.")
+        parser.add_argument('--json', help='Write the measurements to this file too.')
+
+    def handle(self, *args, **options):
+        measurements = run_benchmarks(options['repeat'], options['scenario'], options['search'],
+                                      cold=not options['warm'])
+        self.stdout.write(format_measurements(measurements))
+        if options['json']:
+            with open(options['json'], 'w') as output:
+                json.dump([measurement._asdict() for measurement in measurements], output, indent=2)
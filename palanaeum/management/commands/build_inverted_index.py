@@ -0,0 +1,21 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from palanaeum.inverted_index import build_index
+
+
+class Command(BaseCommand):
+    help = 'Export the search index into files mapped by the inverted_index search backend.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=None,
+                            help='Directory of the index, INVERTED_INDEX_DIR setting by default.')
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        build_path = build_index(options['path'])
+        size = sum(os.path.getsize(os.path.join(build_path, name)) for name in os.listdir(build_path))
+        self.stdout.write("Inverted index built in {:.1f} s: {} ({:.1f} MB)."
+                          .format(time.time() - start_time, build_path, size / 1024 / 1024))
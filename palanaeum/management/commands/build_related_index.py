@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from palanaeum.models import Entry
+from palanaeum.related import update_signatures
+from palanaeum.search import bump_search_generation
+
+
+class Command(BaseCommand):
+    help = 'Calculate similarity signatures of all entries, used to show related entries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of entries processed at once.')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        entries_ids = list(Entry.objects.order_by('id').values_list('id', flat=True))
+        start_time = time.time()
+        built = 0
+
+        for start in range(0, len(entries_ids), chunk_size):
+            with transaction.atomic():
+                built += update_signatures(entries_ids[start:start + chunk_size])
+            self.stdout.write("\r{:4.2%}".format(min(start + chunk_size, len(entries_ids)) / len(entries_ids)),
+                              ending='')
+
+        bump_search_generation()
+        self.stdout.write("\rSignatures of {} entries calculated in {:.1f} s."
+                          .format(built, time.time() - start_time))
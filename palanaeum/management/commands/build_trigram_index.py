@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, DatabaseError
+
+from palanaeum.models import EntrySearchVector
+
+INDEXES = {
+    'palanaeum_esv_text_trgm': 'text',
+    'palanaeum_esv_speakers_trgm': 'speakers',
+}
+
+
+class Command(BaseCommand):
+    help = 'Install the pg_trgm extension and build trigram indexes used by exact and fuzzy text search.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drop', action='store_true', help='Remove the trigram indexes instead.')
+
+    def handle(self, *args, **options):
+        table = EntrySearchVector._meta.db_table
+
+        with connection.cursor() as cursor:
+            if options['drop']:
+                for name in INDEXES:
+                    cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS {}".format(name))
+                self.stdout.write("Trigram indexes removed.")
+                return
+
+            try:
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            except DatabaseError as e:
+                raise CommandError("Couldn't install the pg_trgm extension: {}".format(e))
+
+            for name, column in INDEXES.items():
+                self.stdout.write("Building index {}...".format(name))
+                # Concurrent build doesn't block the search index updates
+                cursor.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} USING gin ({} gin_trgm_ops)"
+                               .format(name, table, column))
+
+        self.stdout.write("Trigram indexes built.")
@@ -0,0 +1,49 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from palanaeum.benchmark import generate_archive
+from palanaeum.budgets import BUDGET_DATASET, REQUESTS, check_budgets, format_request_measurements, \
+    load_budgets, replay_requests
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Replay requests of the main pages and compare their queries and latency with the checked in budgets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', action='store_true',
+                            help='Measure on the synthetic dataset of the budgets, created in a transaction '
+                                 'that is rolled back afterwards. Numbers match the budgets on an empty database.')
+        parser.add_argument('--staff-user', help='Username of a staff member used by staff requests.')
+        parser.add_argument('--request', action='append', choices=sorted(REQUESTS),
+                            help='Replay only this request, can be repeated.')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of timed calls of every request.')
+        parser.add_argument('--no-timings', action='store_true', help='Check only the numbers of queries.')
+
+    def handle(self, *args, **options):
+        if options['synthetic']:
+            try:
+                with transaction.atomic():
+                    generate_archive(**BUDGET_DATASET)
+                    staff_user = User.objects.create(username='budgets_staff', is_staff=True, is_superuser=True)
+                    measurements = self.replay(options, staff_user)
+                    raise Rollback()
+            except Rollback:
+                pass
+        else:
+            staff_user = User.objects.get(username=options['staff_user']) if options['staff_user'] else None
+            measurements = self.replay(options, staff_user)
+
+        budgets = load_budgets()
+        self.stdout.write(format_request_measurements(measurements, budgets))
+        violations = check_budgets(measurements, budgets, timings=not options['no_timings'])
+        if violations:
+            raise CommandError("Budgets exceeded:\n" + "\n".join(violations))
+
+    @staticmethod
+    def replay(options: dict, staff_user) -> list:
+        return replay_requests(options['request'], options['repeat'], staff_user)
@@ -71,3 +71,4 @@ for entry in entries:
     version.note = footnote.text
     footnote.delete()
     version.save()
+    entry.update_version_pointers()
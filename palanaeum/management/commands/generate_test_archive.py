@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from palanaeum.benchmark import clear_archive, generate_archive
+
+
+class Command(BaseCommand):
+    help = 'Create a synthetic archive of events and entries for search benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--entries', type=int, default=10000, help='Number of created entries.')
+        parser.add_argument('--entries-per-event', type=int, default=50)
+        parser.add_argument('--versions', type=float, default=1.5, help='Average number of versions of an entry.')
+        parser.add_argument('--lines', type=float, default=4, help='Average number of lines of a version.')
+        parser.add_argument('--tags', type=int, default=300, help='Number of used tags.')
+        parser.add_argument('--url-share', type=float, default=0.2, help='Share of entries with URL sources.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of entries created in a single transaction.')
+        parser.add_argument('--clear', action='store_true', help='Delete the synthetic archive instead.')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            self.stdout.write("{} entries deleted.".format(clear_archive()))
+            return
+
+        total = options['entries']
+        start_time = time.time()
+
+        def report_progress(created):
+            elapsed = max(time.time() - start_time, 0.001)
+            self.stdout.write("\r{:4.2%} {:.0f} entries/s".format(created / total, created / elapsed), ending='')
+
+        created = generate_archive(
+            total, batch_size=options['batch_size'], progress=report_progress, seed=options['seed'],
+            entries_per_event=options['entries_per_event'], versions=options['versions'], lines=options['lines'],
+            tags=options['tags'], url_share=options['url_share']
+        )
+        self.stdout.write("\r{} entries created in {:.1f} s.".format(created, time.time() - start_time))
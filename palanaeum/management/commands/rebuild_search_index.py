@@ -1,20 +1,88 @@
+import time
+from multiprocessing import Pool
+
 from django.core.management.base import BaseCommand
+from django.db import connection, connections, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
 
 from palanaeum.models import EntrySearchVector, Entry
+from palanaeum.search import bump_search_generation
+
+SHADOW_TABLE = 'palanaeum_entrysearchvector_shadow'
+
+
+def build_chunk(bounds: tuple) -> int:
+    """
+    Calculate search vectors of entries with ids in the [start, end) range into the shadow table.
+    """
+    start, end = bounds
+    sql = "INSERT INTO {} (entry_id, text_vector, speaker_vector, text, speakers) {}".format(
+        SHADOW_TABLE, EntrySearchVector.VECTORS_SQL.format(
+            pointer='newest_version_id', where='e.id >= %s AND e.id < %s')
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [start, end])
+        return cursor.rowcount
 
 
 class Command(BaseCommand):
-    help = 'Recreate the whole search index.'
+    help = 'Recalculate the whole search index and merge the changed vectors into it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of entry ids processed in a single query.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of processes building the index in parallel.')
 
     def handle(self, *args, **options):
-        entries_count = Entry.objects.count()
+        chunk_size = options['chunk_size']
+        last_id = Entry.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        chunks = [(start, start + chunk_size) for start in range(0, last_id + 1, chunk_size)]
+        start_time = time.time()
+        started = timezone.now()
+
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS {}".format(SHADOW_TABLE))
+            cursor.execute("CREATE UNLOGGED TABLE {} (entry_id integer PRIMARY KEY, text_vector tsvector NOT NULL, "
+                           "speaker_vector tsvector NOT NULL, text text NOT NULL, speakers text NOT NULL)"
+                           .format(SHADOW_TABLE))
+
+        built = 0
+        if options['workers'] > 1:
+            # Worker processes have to open their own database connections
+            connections.close_all()
+            with Pool(options['workers']) as pool:
+                for i, count in enumerate(pool.imap_unordered(build_chunk, chunks)):
+                    built += count
+                    self.report_progress(i + 1, len(chunks), built, start_time)
+        else:
+            for i, chunk in enumerate(chunks):
+                built += build_chunk(chunk)
+                self.report_progress(i + 1, len(chunks), built, start_time)
 
-        EntrySearchVector.objects.all().delete()
+        # The shadow table is merged into the index rather than swapped in, which keeps the indexes of the vector
+        # table intact. Only the changed rows are written and readers see the old vectors until the commit.
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("DELETE FROM {0} WHERE entry_id <= %s AND "
+                           "NOT EXISTS (SELECT 1 FROM {1} WHERE {1}.entry_id = {0}.entry_id)"
+                           .format(EntrySearchVector._meta.db_table, SHADOW_TABLE), [last_id])
+            cursor.execute(EntrySearchVector.UPSERT_SQL.format(
+                table=EntrySearchVector._meta.db_table,
+                vectors="SELECT entry_id, text_vector, speaker_vector, text, speakers FROM {}".format(SHADOW_TABLE)
+            ))
+            changed = cursor.rowcount
+            cursor.execute("DROP TABLE {}".format(SHADOW_TABLE))
+            # Entries edited during the rebuild may have been built from their old versions
+            EntrySearchVector.update_entries(Entry.objects.filter(
+                Q(modified__gte=started) | Q(newest_version__date__gte=started)
+            ).values_list('id', flat=True))
+            bump_search_generation()
 
-        for i, entry in enumerate(Entry.objects.all()):
-            esv = EntrySearchVector(entry=entry)
-            esv.update()
-            if i % 10 == 0:
-                self.stdout.write("\r{:4.2%}".format(i/entries_count), ending='')
+        elapsed = time.time() - start_time
+        self.stdout.write("\rSearch index rebuilt: {} entries in {:.1f} s ({:.0f} entries/s), {} vectors changed."
+                          .format(built, elapsed, built / max(elapsed, 0.001), changed))
 
-        self.stdout.write("\rSearch index rebuilt.")
+    def report_progress(self, done: int, total: int, built: int, start_time: float):
+        elapsed = max(time.time() - start_time, 0.001)
+        self.stdout.write("\r{:4.2%} {:.0f} entries/s".format(done / total, built / elapsed), ending='')
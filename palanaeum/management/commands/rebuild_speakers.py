@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from palanaeum.models import Speaker
+from palanaeum.search import bump_search_generation
+
+
+class Command(BaseCommand):
+    help = 'Recalculate speakers of all entries and their counts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of entries updated at once.')
+
+    def handle(self, *args, **options):
+        Speaker.rebuild(options['batch_size'],
+                        progress=lambda done: self.stdout.write("\r{:4.2%}".format(done), ending=''))
+
+        bump_search_generation()
+        self.stdout.write("\r{} speakers found.".format(Speaker.objects.count()))
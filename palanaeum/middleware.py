@@ -1,9 +1,13 @@
 # coding=utf-8
+import random
 import threading
 
 import pytz
+from django.conf import settings as django_settings
 from django.utils import timezone
 
+from palanaeum import profiling
+
 _GLOBAL_REQUEST_BOX = threading.local()
 
 
@@ -45,6 +49,24 @@ class GlobalRequestKeeper:
         return self.get_response(request)
 
 
+class ProfilingMiddleware:
+    """
+    Profile a sample of requests (see palanaeum.profiling). Staff members can get a sampling profiler
+    summary of any request by adding ?profile=1 to its URL.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.GET.get('profile') == '1' and request.user.is_staff:
+            return profiling.profile_with_sampling(request, self.get_response)
+        sample_rate = getattr(django_settings, 'PROFILING_SAMPLE_RATE', 0)
+        if sample_rate and random.random() < sample_rate:
+            return profiling.profile_request(request, self.get_response)
+        return self.get_response(request)
+
+
 def get_request():
     global _GLOBAL_REQUEST_BOX
     return getattr(_GLOBAL_REQUEST_BOX, 'request', None)
@@ -0,0 +1,37 @@
+# Generated by Django 6.0.4 on 2026-10-18 06:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_version_pointers(apps, schema_editor):
+    Entry = apps.get_model('palanaeum', 'Entry')
+    EntryVersion = apps.get_model('palanaeum', 'EntryVersion')
+
+    versions = EntryVersion.objects.filter(entry_id=OuterRef('id')).order_by('-date', 'id')
+    Entry.objects.update(
+        newest_version=Subquery(versions.values('id')[:1]),
+        newest_approved_version=Subquery(versions.filter(is_approved=True).values('id')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('palanaeum', '0019_navbar_dropdowns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entry',
+            name='newest_approved_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='palanaeum.entryversion'),
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='newest_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='palanaeum.entryversion'),
+        ),
+        migrations.RunPython(backfill_version_pointers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.4 on 2026-10-18 07:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('palanaeum', '0020_entry_version_pointers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndexUpdate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queued_date', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('entry', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='palanaeum.entry')),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0.4 on 2026-10-18 07:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('palanaeum', '0021_search_index_update'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entrysearchvector',
+            name='speakers',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='entrysearchvector',
+            name='text',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE palanaeum_entrysearchvector esv
+            SET text = coalesce(lines.texts, ''), speakers = coalesce(lines.speakers, '')
+            FROM palanaeum_entry e
+            LEFT JOIN LATERAL (
+                SELECT string_agg(regexp_replace(l.text, '<[^>]*>', ' ', 'g'), ' ' ORDER BY l."order") AS texts,
+                    string_agg(regexp_replace(l.speaker, '<[^>]*>', ' ', 'g'), ' ' ORDER BY l."order") AS speakers
+                FROM palanaeum_entryline l
+                WHERE l.entry_version_id = e.newest_version_id
+            ) lines ON True
+            WHERE e.id = esv.entry_id
+            """,
+            migrations.RunSQL.noop
+        ),
+    ]
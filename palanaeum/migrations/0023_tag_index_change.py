@@ -0,0 +1,22 @@
+# Generated by Django 6.0.4 on 2026-10-18 07:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('palanaeum', '0022_search_vector_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagIndexChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_id', models.IntegerField()),
+                ('date', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
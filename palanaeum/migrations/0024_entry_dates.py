@@ -0,0 +1,32 @@
+# Generated by Django 6.0.4 on 2026-10-18 07:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('palanaeum', '0023_tag_index_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entry',
+            name='newest_approved_entry_date',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='newest_entry_date',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE palanaeum_entry e
+            SET newest_entry_date = (SELECT entry_date FROM palanaeum_entryversion WHERE id = e.newest_version_id),
+                newest_approved_entry_date = (SELECT entry_date FROM palanaeum_entryversion
+                                              WHERE id = e.newest_approved_version_id)
+            """,
+            migrations.RunSQL.noop
+        ),
+    ]
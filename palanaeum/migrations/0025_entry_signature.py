@@ -0,0 +1,28 @@
+# Generated by Django 6.0.4 on 2026-10-18 07:33
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('palanaeum', '0024_entry_dates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntrySignature',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('signature', models.BinaryField()),
+                ('bands', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), size=None)),
+                ('entry', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='palanaeum.entry')),
+            ],
+            options={
+                'indexes': [django.contrib.postgres.indexes.GinIndex(fields=['bands'], name='palanaeum_e_bands_7552d7_gin')],
+            },
+        ),
+    ]
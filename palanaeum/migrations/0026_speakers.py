@@ -0,0 +1,67 @@
+# Generated by Django 6.0.4 on 2026-10-18 07:39
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_speakers(apps, schema_editor):
+    # Speakers are found with the same code as the rebuild_speakers command uses. It reads only columns
+    # present at this point, so current models work with the schema of this migration.
+    from palanaeum.models import Speaker
+    from palanaeum.search import bump_search_generation
+
+    Speaker.rebuild()
+    bump_search_generation()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('palanaeum', '0025_entry_signature'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Speaker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=512, unique=True)),
+                ('name', models.CharField(max_length=512)),
+                ('aliases', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=512), blank=True, default=list, size=None)),
+                ('entries_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('-entries_count', 'name'),
+            },
+        ),
+        migrations.CreateModel(
+            name='EventSpeaker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entries_count', models.PositiveIntegerField(default=0)),
+                ('lines_count', models.PositiveIntegerField(default=0)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='speakers', to='palanaeum.event')),
+                ('speaker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='palanaeum.speaker')),
+            ],
+            options={
+                'unique_together': {('event', 'speaker')},
+            },
+        ),
+        migrations.CreateModel(
+            name='EntrySpeaker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=512)),
+                ('newest', models.BooleanField(default=False)),
+                ('approved', models.BooleanField(default=False)),
+                ('lines_count', models.PositiveIntegerField(default=0)),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='palanaeum.entry')),
+                ('speaker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='palanaeum.speaker')),
+            ],
+            options={
+                'unique_together': {('entry', 'speaker')},
+            },
+        ),
+        migrations.RunPython(backfill_speakers, migrations.RunPython.noop),
+    ]
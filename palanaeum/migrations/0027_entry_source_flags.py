@@ -0,0 +1,45 @@
+# Generated by Django 6.0.4 on 2026-10-18 08:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('palanaeum', '0026_speakers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entry',
+            name='has_image',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='has_snippet',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='has_url',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='snippet_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE palanaeum_entry e
+            SET has_snippet = EXISTS (SELECT 1 FROM palanaeum_snippet WHERE entry_id = e.id),
+                snippet_count = (SELECT count(*) FROM palanaeum_snippet WHERE entry_id = e.id AND is_visible),
+                has_image = EXISTS (SELECT 1 FROM palanaeum_imagesource WHERE entry_id = e.id),
+                has_url = EXISTS (SELECT 1 FROM palanaeum_urlsource_entry_versions uv
+                                  JOIN palanaeum_entryversion v ON v.id = uv.entryversion_id
+                                  WHERE v.entry_id = e.id)
+            """,
+            migrations.RunSQL.noop
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.4 on 2026-10-18 08:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('palanaeum', '0027_entry_source_flags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entry',
+            name='sources_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
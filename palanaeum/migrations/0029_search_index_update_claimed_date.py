@@ -0,0 +1,18 @@
+# Generated by Django 6.0.4 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('palanaeum', '0028_entry_sources_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchindexupdate',
+            name='claimed_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
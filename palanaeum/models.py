@@ -1,10 +1,11 @@
+import json
 import os
 import pathlib
 import re
 import subprocess
 import time
-from collections import defaultdict
-from datetime import date
+from collections import Counter, defaultdict
+from datetime import date, timedelta
 from functools import total_ordering
 from urllib.parse import urlencode
 
@@ -13,11 +14,13 @@ import django.contrib.postgres.search as pg_search
 import pytz
 from django.conf import settings
 from django.contrib.auth.models import User, AnonymousUser
+from django.contrib.postgres.fields import ArrayField
 from django.contrib.postgres.indexes import GinIndex
 from django.core.exceptions import PermissionDenied
 from django.core.files.uploadedfile import UploadedFile
-from django.db import models
-from django.db.models import Max, Count, Q
+from django.db import models, transaction, connection
+from django.db.models import Max, Min, Count, Q, F, OuterRef, Subquery, Exists
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.cache import caches
@@ -29,6 +32,8 @@ from django_extensions.db.models import TimeStampedModel
 
 from palanaeum.configuration import get_config
 from palanaeum.middleware import get_request
+from palanaeum.page_cache import bump_event_page_generation
+from palanaeum.tag_index import changes_recorded
 from palanaeum.utils import is_contributor
 
 
@@ -101,6 +106,14 @@ class ApprovedVisibleManager(VisibleManager):
         return self.generate_queryset(approved_only=True)
 
 
+def bump_search_generation():
+    """
+    Invalidate cached search results. Imported lazily, because the search module depends on models.
+    """
+    from palanaeum.search import bump_search_generation
+    bump_search_generation()
+
+
 def get_current_user():
     return getattr(get_request(), 'user', None)
 
@@ -229,6 +242,8 @@ class Tag(models.Model):
         if self.name:
             self.name = bleach.clean(self.name, tags=[], strip=True)
             super().save(force_insert, force_update, using, update_fields)
+            # New tags are suggested by the autocomplete index
+            changes_recorded()
         else:
             if self.pk:
                 self.delete()
@@ -293,6 +308,12 @@ class Taggable(models.Model):
         tags = self.tags.all()
         return ", ".join(tag.name for tag in tags)
 
+    def tags_changed(self):
+        """
+        Called after the set of tags was modified.
+        """
+        bump_search_generation()
+
     def update_tags(self, tags):
         """
         Update the list of associated tags.
@@ -306,6 +327,7 @@ class Taggable(models.Model):
             self.tags.add(tag)
         self.save()
         Tag.clean_unused()
+        self.tags_changed()
 
     def add_tag(self, tag):
         """
@@ -317,6 +339,7 @@ class Taggable(models.Model):
         self.tags.add(tag_obj)
         self.save()
         Tag.clean_unused()
+        self.tags_changed()
 
     def remove_tag(self, tag):
         """
@@ -328,6 +351,7 @@ class Taggable(models.Model):
         self.tags.remove(tag_obj)
         self.save()
         Tag.clean_unused()
+        self.tags_changed()
 
 
 @total_ordering
@@ -404,13 +428,10 @@ class Event(Taggable, Content):
         yield from URLSource.all_visible.filter(entry_versions__entry__event=self).distinct()
 
     def all_speakers(self):
-        lines = EntryLine.objects.filter(entry_version__entry__event=self)
-        speakers = defaultdict(int)
-        for line in lines:
-            speakers[line.speaker] += 1
-        speakers = [(count, speaker) for speaker, count in speakers.items()]
-        speakers.sort(reverse=True)
-        yield from (speaker[1] for speaker in speakers)
+        """
+        Yield names of speakers of this event, starting with the ones speaking the most.
+        """
+        yield from self.speakers.order_by('-lines_count', 'speaker__name').values_list('speaker__name', flat=True)
 
     def editable(self):
         request = get_request()
@@ -421,6 +442,30 @@ class Event(Taggable, Content):
     def entries_count(self):
         return Entry.all_visible.filter(event=self).count()
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._saved_visibility = (self.__dict__.get('is_visible'), self.__dict__.get('is_approved'))
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        visibility = (self.is_visible, self.is_approved)
+        bump_event_page_generation([self.id], visibility_changed=visibility != self._saved_visibility)
+        self._saved_visibility = visibility
+
+    def delete(self, using=None, keep_parents=False):
+        event_id = self.id
+        result = super().delete(using, keep_parents)
+        bump_event_page_generation([event_id], visibility_changed=True)
+        return result
+
+    def tags_changed(self):
+        super().tags_changed()
+        bump_event_page_generation([self.id])
+        # Event tags are counted by the autocomplete index
+        changes_recorded()
+        # Event tags are a part of search vectors of all its entries
+        SearchIndexUpdate.enqueue(self.entries.values_list('id', flat=True))
+
 
 class Entry(TimeStampedModel, Content):
     """
@@ -433,10 +478,30 @@ class Entry(TimeStampedModel, Content):
         verbose_name_plural = _('entries')
 
     CONTENT_TYPE = 'entry'
+    # Those fields are maintained by update_version_pointers and update_source_flags and never written by save
+    VERSION_POINTERS = ('newest_version', 'newest_approved_version', 'newest_entry_date',
+                        'newest_approved_entry_date')
+    SOURCE_FLAGS = ('has_snippet', 'snippet_count', 'has_image', 'has_url', 'sources_version')
+
     order = models.PositiveIntegerField(default=0)
     event = models.ForeignKey(Event, null=True, related_name='entries',
                               on_delete=models.PROTECT)
     searchable = models.BooleanField(default=True, db_index=True)
+    newest_version = models.ForeignKey('EntryVersion', null=True, blank=True, related_name='+',
+                                       on_delete=models.SET_NULL)
+    newest_approved_version = models.ForeignKey('EntryVersion', null=True, blank=True, related_name='+',
+                                                on_delete=models.SET_NULL)
+    # Copies of entry_date of the versions above, so date searches can use an index
+    newest_entry_date = models.DateField(null=True, blank=True, db_index=True)
+    newest_approved_entry_date = models.DateField(null=True, blank=True, db_index=True)
+    # Summary of sources maintained by update_source_flags: any linked snippet, number of visible ones,
+    # any image source and any URL source of any version
+    has_snippet = models.BooleanField(default=False)
+    snippet_count = models.PositiveIntegerField(default=0)
+    has_image = models.BooleanField(default=False)
+    has_url = models.BooleanField(default=False)
+    # Incremented by update_source_flags, so rendered entries can be cached until their sources change
+    sources_version = models.PositiveIntegerField(default=0)
 
     def __init__(self, *args, **kwargs):
         super(Entry, self).__init__(*args, **kwargs)
@@ -444,10 +509,78 @@ class Entry(TimeStampedModel, Content):
         self.prefetched_url_sources = []
         self.prefetched = False
         self.prefetched_last_version = None
+        self._saved_is_visible = self.__dict__.get('is_visible')
+        self._saved_event_id = self.__dict__.get('event_id')
 
     def save(self, **kwargs):
         self.event.modified_date = timezone.now()
+        if self.is_visible != self._saved_is_visible:
+            bump_search_generation()
+            self._saved_is_visible = self.is_visible
+        if self.pk is not None and not self._state.adding and kwargs.get('update_fields') is None:
+            # Don't overwrite version pointers updated in the meantime with stale values
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.VERSION_POINTERS
+                                       and field.name not in self.SOURCE_FLAGS]
         super(Entry, self).save(**kwargs)
+        bump_event_page_generation([self.event_id, self._saved_event_id])
+        self._saved_event_id = self.event_id
+
+    @staticmethod
+    def update_all_version_pointers(entries) -> int:
+        """
+        Point given entries to their newest version and their newest approved version.
+        Return the number of updated entries.
+        """
+        versions = EntryVersion.objects.filter(entry=OuterRef('pk')).order_by('-date', 'id')
+        approved_versions = versions.filter(is_approved=True)
+        return entries.update(
+            newest_version=Subquery(versions.values('id')[:1]),
+            newest_approved_version=Subquery(approved_versions.values('id')[:1]),
+            newest_entry_date=Subquery(versions.values('entry_date')[:1]),
+            newest_approved_entry_date=Subquery(approved_versions.values('entry_date')[:1]),
+        )
+
+    @staticmethod
+    def update_source_flags(entries) -> int:
+        """
+        Recalculate the source flags of given entries and increment their sources version. Has to be called every
+        time a linked snippet, image or URL source changes (including approval and visibility) and when URL sources
+        of a version change.
+        Return the number of updated entries.
+        """
+        bump_event_page_generation(entries.values_list('event_id', flat=True).distinct())
+        snippets = Snippet.objects.filter(entry=OuterRef('pk'))
+        visible_snippets = snippets.filter(is_visible=True).order_by().values('entry').annotate(count=Count('id'))
+        return entries.update(
+            has_snippet=Exists(snippets),
+            snippet_count=Coalesce(Subquery(visible_snippets.values('count')), 0),
+            has_image=Exists(ImageSource.objects.filter(entry=OuterRef('pk'))),
+            has_url=Exists(URLSource.objects.filter(entry_versions__entry=OuterRef('pk'))),
+            sources_version=F('sources_version') + 1,
+        )
+
+    def update_version_pointers(self):
+        """
+        Update the pointers to the newest versions of this entry, with its speakers and source flags.
+        Has to be called once a version is added (with its lines, sources and tags), removed or approved.
+        """
+        Entry.update_all_version_pointers(Entry.objects.filter(pk=self.pk))
+        # Removed versions may have had the only URL sources
+        Entry.update_source_flags(Entry.objects.filter(pk=self.pk))
+        self.refresh_from_db(fields=self.VERSION_POINTERS + self.SOURCE_FLAGS)
+        Speaker.update_entries([self.pk])
+        TagIndexChange.record([self.pk])
+        bump_search_generation()
+
+    def delete(self, using=None, keep_parents=False):
+        speakers_ids = list(EntrySpeaker.objects.filter(entry=self).values_list('speaker_id', flat=True))
+        event_id = self.event_id
+        result = super().delete(using, keep_parents)
+        Speaker.recount(speakers_ids)
+        Speaker.recount_events([event_id])
+        bump_event_page_generation([event_id])
+        return result
 
     def get_absolute_url(self):
         return reverse('view_entry', args=(self.id,))
@@ -469,7 +602,7 @@ class Entry(TimeStampedModel, Content):
         return getattr(version, value_name)
 
     def all_url_sources(self):
-        if self.prefetched and self.prefetched_url_sources:
+        if self.prefetched and self.prefetched_last_version is not None:
             return self.prefetched_url_sources
         return (self._get_opt_version_value('url_sources') or URLSource.objects.none()).distinct()
 
@@ -479,7 +612,7 @@ class Entry(TimeStampedModel, Content):
 
     @property
     def lines(self):
-        if self.prefetched and self.prefetched_lines:
+        if self.prefetched and self.prefetched_last_version is not None:
             return self.prefetched_lines
         if self.id is None:
             return []
@@ -499,14 +632,10 @@ class Entry(TimeStampedModel, Content):
 
     @property
     def direct_entry(self):
-        # FIXME: This is ugly, I know but I have to make it work for now
         if self.id is None:
             return False
-        is_direct = str(self._get_opt_version_value('direct_entry')) == 'True'
-        is_direct &= not Snippet.objects.filter(entry=self).exists()
-        is_direct &= not ImageSource.objects.filter(entry=self).exists()
-        is_direct &= not URLSource.objects.filter(entry_versions__entry=self).exists()
-        return is_direct
+        return (str(self._get_opt_version_value('direct_entry')) == 'True' and not self.has_snippet
+                and not self.has_image and not self.has_url)
 
     @property
     def reported_by(self):
@@ -542,46 +671,112 @@ class Entry(TimeStampedModel, Content):
         else:
             self.order = 0
 
+    # Everything needed to display entries besides the Entry and its Event, one JSON object per entry.
+    # Rows are converted with to_jsonb, so the keys are column names. URL sources are limited
+    # by the {url_sources_visible} condition, like URLSource.all_visible does.
+    PREFETCH_SQL = """\
+        SELECT e.id, jsonb_build_object(
+            'version', to_jsonb(v),
+            'lines', (
+                SELECT coalesce(jsonb_agg(to_jsonb(l) ORDER BY l."order"), '[]')
+                FROM palanaeum_entryline l
+                WHERE l.entry_version_id = v.id
+            ),
+            'tags', (
+                SELECT coalesce(jsonb_agg(to_jsonb(t) ORDER BY t.name), '[]')
+                FROM palanaeum_entryversion_tags vt JOIN palanaeum_tag t ON t.id = vt.tag_id
+                WHERE vt.entryversion_id = v.id
+            ),
+            'url_sources', (
+                SELECT coalesce(jsonb_agg(to_jsonb(u) ORDER BY u.id), '[]')
+                FROM palanaeum_urlsource_entry_versions uv JOIN palanaeum_urlsource u ON u.id = uv.urlsource_id
+                WHERE uv.entryversion_id = v.id AND {url_sources_visible}
+            ),
+            'snippets', (
+                SELECT coalesce(jsonb_agg(to_jsonb(s) ORDER BY s.source_id, s.beginning), '[]')
+                FROM palanaeum_snippet s
+                WHERE s.entry_id = e.id
+            ),
+            'image_sources', (
+                SELECT coalesce(jsonb_agg(to_jsonb(i) ORDER BY i.event_id, i.name, i.id), '[]')
+                FROM palanaeum_imagesource i
+                WHERE i.entry_id = e.id
+            )
+        )::text
+        FROM palanaeum_entry e
+        LEFT JOIN palanaeum_entryversion v ON v.id = e.{version_pointer}
+        WHERE e.id = ANY(%s)
+        """
+
+    @staticmethod
+    def fetch_prefetched_data(entries_ids, show_unapproved=False) -> dict:
+        """
+        Return a map: entry_id -> dict of rows (as dicts keyed by column names) related to the current version
+        of the entry, loaded by PREFETCH_SQL. The version is None if the entry has none visible.
+        """
+        user = get_current_user() or AnonymousUser()
+        if user.is_staff:
+            url_sources_visible = 'TRUE'
+        elif user.is_anonymous:
+            url_sources_visible = 'u.is_visible AND u.is_approved'
+        else:
+            url_sources_visible = 'u.is_visible'
+        sql = Entry.PREFETCH_SQL.format(
+            url_sources_visible=url_sources_visible,
+            version_pointer='newest_version_id' if show_unapproved else 'newest_approved_version_id'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [list(entries_ids)])
+            return {entry_id: json.loads(data) for entry_id, data in cursor}
+
     @staticmethod
     def prefetch_entries(entries_ids, show_unapproved=False) -> dict:
         """
         Loads a bunch of Entries in a possibly fastest way, putting data in prefetched fileds.
+        Two queries are made, no matter how many entries there are.
         Returns a map: entry_id -> entry
         """
-        entries = Entry.all_visible.filter(id__in=entries_ids).prefetch_related('event', 'snippets', 'versions',
-                                                                                'image_sources')
+        entries_map = {e.id: e for e in Entry.all_visible.filter(id__in=entries_ids).select_related('event')}
+        if not entries_map:
+            return entries_map
 
-        # Get newest versions
-        version_map = {}
-        entry_version_map = {}
-        entries_map = {e.id: e for e in entries}
+        prefetched_data = Entry.fetch_prefetched_data(entries_map, show_unapproved)
 
-        for entry in entries_map.values():
+        for entry_id, data in prefetched_data.items():
+            entry = entries_map[entry_id]
             entry.prefetched = True
+            _set_prefetched(entry, 'snippets', [_from_json(Snippet, row) for row in data['snippets']])
+            _set_prefetched(entry, 'image_sources', [_from_json(ImageSource, row) for row in data['image_sources']])
+            if data['version'] is None:
+                continue
+            version = _from_json(EntryVersion, data['version'])
+            _set_prefetched(version, 'tags', [_from_json(Tag, row) for row in data['tags']])
+            entry.prefetched_last_version = version
+            entry.prefetched_lines = [_from_json(EntryLine, row) for row in data['lines']]
+            entry.prefetched_url_sources = [_from_json(URLSource, row) for row in data['url_sources']]
 
-        if show_unapproved:
-            versions = EntryVersion.objects.filter(entry__in=entries)
-        else:
-            versions = EntryVersion.objects.filter(entry__in=entries, is_approved=True)
+        return entries_map
 
-        for version in versions.order_by('-date', 'id'):
-            if version.entry_id in entry_version_map:
-                continue
-            version_map[version.id] = version.entry_id
-            entry_version_map[version.entry_id] = version.id
-            entries_map[version.entry_id].prefetched_last_version = version
 
-        # Get lines
-        for line in EntryLine.objects.filter(entry_version__in=version_map.keys()).order_by('order'):
-            entries_map[version_map[line.entry_version_id]].prefetched_lines.append(line)
+def _from_json(model, data: dict):
+    """
+    Create a model instance from a row converted to JSON by Postgres.
+    """
+    fields = model._meta.concrete_fields
+    return model.from_db(connection.alias, [field.attname for field in fields],
+                         [field.to_python(data[field.column]) for field in fields])
 
-        # Get URL sources
-        for source in URLSource.all_visible.filter(entry_versions__id__in=version_map.keys()).distinct():
-            for version in source.entry_versions.only('id'):
-                if version.id in version_map:
-                    entries_map[version_map[version.id]].prefetched_url_sources.append(source)
 
-        return entries_map
+def _set_prefetched(instance, name: str, objects: list):
+    """
+    Store objects as the prefetched result of a related manager, the way prefetch_related does.
+    """
+    queryset = getattr(instance, name).get_queryset()
+    queryset._result_cache = objects
+    queryset._prefetch_done = True
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache[name] = queryset
 
 
 class EntrySearchVector(models.Model):
@@ -591,48 +786,158 @@ class EntrySearchVector(models.Model):
     entry = models.OneToOneField(Entry, on_delete=models.CASCADE)
     text_vector = pg_search.SearchVectorField()
     speaker_vector = pg_search.SearchVectorField()
+    # Plain text of the current version, searched with trigram indexes (see build_trigram_index command)
+    text = models.TextField(default='', blank=True)
+    speakers = models.TextField(default='', blank=True)
 
     class Meta:
         indexes = [GinIndex(fields=['text_vector']), GinIndex(fields=['speaker_vector'])]
 
+    # Calculates search vectors of the newest versions of entries matching the {where} condition.
+    # HTML tags are stripped from notes, lines and speakers, tags get weight A, lines B, notes and event tags C
+    # and speakers D. Speakers make also a separate vector. Plain text of lines and speakers is kept
+    # for trigram matching.
+    VECTORS_SQL = """\
+        SELECT e.id AS entry_id,
+            setweight(to_tsvector('english', regexp_replace(coalesce(v.note, ''), '<[^>]*>', ' ', 'g')), 'C')
+            || setweight(to_tsvector('english', coalesce(tags.names, '')), 'A')
+            || setweight(to_tsvector('english', coalesce(event_tags.names, '')), 'C')
+            || setweight(to_tsvector('english', coalesce(lines.texts, '')), 'B')
+            || setweight(to_tsvector('english', coalesce(lines.speakers, '')), 'D') AS text_vector,
+            setweight(to_tsvector('english', coalesce(lines.speakers, '')), 'A') AS speaker_vector,
+            coalesce(lines.texts, '') AS text,
+            coalesce(lines.speakers, '') AS speakers
+        FROM palanaeum_entry e
+        LEFT JOIN palanaeum_entryversion v ON v.id = e.{pointer}
+        LEFT JOIN LATERAL (
+            SELECT string_agg(regexp_replace(l.text, '<[^>]*>', ' ', 'g'), ' ' ORDER BY l."order") AS texts,
+                string_agg(regexp_replace(l.speaker, '<[^>]*>', ' ', 'g'), ' ' ORDER BY l."order") AS speakers
+            FROM palanaeum_entryline l
+            WHERE l.entry_version_id = v.id
+        ) lines ON True
+        LEFT JOIN LATERAL (
+            SELECT string_agg(t.name, ' ') AS names
+            FROM palanaeum_entryversion_tags vt JOIN palanaeum_tag t ON t.id = vt.tag_id
+            WHERE vt.entryversion_id = v.id
+        ) tags ON True
+        LEFT JOIN LATERAL (
+            SELECT string_agg(t.name, ' ') AS names
+            FROM palanaeum_event_tags et JOIN palanaeum_tag t ON t.id = et.tag_id
+            WHERE et.event_id = e.event_id
+        ) event_tags ON True
+        WHERE {where}
+        """
+    UPSERT_SQL = """\
+        INSERT INTO {table} (entry_id, text_vector, speaker_vector, text, speakers)
+        {vectors}
+        ON CONFLICT (entry_id) DO UPDATE
+        SET text_vector = EXCLUDED.text_vector, speaker_vector = EXCLUDED.speaker_vector,
+            text = EXCLUDED.text, speakers = EXCLUDED.speakers
+        WHERE {table}.text_vector IS DISTINCT FROM EXCLUDED.text_vector
+            OR {table}.speaker_vector IS DISTINCT FROM EXCLUDED.speaker_vector
+            OR {table}.text IS DISTINCT FROM EXCLUDED.text
+            OR {table}.speakers IS DISTINCT FROM EXCLUDED.speakers
+        """
+
+    @staticmethod
+    def update_entries(entries_ids) -> int:
+        """
+        Recalculate search vectors of given entries with a single query. Return the number of changed vectors.
+        """
+        entries_ids = list(entries_ids)
+        if not entries_ids:
+            return 0
+        sql = EntrySearchVector.UPSERT_SQL.format(
+            table=EntrySearchVector._meta.db_table,
+            vectors=EntrySearchVector.VECTORS_SQL.format(pointer='newest_version_id', where='e.id = ANY(%s)')
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [entries_ids])
+            updated = cursor.rowcount
+        # Speaker search has to agree with the text search
+        Speaker.update_entries(entries_ids)
+        # Inverted indexes of processes follow the vectors using the change log
+        TagIndexChange.record(entries_ids)
+        bump_search_generation()
+        return updated
+
     def update(self):
-        lines = self.entry.lines.all()
-        text_vector = pg_search.SearchVector(models.Value(strip_tags(self.entry.note), output_field=models.TextField()),
-                                             weight='C', config='english')
-
-        for tag in self.entry.tags.all():
-            text_vector += pg_search.SearchVector(models.Value(tag.name, output_field=models.TextField()), weight='A',
-                                                  config='english')
-
-        for tag in self.entry.event.tags.all():
-            text_vector += pg_search.SearchVector(models.Value(tag.name, output_field=models.TextField()), weight='C',
-                                                  config='english')
-
-        if lines.exists():
-            speaker_vectors = []
-
-            for line in lines:
-                text_vector += pg_search.SearchVector(
-                    models.Value(strip_tags(line.text), output_field=models.TextField()),
-                    weight='B', config='english')
-                speaker_vectors.append(pg_search.SearchVector(
-                    models.Value(strip_tags(line.speaker), output_field=models.TextField()),
-                    weight='A', config='english'))
-                text_vector += pg_search.SearchVector(
-                    models.Value(strip_tags(line.speaker), output_field=models.TextField()),
-                    weight='D', config='english')
-
-            speaker_vector = speaker_vectors[0]
-            for sv in speaker_vectors[1:]:
-                speaker_vector += sv
-
-            self.speaker_vector = speaker_vector
-
-        self.text_vector = text_vector
-        self.save()
+        EntrySearchVector.update_entries([self.entry_id])
+        if self.pk is None:
+            self.pk = EntrySearchVector.objects.only('id').get(entry_id=self.entry_id).pk
+        self.refresh_from_db(fields=['text_vector', 'speaker_vector', 'text', 'speakers'])
+
+
+class SearchIndexUpdate(models.Model):
+    """
+    An entry waiting for its search vector to be recalculated by the update_search_index task.
+    Every entry is queued only once, no matter how many times it was changed in the meantime.
+    The task claims a batch of entries and processes it without holding locks on the queue. Queueing an entry
+    again moves its queued_date and drops the claim, so the task keeps it queued and processes it once more.
+    """
+    entry = models.OneToOneField(Entry, on_delete=models.CASCADE, related_name='+')
+    queued_date = models.DateTimeField(default=timezone.now, db_index=True)
+    # When a task took the entry for processing
+    claimed_date = models.DateTimeField(null=True, blank=True)
+
+    @staticmethod
+    def enqueue(entries_ids):
+        """
+        Queue given entries for reindexing and make sure the queue gets processed after commit.
+        """
+        SearchIndexUpdate.objects.bulk_create(
+            [SearchIndexUpdate(entry_id=entry_id) for entry_id in set(entries_ids)],
+            update_conflicts=True, unique_fields=['entry'], update_fields=['queued_date', 'claimed_date']
+        )
+        from palanaeum import tasks
+        transaction.on_commit(tasks.schedule_search_index_update)
+
+    @staticmethod
+    def get_lag() -> timedelta:
+        """
+        Return how long the oldest queued entry has been waiting for reindexing.
+        """
+        oldest = SearchIndexUpdate.objects.aggregate(oldest=Min('queued_date'))['oldest']
+        if oldest is None:
+            return timedelta(0)
+        return timezone.now() - oldest
+
+
+class EntrySignature(models.Model):
+    """
+    MinHash signature of the current version of an entry, used to find similar entries (see palanaeum.related).
+    Entries sharing any of the band keys are candidates for being related.
+    """
+    entry = models.OneToOneField(Entry, on_delete=models.CASCADE, related_name='+')
+    signature = models.BinaryField()
+    bands = ArrayField(models.BigIntegerField())
+
+    class Meta:
+        indexes = [GinIndex(fields=['bands'])]
+
+
+class TagIndexChange(models.Model):
+    """
+    An entry, whose current tags, speakers or search vectors might have changed. Every process holding one of the
+    in-memory indexes (see palanaeum.tag_index, palanaeum.autocomplete and palanaeum.inverted_index) reads this log
+    to patch its copy.
+    """
+    # Not a foreign key, the log has to outlive deleted entries
+    entry_id = models.IntegerField()
+    date = models.DateTimeField(default=timezone.now, db_index=True)
+
+    @staticmethod
+    def record(entries_ids):
+        TagIndexChange.objects.bulk_create([TagIndexChange(entry_id=entry_id) for entry_id in set(entries_ids)])
+        # This process sees its own changes right away, other ones read the log periodically
+        changes_recorded()
 
 
 class NewestEntryVersionManager(models.Manager):
+    """
+    Returns only the newest versions of entries, that the current user can see.
+    Anonymous users see only the newest approved versions.
+    """
     def get_queryset(self):
         request = get_request()
         if not (request and hasattr(request, 'user')):
@@ -640,12 +945,11 @@ class NewestEntryVersionManager(models.Manager):
         else:
             user = request.user
         queryset = super(NewestEntryVersionManager, self).get_queryset()
-        if not user.is_staff:
-            if user.is_authenticated:
-                queryset = queryset.filter(entry__is_visible=True)
-            else:
-                queryset = queryset.filter(entry__is_visible=True, is_approved=True)
-        return queryset.order_by('entry_id', '-date', 'id').distinct('entry_id')
+        if user.is_staff:
+            return queryset.filter(entry__newest_version=F('id'))
+        if user.is_authenticated:
+            return queryset.filter(entry__is_visible=True, entry__newest_version=F('id'))
+        return queryset.filter(entry__is_visible=True, entry__newest_approved_version=F('id'))
 
 
 class EntryVersion(Taggable):
@@ -682,6 +986,15 @@ class EntryVersion(Taggable):
         self.entry.event.modified_date = timezone.now()
         self.entry.event.save()
         super().save(*args, **kwargs)
+        # Lines, sources and tags are saved after the version, so its entry is updated by the caller
+        # once they're all written (see Entry.update_version_pointers)
+
+    def tags_changed(self):
+        super().tags_changed()
+        bump_event_page_generation([self.entry.event_id])
+        TagIndexChange.record([self.entry_id])
+        if self.is_approved:
+            SearchIndexUpdate.enqueue([self.entry_id])
 
     def archive_version(self):
         """
@@ -733,8 +1046,8 @@ class EntryVersion(Taggable):
         EntryVersion.objects.filter(entry=self.entry, is_approved=False, date__lte=self.date).update(
             is_approved=True, approved_by=approve_by, approved_date=timezone.now()
         )
-        esv = EntrySearchVector.objects.get_or_create(entry=self.entry)[0]
-        esv.update()
+        self.entry.update_version_pointers()
+        SearchIndexUpdate.enqueue([self.entry_id])
 
         if not self.entry.is_approved:
             self.entry.is_approved = True
@@ -744,6 +1057,7 @@ class EntryVersion(Taggable):
 
     def reject(self):
         EntryVersion.objects.filter(entry=self.entry, is_approved=False).delete()
+        self.entry.update_version_pointers()
 
 
 class EntryLine(models.Model):
@@ -780,6 +1094,165 @@ class EntryLine(models.Model):
         return self.entry_version.entry_id
 
 
+class Speaker(models.Model):
+    """
+    A person speaking in entries. Lines name their speakers with free text, spellings that differ
+    only in case and whitespace are matched to the same speaker. The most common spelling is the
+    canonical name, the others are kept as aliases.
+    """
+    class Meta:
+        ordering = ('-entries_count', 'name')
+
+    key = models.CharField(max_length=512, unique=True)
+    name = models.CharField(max_length=512)
+    aliases = ArrayField(models.CharField(max_length=512), default=list, blank=True)
+    # Number of entries, whose approved versions contain this speaker
+    entries_count = models.PositiveIntegerField(default=0)
+
+    # Speakers of the newest and the newest approved versions of entries, with normalized keys
+    ENTRY_SPEAKERS_SQL = """\
+        SELECT e.id, lower(regexp_replace(lines.name, '\\s+', ' ', 'g')) AS key, lines.name,
+            COALESCE(bool_or(l.entry_version_id = e.newest_version_id), False),
+            COALESCE(bool_or(l.entry_version_id = e.newest_approved_version_id), False),
+            COUNT(*) FILTER (WHERE l.entry_version_id = e.newest_approved_version_id)
+        FROM palanaeum_entry e
+        JOIN palanaeum_entryline l ON l.entry_version_id IN (e.newest_version_id, e.newest_approved_version_id)
+        CROSS JOIN LATERAL trim(regexp_replace(l.speaker, '<[^>]*>', ' ', 'g')) AS lines(name)
+        WHERE e.id = ANY(%s) AND lines.name <> ''
+        GROUP BY e.id, lines.name
+        """
+    RECOUNT_SQL = """\
+        WITH counts AS (
+            SELECT es.speaker_id, COUNT(*) FILTER (WHERE es.approved) AS entries_count,
+                mode() WITHIN GROUP (ORDER BY es.name) AS name, array_agg(DISTINCT es.name) AS spellings
+            FROM palanaeum_entryspeaker es
+            WHERE es.speaker_id = ANY(%s)
+            GROUP BY es.speaker_id
+        )
+        UPDATE palanaeum_speaker s
+        SET entries_count = counts.entries_count, name = counts.name, aliases = array_remove(counts.spellings, counts.name)
+        FROM counts
+        WHERE s.id = counts.speaker_id
+        """
+    EVENT_COUNTS_SQL = """\
+        INSERT INTO palanaeum_eventspeaker (event_id, speaker_id, entries_count, lines_count)
+        SELECT e.event_id, es.speaker_id, COUNT(*), SUM(es.lines_count)
+        FROM palanaeum_entryspeaker es
+        JOIN palanaeum_entry e ON e.id = es.entry_id
+        WHERE e.event_id = ANY(%s) AND es.approved
+        GROUP BY e.event_id, es.speaker_id
+        """
+
+    def __str__(self):
+        return self.name
+
+    @staticmethod
+    def update_entries(entries_ids):
+        """
+        Update speakers of the current versions of given entries and recalculate affected counts.
+        """
+        entries_ids = list(entries_ids)
+        if not entries_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(Speaker.ENTRY_SPEAKERS_SQL, [entries_ids])
+            rows = cursor.fetchall()
+
+        # Every entry gets a single row per speaker, named with its most common spelling in that entry
+        entry_speakers = {}
+        spellings = defaultdict(Counter)
+        for entry_id, key, name, newest, approved, lines_count in rows:
+            entry_speaker = entry_speakers.setdefault((entry_id, key), EntrySpeaker(entry_id=entry_id))
+            entry_speaker.newest = entry_speaker.newest or newest
+            entry_speaker.approved = entry_speaker.approved or approved
+            entry_speaker.lines_count += lines_count
+            spellings[(entry_id, key)][name] += lines_count + 1
+        for speaker_key, entry_speaker in entry_speakers.items():
+            entry_speaker.name = spellings[speaker_key].most_common(1)[0][0]
+
+        keys = {key for entry_id, key in entry_speakers}
+        Speaker.objects.bulk_create([Speaker(key=key, name=entry_speaker.name)
+                                     for (entry_id, key), entry_speaker in entry_speakers.items()],
+                                    ignore_conflicts=True)
+        speakers_ids = dict(Speaker.objects.filter(key__in=keys).values_list('key', 'id'))
+        for (entry_id, key), entry_speaker in entry_speakers.items():
+            entry_speaker.speaker_id = speakers_ids[key]
+
+        old_entry_speakers = EntrySpeaker.objects.filter(entry_id__in=entries_ids)
+        affected = set(old_entry_speakers.values_list('speaker_id', flat=True)) | set(speakers_ids.values())
+        old_entry_speakers.delete()
+        EntrySpeaker.objects.bulk_create(entry_speakers.values())
+
+        Speaker.recount(affected)
+        Speaker.recount_events(Entry.objects.filter(id__in=entries_ids).values_list('event_id', flat=True).distinct())
+
+    @staticmethod
+    def rebuild(batch_size=1000, progress=None):
+        """
+        Update speakers of all entries, in batches of given size, each in its own transaction.
+        Progress is called with the fraction of entries done after every batch.
+        """
+        last_id = Entry.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        for start in range(0, last_id + 1, batch_size):
+            with transaction.atomic():
+                Speaker.update_entries(Entry.objects.filter(id__gte=start, id__lt=start + batch_size)
+                                       .values_list('id', flat=True))
+            if progress is not None:
+                progress(min(start + batch_size, last_id) / max(last_id, 1))
+
+    @staticmethod
+    def recount(speakers_ids):
+        """
+        Recalculate canonical names, aliases and counts of given speakers. Speakers without entries are removed.
+        """
+        speakers_ids = list(speakers_ids)
+        with connection.cursor() as cursor:
+            cursor.execute(Speaker.RECOUNT_SQL, [speakers_ids])
+        Speaker.objects.filter(id__in=speakers_ids, entries=None).delete()
+
+    @staticmethod
+    def recount_events(events_ids):
+        """
+        Recalculate the numbers of entries and lines of speakers in given events.
+        """
+        events_ids = list(events_ids)
+        EventSpeaker.objects.filter(event_id__in=events_ids).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(Speaker.EVENT_COUNTS_SQL, [events_ids])
+
+
+class EntrySpeaker(models.Model):
+    """
+    A speaker present in the current versions of an entry.
+    """
+    class Meta:
+        unique_together = ('entry', 'speaker')
+
+    entry = models.ForeignKey(Entry, on_delete=models.CASCADE, related_name='+')
+    speaker = models.ForeignKey(Speaker, on_delete=models.CASCADE, related_name='entries')
+    # The spelling used in this entry
+    name = models.CharField(max_length=512)
+    # Present in the newest version, visible to logged in users
+    newest = models.BooleanField(default=False)
+    # Present in the newest approved version, visible to everybody
+    approved = models.BooleanField(default=False)
+    # Number of lines of the approved version
+    lines_count = models.PositiveIntegerField(default=0)
+
+
+class EventSpeaker(models.Model):
+    """
+    Precalculated numbers of approved entries and lines of a speaker in an event.
+    """
+    class Meta:
+        unique_together = ('event', 'speaker')
+
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='speakers')
+    speaker = models.ForeignKey(Speaker, on_delete=models.CASCADE, related_name='events')
+    entries_count = models.PositiveIntegerField(default=0)
+    lines_count = models.PositiveIntegerField(default=0)
+
+
 class UsersEntryCollection(TimeStampedModel):
     """
     Users are allowed to create and manage their private collections. They may share them with others, too!
@@ -838,9 +1311,20 @@ class ImageSource(Content, Source):
     file = models.ImageField(max_length=200)
     name = models.CharField(max_length=250)
 
+    def __init__(self, *args, **kwargs):
+        super(ImageSource, self).__init__(*args, **kwargs)
+        self._saved_entry_id = self.__dict__.get('entry_id')
+
     def __str__(self):
         return "<ImageSource({}/{}): {} ({})>".format(self.event_id, self.id, str(self.file), self.name)
 
+    def save(self, *args, **kwargs):
+        super(ImageSource, self).save(*args, **kwargs)
+        bump_event_page_generation([self.event_id])
+        if self.entry_id is not None or self._saved_entry_id is not None:
+            Entry.update_source_flags(Entry.objects.filter(pk__in=[self.entry_id, self._saved_entry_id]))
+            self._saved_entry_id = self.entry_id
+
     def get_url(self):
         return self.file.url
 
@@ -866,7 +1350,11 @@ class ImageSource(Content, Source):
         if self.event:
             self.event.modified_date = timezone.now()
             self.event.save()
+        entry_id = self.entry_id
         super(ImageSource, self).delete(using, keep_parents)
+        bump_event_page_generation([self.event_id])
+        if entry_id is not None:
+            Entry.update_source_flags(Entry.objects.filter(pk=entry_id))
 
 
 class URLSource(Content, Source):
@@ -891,6 +1379,20 @@ class URLSource(Content, Source):
     def save(self, *args, **kwargs):
         self.text = bleach.clean(self.text, tags=[], strip=True)
         super(URLSource, self).save(*args, **kwargs)
+        # Entries show texts and visibility of their URL sources
+        Entry.update_source_flags(self.get_entries())
+
+    def delete(self, using=None, keep_parents=False):
+        entries_ids = list(self.get_entries().values_list('id', flat=True))
+        result = super(URLSource, self).delete(using, keep_parents)
+        Entry.update_source_flags(Entry.objects.filter(pk__in=entries_ids))
+        return result
+
+    def get_entries(self):
+        """
+        Return entries having a version linked to this source.
+        """
+        return Entry.objects.filter(pk__in=EntryVersion.objects.filter(url_sources=self).values('entry_id'))
 
     def get_url(self):
         return self.url
@@ -985,6 +1487,7 @@ class AudioSource(Source, Content):
         if self.file and self.length == 0:
             self.reset_length()
         super(AudioSource, self).save(*args, **kwargs)
+        bump_event_page_generation([self.event_id])
 
     def editable(self):
         request = get_request()
@@ -1006,6 +1509,7 @@ class AudioSource(Source, Content):
         for snippet in self.snippets.all():
             snippet.delete()
         super().delete(using=using, keep_parents=keep_parents)
+        bump_event_page_generation([self.event_id])
 
 
 def get_snippet_path():
@@ -1032,9 +1536,20 @@ class Snippet(Content):
     muted = models.BooleanField(default=False, help_text=_("Is given part of the audio muted?"))
     optional = models.BooleanField(default=False, help_text=_("This snippet shouldn't be transcribed."))
 
+    def __init__(self, *args, **kwargs):
+        super(Snippet, self).__init__(*args, **kwargs)
+        self._saved_entry_id = self.__dict__.get('entry_id')
+
     def __str__(self):
         return "<Snippet({}/{}): {}-{}>".format(self.source_id, self.id, self.beginning, self.ending)
 
+    def save(self, *args, **kwargs):
+        super(Snippet, self).save(*args, **kwargs)
+        # Entries show files and visibility of their snippets, any change is a change of their sources
+        if self.entry_id is not None or self._saved_entry_id is not None:
+            Entry.update_source_flags(Entry.objects.filter(pk__in=[self.entry_id, self._saved_entry_id]))
+            self._saved_entry_id = self.entry_id
+
     def get_ending(self):
         return self.ending
 
@@ -1054,7 +1569,10 @@ class Snippet(Content):
             os.unlink(str(self.file))
         except FileNotFoundError:
             pass
+        entry_id = self.entry_id
         super(Snippet, self).delete(*args, **kwargs)
+        if entry_id is not None:
+            Entry.update_source_flags(Entry.objects.filter(pk=entry_id))
 
     def editable(self):
         request = get_request()
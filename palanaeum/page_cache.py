@@ -0,0 +1,193 @@
+"""
+Cache of rendered event pages.
+
+Event pages are the most visited pages. Pages of anonymous users are cached as serialized content for every
+language and URL. Pages of logged in users show their name, notifications and links depending on their
+permissions, so only the list of entries is cached for them, for every audience (contributors and staff members,
+see fragments.get_viewer_class) and language. The rest of the page is rendered with every request.
+
+Every event has a generation counter in the same cache, bumped after any change of the event, its entries
+or sources. The counter and the page are fetched with a single cache call, so fresh pages are served without
+touching the database. The generation is a part of the ETag of the page, browsers revalidating it get
+304 responses.
+
+When a page or a list of entries goes stale, only one request renders it again, concurrent requests get the stale
+one meanwhile. Stale copies are never served after the event was hidden, disapproved or removed: such changes bump
+a second counter, the visibility of the event, which has to match too.
+"""
+import hashlib
+import time
+
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
+
+from palanaeum.fragments import get_viewer_class, has_private_sources
+
+PAGES_CACHE = caches['pages']
+# Pages are invalidated by the generation counters, the timeout frees the memory and limits how long
+# the parts of pages unrelated to the event may lag behind.
+PAGES_CACHE_TTL = 60 * 60
+# How long concurrent requests may get the stale page, while one of them renders the new one
+PAGES_LOCK_TTL = 30
+
+
+def get_generation_key(event_id) -> str:
+    return 'event_page_generation_{}'.format(event_id)
+
+
+def get_visibility_key(event_id) -> str:
+    return 'event_page_visibility_{}'.format(event_id)
+
+
+def bump_event_page_generation(event_ids, visibility_changed=False):
+    """
+    Invalidate cached pages of given events, once the current transaction is committed.
+    If the visibility of the events changed, their stale pages aren't served anymore either.
+    """
+    event_ids = {event_id for event_id in event_ids if event_id is not None}
+    keys = {get_generation_key(event_id) for event_id in event_ids}
+    if visibility_changed:
+        keys.update(get_visibility_key(event_id) for event_id in event_ids)
+    if not keys:
+        return
+
+    def bump():
+        for key in keys:
+            try:
+                PAGES_CACHE.incr(key)
+            except ValueError:
+                # The counter is gone, it starts again from the current time
+                pass
+
+    transaction.on_commit(bump)
+
+
+class EventPageCache:
+    """
+    Cached page of an event for anonymous users, or the cached list of its entries for other audiences.
+    """
+    def __init__(self, request, event_id):
+        self.request = request
+        self.event_id = event_id
+        self.audience = get_viewer_class(request)
+        self.whole_page = self.audience == 'anonymous'
+        if self.whole_page:
+            url_hash = hashlib.md5(request.build_absolute_uri(request.path).encode()).hexdigest()
+            self.key = 'event_page_{}_{}_{}'.format(event_id, get_language(), url_hash)
+        else:
+            self.key = 'event_entries_{}_{}_{}'.format(event_id, self.audience, get_language())
+        self.lock_key = self.key + '_lock'
+        self.generation = None
+        self.visibility = None
+        self.locked = False
+        # Rendered list of entries, if it was cached
+        self.entries_section = None
+        # Pending messages are shown only once, with a rendered page
+        self.enabled = request.method in ('GET', 'HEAD') and not len(get_messages(request))
+
+    def get_response(self):
+        """
+        Return the cached page, or a 304 response if the client has it already.
+        Return None if the page has to be rendered and passed to store(). The cached list of entries
+        of logged in users is kept in entries_section then, or it has to be passed to store_entries().
+        """
+        if not self.enabled:
+            return None
+        generation_key = get_generation_key(self.event_id)
+        visibility_key = get_visibility_key(self.event_id)
+        cached = PAGES_CACHE.get_many([generation_key, visibility_key, self.key])
+        self.generation = cached.get(generation_key)
+        self.visibility = cached.get(visibility_key)
+        if self.generation is None or self.visibility is None:
+            # Start from the current time, so that pages cached before the counters got lost are never reused
+            now = int(time.time() * 1000)
+            PAGES_CACHE.add(generation_key, now, None)
+            PAGES_CACHE.add(visibility_key, now, None)
+            counters = PAGES_CACHE.get_many([generation_key, visibility_key])
+            self.generation = counters.get(generation_key)
+            self.visibility = counters.get(visibility_key)
+
+        page = cached.get(self.key)
+        if self.generation is None or self.visibility is None or page is None:
+            return None
+        if page['generation'] != self.generation:
+            if page['visibility'] != self.visibility:
+                # The event may be gone or hidden now
+                return None
+            self.locked = PAGES_CACHE.add(self.lock_key, True, PAGES_LOCK_TTL)
+            if self.locked:
+                return None
+        if self.whole_page:
+            return self._finish(page)
+        self.entries_section = mark_safe(page['content'])
+        return None
+
+    def store_entries(self, entries_section, event, entries):
+        """
+        Cache the rendered list of entries of the event for logged in users, if it's the same for
+        the whole audience. Entries are the ones in the list (EntryData).
+        """
+        if self.whole_page or self.generation is None:
+            return
+        if self.audience == 'staff':
+            shared = True
+        elif not (event.is_visible and event.is_approved):
+            # Only the author sees it
+            shared = False
+        else:
+            shared = not any(has_private_sources(entry) for entry in entries)
+
+        if shared:
+            PAGES_CACHE.set(self.key, {'generation': self.generation, 'visibility': self.visibility,
+                                       'content': str(entries_section)}, PAGES_CACHE_TTL)
+        self._unlock()
+
+    def store(self, response, event):
+        """
+        Cache the rendered page of the event for anonymous users. Returns the response to send.
+        """
+        if not self.whole_page or self.generation is None or response.status_code != 200:
+            return response
+        if event.is_visible and event.is_approved:
+            page = {
+                'generation': self.generation,
+                'visibility': self.visibility,
+                'etag': '"{}"'.format(hashlib.md5('{}_{}'.format(self.key, self.generation).encode()).hexdigest()),
+                'modified': int(time.time()),
+                'content': response.content,
+                'content_type': response['Content-Type'],
+            }
+            PAGES_CACHE.set(self.key, page, PAGES_CACHE_TTL)
+            response = self._finish(page, response)
+        self._unlock()
+        return response
+
+    def invalidate(self):
+        """
+        Remove the cached page, when rendering it failed, e.g. because the event is gone.
+        """
+        if self.enabled:
+            PAGES_CACHE.delete(self.key)
+        self._unlock()
+
+    def _unlock(self):
+        if self.locked:
+            PAGES_CACHE.delete(self.lock_key)
+            self.locked = False
+
+    def _finish(self, page, response=None):
+        """
+        Make the response of a cached page, or a 304 response if the client has it already.
+        """
+        if response is None:
+            response = HttpResponse(page['content'], content_type=page['content_type'])
+        response['ETag'] = page['etag']
+        response['Last-Modified'] = http_date(page['modified'])
+        return get_conditional_response(self.request, etag=page['etag'], last_modified=page['modified'],
+                                        response=response)
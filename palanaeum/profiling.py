@@ -0,0 +1,296 @@
+"""
+Profiling of requests in production.
+
+ProfilingMiddleware profiles a random sample of requests (PROFILING_SAMPLE_RATE setting). For every profiled
+request it records the number and time of SQL queries, repeated query shapes (a sign of N+1 patterns),
+cache hits and misses of every cache alias, template rendering time and total time. Records are kept
+in a ring buffer of the process and summarized on the staff profiling page, every process shows only its own.
+
+Queries are measured with a database execute wrapper. Caches are measured if their backend is wrapped
+in ProfilingCache and templates if they're rendered by the ProfilingTemplates backend (see the CACHES
+and TEMPLATES settings). Code outside profiled requests only pays for checking a thread local variable.
+
+Staff members can add ?profile=1 to any URL to get a sampling profiler summary of that request
+instead of the page.
+"""
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, deque, namedtuple
+from contextlib import ExitStack
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.http import HttpResponse
+from django.template.backends.django import DjangoTemplates, Template
+from django.utils.module_loading import import_string
+
+LITERALS_REGEXP = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+IN_LIST_REGEXP = re.compile(r"\((?:\?, )+\?\)")
+# Number of repeated query shapes kept for every request
+TOP_DUPLICATES = 5
+# Deeper frames of sampled stacks are cut off
+PROFILER_MAX_DEPTH = 64
+
+ProfileRecord = namedtuple('ProfileRecord', 'date method path endpoint status total_ms sql_count sql_ms '
+                                            'duplicates caches template_ms')
+
+_current = threading.local()
+_records = deque(maxlen=getattr(settings, 'PROFILING_BUFFER_SIZE', 1000))
+_records_lock = threading.Lock()
+
+
+def get_signature(sql: str) -> str:
+    """
+    Return the SQL with parameters and literals replaced by placeholders, equal for queries of the same shape.
+    """
+    return IN_LIST_REGEXP.sub('(?)', LITERALS_REGEXP.sub('?', sql.replace('%s', '?')))
+
+
+class RequestProfile:
+    """
+    Measurements of the request processed by the current thread.
+    """
+    def __init__(self):
+        self.queries = Counter()
+        self.query_times = Counter()
+        self.caches = defaultdict(lambda: [0, 0])
+        self.template_time = 0
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """
+        Database execute wrapper, that measures the query.
+        """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            signature = get_signature(sql)
+            self.queries[signature] += 1
+            self.query_times[signature] += time.perf_counter() - start
+
+    def record_cache(self, cache, hits: int, misses: int):
+        counts = self.caches[_get_cache_alias(cache)]
+        counts[0] += hits
+        counts[1] += misses
+
+
+def _get_cache_alias(cache) -> str:
+    alias = cache.__dict__.get('_profiling_alias')
+    if alias is None:
+        # Every thread has its own cache objects
+        alias = next((alias for alias in settings.CACHES if caches[alias] is cache), type(cache).__name__)
+        cache._profiling_alias = alias
+    return alias
+
+
+_MISSING = object()
+
+
+class ProfilingCache:
+    """
+    Cache backend counting hits and misses of another backend in profiled requests. The other backend
+    is set by the PROFILED_BACKEND parameter of the cache alias, other parameters are passed to it.
+    """
+    def __init__(self, location, params):
+        params = dict(params)
+        backend = import_string(params.pop('PROFILED_BACKEND'))
+        self.cache = backend(location, params)
+
+    def __getattr__(self, name):
+        if name == 'cache':
+            # Not initialized yet, e.g. while being copied
+            raise AttributeError(name)
+        return getattr(self.cache, name)
+
+    def __contains__(self, key):
+        return key in self.cache
+
+    def get(self, key, default=None, version=None):
+        profile = getattr(_current, 'profile', None)
+        if profile is None:
+            return self.cache.get(key, default, version)
+        value = self.cache.get(key, _MISSING, version)
+        profile.record_cache(self, value is not _MISSING, value is _MISSING)
+        return default if value is _MISSING else value
+
+    def get_many(self, keys, version=None):
+        profile = getattr(_current, 'profile', None)
+        values = self.cache.get_many(keys, version)
+        if profile is not None:
+            keys_count = len(keys) if hasattr(keys, '__len__') else len(values)
+            profile.record_cache(self, len(values), keys_count - len(values))
+        return values
+
+
+class ProfiledTemplate(Template):
+    def render(self, context=None, request=None):
+        profile = getattr(_current, 'profile', None)
+        if profile is None:
+            return super().render(context, request)
+        # Templates rendered by other templates (like search filters) are a part of their time
+        profile.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            profile.template_depth -= 1
+            if not profile.template_depth:
+                profile.template_time += time.perf_counter() - start
+
+
+class ProfilingTemplates(DjangoTemplates):
+    """
+    Django template backend measuring the rendering time in profiled requests.
+    """
+    def from_string(self, template_code):
+        return ProfiledTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return ProfiledTemplate(super().get_template(template_name).template, self)
+
+
+def profile_request(request, get_response):
+    """
+    Process the request, recording its profile in the buffer.
+    """
+    profile = RequestProfile()
+    _current.profile = profile
+    start = time.perf_counter()
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+            response = get_response(request)
+    finally:
+        _current.profile = None
+    total = time.perf_counter() - start
+
+    match = getattr(request, 'resolver_match', None)
+    duplicates = [(signature, count, profile.query_times[signature] * 1000)
+                  for signature, count in profile.queries.most_common(TOP_DUPLICATES) if count > 1]
+    record = ProfileRecord(
+        time.time(), request.method, request.path, match.view_name if match else request.path,
+        response.status_code, total * 1000, sum(profile.queries.values()),
+        sum(profile.query_times.values()) * 1000, duplicates,
+        {alias: tuple(counts) for alias, counts in profile.caches.items()}, profile.template_time * 1000
+    )
+    with _records_lock:
+        _records.append(record)
+    return response
+
+
+def get_records() -> list:
+    with _records_lock:
+        return list(_records)
+
+
+def clear_records():
+    with _records_lock:
+        _records.clear()
+
+
+def summarize(records: list, limit: int = 20) -> list:
+    """
+    Return statistics of endpoints sorted by their 95th percentile of total time, slowest first.
+    Every endpoint lists its most repeated queries in the sampled requests.
+    """
+    by_endpoint = defaultdict(list)
+    for record in records:
+        by_endpoint[record.endpoint].append(record)
+
+    endpoints = []
+    for endpoint, endpoint_records in by_endpoint.items():
+        times = np.array([record.total_ms for record in endpoint_records])
+        offenders = Counter()
+        offender_times = Counter()
+        for record in endpoint_records:
+            for signature, count, duration in record.duplicates:
+                offenders[signature] = max(offenders[signature], count)
+                offender_times[signature] += duration / len(endpoint_records)
+        endpoints.append({
+            'endpoint': endpoint,
+            'requests': len(endpoint_records),
+            'p50_ms': float(np.percentile(times, 50)),
+            'p95_ms': float(np.percentile(times, 95)),
+            'max_ms': float(times.max()),
+            'sql_count': float(np.mean([record.sql_count for record in endpoint_records])),
+            'sql_ms': float(np.mean([record.sql_ms for record in endpoint_records])),
+            'template_ms': float(np.mean([record.template_ms for record in endpoint_records])),
+            'offenders': [(signature, count, offender_times[signature])
+                          for signature, count in offenders.most_common(3)],
+        })
+    endpoints.sort(key=lambda endpoint: -endpoint['p95_ms'])
+    return endpoints[:limit]
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of a thread at regular intervals from another thread.
+    """
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < PROFILER_MAX_DEPTH:
+                code = frame.f_code
+                stack.append("{}:{}:{}".format(code.co_filename.rsplit('/site-packages/', 1)[-1],
+                                               code.co_name, frame.f_lineno))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self, limit: int = 30) -> str:
+        """
+        Return the functions with most samples (own and with their callees) and the folded stacks,
+        that can be turned into a flame graph by flamegraph.pl or speedscope.
+        """
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for function in set(stack):
+                total[function] += count
+
+        samples = max(self.samples, 1)
+        lines = ["{} samples every {:.1f} ms".format(self.samples, self.interval * 1000), "",
+                 "Own time:"]
+        lines += ["{:6.1%}  {}".format(count / samples, function) for function, count in own.most_common(limit)]
+        lines += ["", "Total time:"]
+        lines += ["{:6.1%}  {}".format(count / samples, function) for function, count in total.most_common(limit)]
+        lines += ["", "Folded stacks:"]
+        lines += ["{} {}".format(";".join(stack), count) for stack, count in self.stacks.most_common()]
+        return "\n".join(lines)
+
+
+def profile_with_sampling(request, get_response) -> HttpResponse:
+    """
+    Process the request under the sampling profiler and return the profiler summary instead of the response.
+    """
+    interval = getattr(settings, 'PROFILING_INTERVAL', 0.001)
+    start = time.perf_counter()
+    with SamplingProfiler(threading.get_ident(), interval) as profiler:
+        response = get_response(request)
+    total = time.perf_counter() - start
+    header = "{} {} -> {} in {:.1f} ms\n".format(request.method, request.path, response.status_code, total * 1000)
+    return HttpResponse(header + profiler.summary(), content_type='text/plain; charset=utf-8')
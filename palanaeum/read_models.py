@@ -0,0 +1,215 @@
+"""
+Read-only projection of entries for rendering.
+
+Pages listing entries (events, search results, collections, recent entries and feeds) don't need
+model instances. load_entries builds small slotted objects from rows of the entries and the data
+of their current versions (see Entry.fetch_prefetched_data). They have the attributes and methods used
+by the entry templates, so the same templates render both them and Entry instances.
+"""
+from dataclasses import dataclass
+from datetime import date, datetime
+
+from django.db import DEFAULT_DB_ALIAS
+from django.urls import reverse
+from django.utils.html import strip_tags
+
+from palanaeum.middleware import get_request
+from palanaeum.models import Entry, Event, ImageSource, Tag
+from palanaeum.utils import is_contributor
+
+ENTRY_FIELDS = ('id', 'order', 'event_id', 'is_visible', 'searchable', 'created', 'modified', 'snippet_count',
+                'has_snippet', 'has_image', 'has_url', 'sources_version')
+
+
+class Related(tuple):
+    """
+    Objects related to an entry. Answers all() and exists() like related managers do in templates.
+    """
+    __slots__ = ()
+
+    def all(self):
+        return self
+
+    def exists(self) -> bool:
+        return bool(self)
+
+
+class _Content:
+    """
+    Visibility check of Content.visible, for objects with is_visible, is_approved and created_by_id.
+    """
+    __slots__ = ()
+
+    def visible(self) -> bool:
+        user = getattr(get_request(), 'user', None)
+        if user is None:
+            return self.is_visible and self.is_approved
+        if user.is_staff or (self.is_visible and self.is_approved):
+            return True
+        if not self.is_approved:
+            return user.is_authenticated and self.created_by_id == user.id
+        return False
+
+
+@dataclass(slots=True)
+class LineData:
+    speaker: str
+    text: str
+
+    def __str__(self):
+        text = strip_tags(self.text)
+        if len(text) > 50:
+            text = text[:47] + '...'
+        return "{}: {}".format(self.speaker, text)
+
+
+@dataclass(slots=True)
+class SnippetData(_Content):
+    id: int
+    file: str
+    is_visible: bool
+    is_approved: bool
+    created_by_id: int
+
+    def get_file_url(self):
+        if not self.file:
+            return False
+        return '/' + self.file.replace('\\', '/')
+
+
+@dataclass(slots=True)
+class ImageSourceData(_Content):
+    id: int
+    name: str
+    # ImageFieldFile, used by the thumbnail tag
+    file: object
+    is_visible: bool
+    is_approved: bool
+    created_by_id: int
+
+    @property
+    def title(self) -> str:
+        return self.name
+
+    def get_url(self) -> str:
+        return self.file.url
+
+
+@dataclass(slots=True)
+class URLSourceData:
+    url: str
+    text: str
+
+    @property
+    def title(self) -> str:
+        return self.text or self.url
+
+    def get_url(self) -> str:
+        return self.url
+
+    def html(self) -> str:
+        return "<a href='{}' target='_blank'><span>{}</span></a>".format(self.url, self.text or self.url)
+
+
+@dataclass(slots=True)
+class EntryData:
+    id: int
+    order: int
+    event_id: int
+    event: Event
+    is_visible: bool
+    searchable: bool
+    created: datetime
+    modified: datetime
+    snippet_count: int
+    sources_version: int
+    # The current version, None if the entry has none visible
+    version_id: int
+    version_date: datetime
+    date: date
+    note: str
+    paraphrased: bool
+    reported_by: str
+    is_suggestion: bool
+    direct_entry: bool
+    lines: tuple
+    tags: Related
+    url_sources: tuple
+    snippets: Related
+    image_sources: Related
+    # Rendered HTML of the entry, see palanaeum.fragments
+    fragment: str = None
+
+    @property
+    def pk(self) -> int:
+        return self.id
+
+    def get_absolute_url(self) -> str:
+        return reverse('view_entry', args=(self.id,))
+
+    def all_url_sources(self) -> tuple:
+        return self.url_sources
+
+    def editable(self) -> bool:
+        return is_contributor(get_request())
+
+    def __str__(self):
+        if not self.lines:
+            return '-- empty entry --'
+        return str(self.lines[0])
+
+
+def load_entries(entries_ids, show_unapproved=False, events: dict = None) -> dict:
+    """
+    Load visible entries for rendering with three queries at most: entries, their events (unless given
+    as a map: event_id -> event) and the data of their current versions.
+    Returns a map: entry_id -> EntryData
+    """
+    rows = list(Entry.all_visible.filter(id__in=entries_ids).values(*ENTRY_FIELDS))
+    if not rows:
+        return {}
+    events = dict(events or {})
+    missing_events = {row['event_id'] for row in rows} - events.keys()
+    if missing_events:
+        events.update(Event.objects.in_bulk(missing_events))
+    prefetched_data = Entry.fetch_prefetched_data([row['id'] for row in rows], show_unapproved)
+
+    # Tags repeat in many entries, they're shared
+    tags = {}
+    image_field = ImageSource._meta.get_field('file')
+    entries_map = {}
+    for row in rows:
+        data = prefetched_data[row['id']]
+        version = data['version'] or {}
+        snippets = Related(
+            SnippetData(snippet['id'], snippet['file'], snippet['is_visible'], snippet['is_approved'],
+                        snippet['created_by_id'])
+            for snippet in data['snippets']
+        )
+        image_sources = Related(
+            ImageSourceData(image['id'], image['name'], image_field.attr_class(None, image_field, image['file']),
+                            image['is_visible'], image['is_approved'], image['created_by_id'])
+            for image in data['image_sources']
+        )
+        for tag in data['tags']:
+            if tag['id'] not in tags:
+                tags[tag['id']] = Tag.from_db(DEFAULT_DB_ALIAS, ['id', 'name'], [tag['id'], tag['name']])
+        entries_map[row['id']] = EntryData(
+            row['id'], row['order'], row['event_id'], events.get(row['event_id']), row['is_visible'],
+            row['searchable'], row['created'], row['modified'], row['snippet_count'], row['sources_version'],
+            version.get('id'),
+            datetime.fromisoformat(version['date']) if version else None,
+            date.fromisoformat(version['entry_date']) if version else None,
+            version.get('note', ''),
+            version.get('paraphrased', False),
+            version.get('reported_by', ''),
+            not version.get('is_approved', False),
+            (version.get('direct_entry', False) and not row['has_snippet'] and not row['has_image']
+             and not row['has_url']),
+            tuple(LineData(line['speaker'], line['text']) for line in data['lines']),
+            Related(tags[tag['id']] for tag in data['tags']),
+            tuple(URLSourceData(source['url'], source['text']) for source in data['url_sources']),
+            snippets,
+            image_sources,
+        )
+    return entries_map
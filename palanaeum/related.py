@@ -0,0 +1,135 @@
+"""
+"More like this" index of entries.
+
+Every entry gets a MinHash signature of the lexemes and tags of its newest approved version, the one visible
+to everybody (lexemes are calculated like the search vector). The share of equal
+signature values estimates the Jaccard similarity of two entries. Signatures are split into bands and entries
+sharing a band (locality sensitive hashing) are the only candidates compared at request time.
+Signatures are updated together with the search index, see tasks.update_search_index.
+"""
+import zlib
+
+import numpy as np
+from django.db import connection
+
+from palanaeum.models import EntrySearchVector, EntrySignature
+from palanaeum.scoring import ScoredEntries
+from palanaeum.search import SEARCH_CACHE, SEARCH_CACHE_TTL, get_search_generation
+
+NUM_HASHES = 64
+BANDS = 32
+ROWS = NUM_HASHES // BANDS
+# Tags describe the topic better than single words, so each tag counts as that many words
+TAG_WEIGHT = 4
+RELATED_LIMIT = 10
+MIN_SIMILARITY = 0.1
+
+# Random multiply-shift hash functions ((a * x + b) mod 2^64) >> 32 with odd a, the same in every process
+_rng = np.random.RandomState(20170603)
+HASH_A = (_rng.randint(0, 1 << 32, NUM_HASHES, dtype=np.uint64) << np.uint64(32)
+          | _rng.randint(0, 1 << 32, NUM_HASHES, dtype=np.uint64) | np.uint64(1))
+HASH_B = _rng.randint(0, 1 << 32, NUM_HASHES, dtype=np.uint64) << np.uint64(32) \
+    | _rng.randint(0, 1 << 32, NUM_HASHES, dtype=np.uint64)
+
+TOKENS_SQL = """\
+    SELECT e.id, tsvector_to_array(vectors.text_vector),
+        ARRAY(SELECT vt.tag_id FROM palanaeum_entryversion_tags vt
+              WHERE vt.entryversion_id = e.newest_approved_version_id)
+    FROM ({vectors}) vectors
+    JOIN palanaeum_entry e ON e.id = vectors.entry_id
+    WHERE e.newest_approved_version_id IS NOT NULL
+    """.format(vectors=EntrySearchVector.VECTORS_SQL.format(pointer='newest_approved_version_id',
+                                                            where='e.id = ANY(%s)'))
+# Related entries are cached for everybody, so only the ones visible to everybody are candidates
+CANDIDATES_SQL = """\
+    SELECT s.entry_id, s.signature
+    FROM palanaeum_entrysignature s
+    JOIN palanaeum_entry e ON e.id = s.entry_id
+    WHERE s.bands && %s AND s.entry_id <> %s AND e.is_visible = True AND e.is_approved = True
+        AND e.newest_approved_version_id IS NOT NULL AND e.searchable = True
+    """
+
+
+def get_tokens(lexemes: list, tags_ids: list) -> list:
+    """
+    Return the set of features describing an entry.
+    """
+    tokens = set(lexemes)
+    tokens.update('tag:{}:{}'.format(tag_id, i) for tag_id in tags_ids for i in range(TAG_WEIGHT))
+    return sorted(tokens)
+
+
+def get_signature(tokens: list) -> np.ndarray:
+    """
+    Return the MinHash signature of a set of tokens, or None if it's empty.
+    """
+    if not tokens:
+        return None
+    hashes = np.array([zlib.crc32(token.encode()) for token in tokens], dtype=np.uint64)
+    # Products overflow on purpose, only the high bits of the low 64 bits are kept
+    values = (np.outer(hashes, HASH_A) + HASH_B) >> np.uint64(32)
+    return values.min(axis=0).astype(np.uint32)
+
+
+def get_bands(signature: np.ndarray) -> list:
+    """
+    Return the LSH keys of the signature, one for every band.
+    """
+    rows = signature.reshape(BANDS, ROWS)
+    return [band << 32 | zlib.crc32(rows[band].tobytes()) for band in range(BANDS)]
+
+
+def update_signatures(entries_ids) -> int:
+    """
+    Recalculate signatures of given entries from their approved versions. Return the number of stored signatures.
+    """
+    entries_ids = list(entries_ids)
+    if not entries_ids:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(TOKENS_SQL, [entries_ids])
+        rows = cursor.fetchall()
+
+    signatures = []
+    for entry_id, lexemes, tags_ids in rows:
+        signature = get_signature(get_tokens(lexemes, tags_ids))
+        if signature is not None:
+            signatures.append(EntrySignature(entry_id=entry_id, signature=signature.tobytes(),
+                                             bands=get_bands(signature)))
+
+    EntrySignature.objects.filter(entry_id__in=entries_ids).exclude(
+        entry_id__in=[signature.entry_id for signature in signatures]).delete()
+    EntrySignature.objects.bulk_create(signatures, update_conflicts=True, unique_fields=['entry'],
+                                       update_fields=['signature', 'bands'])
+    return len(signatures)
+
+
+def find_related(entry_id: int, limit: int = RELATED_LIMIT) -> list:
+    """
+    Return up to `limit` (entry_id, similarity) pairs of visible entries most similar to the given one.
+    Results are cached until the next change of search results.
+    """
+    cache_key = 'related_{}_{}_{}'.format(entry_id, limit, get_search_generation())
+    related = SEARCH_CACHE.get(cache_key)
+    if related is not None:
+        return related
+
+    related = []
+    own = EntrySignature.objects.filter(entry_id=entry_id).values_list('signature', 'bands').first()
+    if own is not None:
+        signature = np.frombuffer(bytes(own[0]), dtype=np.uint32)
+        with connection.cursor() as cursor:
+            cursor.execute(CANDIDATES_SQL, [own[1], entry_id])
+            candidates = cursor.fetchall()
+        if candidates:
+            ids = np.array([candidate[0] for candidate in candidates], dtype=np.int64)
+            signatures = np.frombuffer(b"".join(bytes(candidate[1]) for candidate in candidates),
+                                       dtype=np.uint32).reshape(len(candidates), NUM_HASHES)
+            similarities = (signatures == signature).mean(axis=1)
+            order = np.argsort(ids)
+            scored = ScoredEntries(ids[order], similarities[order])
+            related = [(related_id, similarity) for related_id, similarity in scored.top(limit)
+                       if similarity >= MIN_SIMILARITY]
+
+    SEARCH_CACHE.set(cache_key, related, SEARCH_CACHE_TTL)
+    return related
@@ -0,0 +1,120 @@
+"""
+Vectorized representation of search results: a sorted array of entry ids with a parallel array of scores.
+All set operations and rankings are done by NumPy, without touching individual results in Python.
+"""
+import numpy as np
+
+ID_TYPE = np.int64
+SCORE_TYPE = np.float64
+
+
+def bitmap_to_array(bitmap: int) -> np.ndarray:
+    """
+    Return a sorted array of positions of set bits.
+    """
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    return np.flatnonzero(np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder='little')).astype(ID_TYPE)
+
+
+class ScoredEntries:
+    """
+    Set of entries with their scores. Ids are sorted and unique.
+    """
+    def __init__(self, ids=None, scores=None):
+        self.ids = np.asarray(ids if ids is not None else (), dtype=ID_TYPE)
+        if scores is None:
+            scores = np.zeros(len(self.ids), dtype=SCORE_TYPE)
+        self.scores = np.asarray(scores, dtype=SCORE_TYPE)
+
+    @staticmethod
+    def from_pairs(pairs) -> 'ScoredEntries':
+        """
+        Build the set from (entry_id, score) pairs, summing scores of repeated entries.
+        """
+        pairs = np.asarray(pairs, dtype=SCORE_TYPE).reshape(-1, 2)
+        return ScoredEntries._accumulate(pairs[:, 0].astype(ID_TYPE), pairs[:, 1])
+
+    @staticmethod
+    def from_ids(ids, score: float = 0) -> 'ScoredEntries':
+        ids = np.unique(np.asarray(ids, dtype=ID_TYPE))
+        return ScoredEntries(ids, np.full(len(ids), score, dtype=SCORE_TYPE))
+
+    @staticmethod
+    def from_bitmap(bitmap: int, score: float = 0) -> 'ScoredEntries':
+        """
+        Build the set from a bitmap, where the bit number N is set for the entry with id N.
+        """
+        ids = bitmap_to_array(bitmap)
+        return ScoredEntries(ids, np.full(len(ids), score, dtype=SCORE_TYPE))
+
+    @staticmethod
+    def _accumulate(ids, scores) -> 'ScoredEntries':
+        unique_ids, positions = np.unique(ids, return_inverse=True)
+        return ScoredEntries(unique_ids, np.bincount(positions, weights=scores, minlength=len(unique_ids)))
+
+    @staticmethod
+    def union_all(sets) -> 'ScoredEntries':
+        """
+        Return entries present in any of the sets, with scores summed over all of them.
+        """
+        sets = list(sets)
+        if not sets:
+            return ScoredEntries()
+        return ScoredEntries._accumulate(np.concatenate([s.ids for s in sets]),
+                                         np.concatenate([s.scores for s in sets]))
+
+    def union(self, other: 'ScoredEntries') -> 'ScoredEntries':
+        return ScoredEntries.union_all([self, other])
+
+    def intersection(self, other: 'ScoredEntries') -> 'ScoredEntries':
+        """
+        Return entries present in both sets, with their scores summed.
+        """
+        ids, mine, others = np.intersect1d(self.ids, other.ids, assume_unique=True, return_indices=True)
+        return ScoredEntries(ids, self.scores[mine] + other.scores[others])
+
+    def difference(self, other: 'ScoredEntries') -> 'ScoredEntries':
+        """
+        Return entries of this set, that are not present in the other one.
+        """
+        keep = ~np.isin(self.ids, other.ids, assume_unique=True)
+        return ScoredEntries(self.ids[keep], self.scores[keep])
+
+    def top(self, k: int = None) -> list:
+        """
+        Return up to k (entry_id, score) pairs with the highest scores. Ties are ordered by id.
+        """
+        count = len(self.ids)
+        if k is None or k >= count:
+            candidates = np.arange(count)
+        elif k <= 0:
+            return []
+        else:
+            # Only entries scoring at least as much as the k-th one need sorting
+            threshold = np.partition(self.scores, count - k)[count - k]
+            candidates = np.flatnonzero(self.scores >= threshold)
+        order = candidates[np.lexsort((self.ids[candidates], -self.scores[candidates]))][:k]
+        return list(zip(self.ids[order].tolist(), self.scores[order].tolist()))
+
+    def as_sql(self) -> tuple:
+        """
+        Return a (sql, params) pair of a query selecting `entry_id` and `rank` of these entries.
+        """
+        return ("SELECT * FROM unnest(%s::integer[], %s::float8[]) AS scored(entry_id, rank)",
+                [self.ids.tolist(), self.scores.tolist()])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __bool__(self):
+        return len(self.ids) > 0
+
+    def __iter__(self):
+        return zip(self.ids.tolist(), self.scores.tolist())
+
+    def __contains__(self, entry_id):
+        index = np.searchsorted(self.ids, entry_id)
+        return index < len(self.ids) and self.ids[index] == entry_id
+
+    def __repr__(self):
+        return "<ScoredEntries: {} entries>".format(len(self.ids))
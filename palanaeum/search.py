@@ -1,21 +1,124 @@
 import abc
+import base64
+import hashlib
+import json
+import logging
 import re
-from collections import defaultdict
+import time
+from collections.abc import Sequence
 from datetime import datetime, date
 from urllib.parse import urlencode
 
+import numpy as np
 from django.core.cache import caches
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
-from django.db import ProgrammingError
+from django.core.cache.backends.dummy import DummyCache
+from django.core.paginator import Paginator, Page, PageNotAnInteger, EmptyPage
+from django.db import ProgrammingError, connection, transaction
+from django.db.models import Min, Max
 from django.db.models.functions import Lower
 from django.http.request import QueryDict
 from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
 
-from palanaeum.models import Entry, Tag, EntrySearchVector, UserSettings, EntryVersion
+from palanaeum import inverted_index
+from palanaeum.fragments import render_entries
+from palanaeum.middleware import get_request
+from palanaeum.models import Entry, Tag, UserSettings
+from palanaeum.read_models import load_entries
+from palanaeum.scoring import ScoredEntries
+from palanaeum.tag_index import get_tag_index, VARIANTS
 
 SEARCH_CACHE = caches['search']
-SEARCH_CACHE_TTL = 60
+# Cached results are invalidated by the generation counter, the timeout only frees the memory
+SEARCH_CACHE_TTL = 24 * 60 * 60
+SEARCH_GENERATION_KEY = 'search_generation'
+
+logger = logging.getLogger('palanaeum.search')
+
+
+def get_search_generation() -> int:
+    """
+    Return the current generation of search results. Results cached with older generations are stale.
+    """
+    generation = SEARCH_CACHE.get(SEARCH_GENERATION_KEY)
+    if generation is None:
+        # Start from the current time, so that results cached before the counter got lost are never reused
+        SEARCH_CACHE.add(SEARCH_GENERATION_KEY, int(time.time() * 1000), None)
+        generation = SEARCH_CACHE.get(SEARCH_GENERATION_KEY, 0)
+    return generation
+
+
+def bump_search_generation():
+    """
+    Invalidate all cached search results, once the current transaction is committed.
+    Has to be called every time a change may affect the results of searches.
+    """
+    def bump():
+        try:
+            SEARCH_CACHE.incr(SEARCH_GENERATION_KEY)
+        except ValueError:
+            get_search_generation()
+
+    transaction.on_commit(bump)
+
+
+# How long the check of the pg_trgm extension is remembered, so installing it doesn't need a restart
+TRIGRAM_CHECK_TTL = 5 * 60
+_trigram_search_available = (None, 0.0)
+
+
+def trigram_search_available() -> bool:
+    """
+    Check if the pg_trgm extension is installed (see build_trigram_index command).
+    The result is remembered for TRIGRAM_CHECK_TTL seconds.
+    """
+    global _trigram_search_available
+    available, checked = _trigram_search_available
+    if available is None or time.time() - checked > TRIGRAM_CHECK_TTL:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+            available = cursor.fetchone()[0]
+        _trigram_search_available = (available, time.time())
+    return available
+
+
+def _get_audience() -> str:
+    """
+    Return the name of the group of users, that see the same search results as the current user.
+    """
+    user = getattr(get_request(), 'user', None)
+    if user is None or not user.is_authenticated:
+        return 'anonymous'
+    return 'staff' if user.is_staff else 'user'
+
+
+def _get_version_variant() -> str:
+    """
+    Return the variant of current versions of entries seen by the current user.
+    Anonymous users don't see unapproved versions.
+    """
+    return 'approved' if _get_audience() == 'anonymous' else 'newest'
+
+
+# Indexed copies of entry_date of the current versions, in each variant
+ENTRY_DATE_FIELDS = {
+    'newest': 'newest_entry_date',
+    'approved': 'newest_approved_entry_date',
+}
+
+
+def get_archive_stats() -> dict:
+    """
+    Return basic statistics of the archive, like the range of dates of entries.
+    They are cached until the next change of search results.
+    """
+    cache_key = 'archive_stats_{}'.format(get_search_generation())
+    stats = SEARCH_CACHE.get(cache_key)
+    if stats is None:
+        stats = Entry.objects.aggregate(min_date=Min('newest_entry_date'), max_date=Max('newest_entry_date'))
+        SEARCH_CACHE.set(cache_key, stats, SEARCH_CACHE_TTL)
+    return stats
 
 
 class SearchFilter(abc.ABC):
@@ -23,19 +126,61 @@ class SearchFilter(abc.ABC):
     That's an abstract class defining an interface for Search Filters.
     The filters operate on EntryLines.
     """
+    # Entries selected by a negated filter are excluded from the results, instead of being required.
+    NEGATED = False
+    # Filters that find their entries without querying the database, they are combined before the search query.
+    # Text filters decide it for every search, see TextSearchFilter.init_from_get_params.
+    in_memory = False
+
     @abc.abstractmethod
-    def _get_cache_key(self):
+    def _get_cache_key(self) -> str:
+        """
+        Return a string that identifies the normalized conditions of this filter.
+        It has to be the same in every process, so it's used to build keys of cached search results.
+        """
         return None
 
-    def get_entry_ids(self) -> frozenset:
+    @abc.abstractmethod
+    def get_sql(self) -> tuple:
         """
-        Return a set of pairs (entry_id, rank) that fulfill the search query.
-        Rank should be a non-negative float number.
+        Return a pair (sql, params) of a query selecting `entry_id` and `rank` columns of entries
+        that fulfill this filter. Every entry may appear only once.
 
         Can return entries that shouldn't be visible to regular users!
         """
         raise NotImplementedError
 
+    def get_entry_ids(self) -> ScoredEntries:
+        """
+        Return entries that fulfill the search query, with their ranks.
+        Rank should be a non-negative float number.
+
+        Can return entries that shouldn't be visible to regular users!
+        """
+        sql, params = self.get_sql()
+
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, list(params))
+                return ScoredEntries.from_pairs(cursor.fetchall())
+        except ProgrammingError:
+            logger.warning("Search filter %s failed to execute.", self, exc_info=True)
+            return ScoredEntries()
+
+    @classmethod
+    def get_param_names(cls) -> tuple:
+        """
+        Return names of GET params used by this filter.
+        """
+        return ()
+
+    def get_highlight_query(self):
+        """
+        Return a (sql, params) tsquery expression of terms that should be highlighted in excerpts
+        of the found entries, or None if this filter doesn't match the text of entries.
+        """
+        return None
+
     @abc.abstractmethod
     def init_from_get_params(self, get_params: QueryDict) -> bool:
         """
@@ -67,88 +212,292 @@ class SearchFilter(abc.ABC):
         return ""
 
 
+class SearchQueryParser:
+    """
+    Parses free-text search queries into a syntax tree and compiles it into a single tsquery.
+
+    Supported syntax:
+      - words separated by spaces match entries containing any of them,
+      - AND, & or + require both sides, OR or | require any of them,
+      - NOT, ! or - before a term excludes entries matching it (unless OR is used explicitly next to it),
+      - "quoted text" matches a phrase, word* matches words starting with the prefix,
+      - parentheses group the expressions.
+
+    Nodes of the tree are tuples: ('word', text), ('prefix', text), ('phrase', text),
+    ('not', node), ('and', [nodes]) and ('or', [nodes]).
+    """
+    TOKEN_REGEXP = re.compile(r'''
+        "(?P<dquoted>[^"]*)"?
+        | (?<![^\s(])'(?P<squoted>[^']*)'(?![^\s)])
+        | (?P<lparen>\()
+        | (?P<rparen>\))
+        | (?P<or>\||\bOR\b)
+        | (?P<and>&|\+|\bAND\b)
+        | (?P<not>!|(?<![^\s(])-|\bNOT\b)
+        | (?P<word>[^\s()"|&+!]+)
+        ''', re.VERBOSE)
+    WORD_REGEXP = re.compile(r'\w+')
+    CONFIG = 'english'
+
+    def __init__(self, text: str):
+        self.tokens = []
+        for match in self.TOKEN_REGEXP.finditer(text):
+            kind = match.lastgroup
+            value = match.group(kind)
+            if kind in ('dquoted', 'squoted'):
+                kind = 'phrase'
+            self.tokens.append((kind, value))
+        self.position = 0
+
+    def parse(self):
+        """
+        Return the syntax tree of the query, or None if it doesn't contain any terms.
+        Unbalanced parentheses and dangling operators are ignored.
+        """
+        nodes = []
+        while self.position < len(self.tokens):
+            node = self._parse_or()
+            if node is not None:
+                nodes.append(node)
+            if self._peek() == 'rparen':
+                self.position += 1
+        return self._combine('or', nodes)
+
+    def _peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][0]
+        return None
+
+    @staticmethod
+    def _combine(operator: str, nodes: list):
+        flat = []
+        for node in nodes:
+            if node is not None:
+                flat.extend(node[1] if node[0] == operator else [node])
+        if len(flat) > 1:
+            # Both operators are commutative, so sort the operands to get a canonical tree
+            return operator, sorted(flat, key=json.dumps)
+        return flat[0] if flat else None
+
+    def _parse_or(self):
+        nodes = [self._parse_and()]
+        explicit = [False]
+        while self._peek() in ('or', 'word', 'phrase', 'not', 'lparen'):
+            explicit[-1] = explicit[-1] or self._peek() == 'or'
+            explicit.append(self._peek() == 'or')
+            if explicit[-1]:
+                self.position += 1
+            nodes.append(self._parse_and())
+
+        # Negated terms just listed among others (like "hoid -cosmere") exclude entries from the results
+        excluded = [node for node, is_explicit in zip(nodes, explicit)
+                    if node is not None and node[0] == 'not' and not is_explicit]
+        alternatives = [node for node in nodes if not any(node is excluded_node for excluded_node in excluded)]
+        return self._combine('and', [self._combine('or', alternatives)] + excluded)
+
+    def _parse_and(self):
+        nodes = [self._parse_not()]
+        while self._peek() == 'and':
+            self.position += 1
+            nodes.append(self._parse_not())
+        return self._combine('and', nodes)
+
+    def _parse_not(self):
+        if self._peek() == 'not':
+            self.position += 1
+            node = self._parse_not()
+            return ('not', node) if node is not None else None
+        return self._parse_atom()
+
+    def _parse_atom(self):
+        kind = self._peek()
+        if kind is None:
+            return None
+        value = self.tokens[self.position][1]
+        self.position += 1
+
+        if kind == 'lparen':
+            node = self._parse_or()
+            if self._peek() == 'rparen':
+                self.position += 1
+            return node
+        if kind == 'phrase':
+            return ('phrase', " ".join(value.split())) if self.WORD_REGEXP.search(value) else None
+        if kind == 'word':
+            words = self.WORD_REGEXP.findall(value)
+            if not words:
+                return None
+            if value.endswith('*') and len(words) == 1:
+                return 'prefix', words[0]
+            # Words glued with punctuation, like "spren-bond", are searched as a phrase
+            return ('word', words[0]) if len(words) == 1 else ('phrase', value.strip('*'))
+        # Dangling operator
+        return None
+
+    @classmethod
+    def compile(cls, node) -> tuple:
+        """
+        Compile the syntax tree into a (sql, params) tsquery expression.
+        """
+        kind = node[0]
+        if kind == 'word':
+            return "plainto_tsquery('{}', %s)".format(cls.CONFIG), [node[1]]
+        if kind == 'phrase':
+            return "phraseto_tsquery('{}', %s)".format(cls.CONFIG), [node[1]]
+        if kind == 'prefix':
+            return "to_tsquery('{}', %s)".format(cls.CONFIG), [node[1] + ':*']
+        if kind == 'not':
+            sql, params = cls.compile(node[1])
+            return "!!{}".format(sql), params
+
+        parts = [cls.compile(child) for child in node[1]]
+        operator = ' && ' if kind == 'and' else ' || '
+        return "({})".format(operator.join(sql for sql, _params in parts)), \
+            [param for _sql, params in parts for param in params]
+
+    @classmethod
+    def terms(cls, node) -> list:
+        """
+        Return texts of all words, prefixes and phrases of the tree that are not negated.
+        """
+        if node[0] in ('and', 'or'):
+            return [term for child in node[1] for term in cls.terms(child)]
+        if node[0] == 'not':
+            return []
+        return [node[1]]
+
+    @classmethod
+    def phrases(cls, node) -> list:
+        """
+        Return all phrases of the tree that are not negated.
+        """
+        if node[0] == 'phrase':
+            return [node[1]]
+        if node[0] in ('and', 'or'):
+            return [phrase for child in node[1] for phrase in cls.phrases(child)]
+        return []
+
+
 class TextSearchFilter(SearchFilter):
     """
-    Search for entries that match given text sample.
+    Search for entries that match given text query (see SearchQueryParser for the syntax).
+    In fuzzy mode entries with words similar to the query terms are found too, using the pg_trgm extension.
     """
-    QUOTE_REGEXP = re.compile(r'''(?P<quote>['"])(.+?)(?P=quote)''')
     SQL_QUERY = """\
-        SELECT esv.id, esv.entry_id, ts_rank(esv.text_vector, to_tsquery(%s), 32) + 1 as rank
+        SELECT esv.entry_id, {rank}{bonus} AS rank
         FROM palanaeum_entrysearchvector esv
         JOIN palanaeum_entry e ON esv.entry_id = e.id
-        WHERE esv.text_vector @@ to_tsquery(%s) AND e.searchable = True
+        WHERE ({condition}) AND e.searchable = True
         """
+    RANK = "ts_rank(esv.{vector}, {query}, 32) + 1"
+    # Entries that only resemble the query rank below the ones that match it
+    FUZZY_RANK = "CASE WHEN {condition} THEN ts_rank(esv.{vector}, {query}, 32) + 1 " \
+                 "ELSE word_similarity(%s, esv.{text}) END"
+    FUZZY_CONDITION = "{condition} OR %s <%% esv.{text}"
+    # Quoted phrases match the exact text too (even if it's made of stop words only), trigram index makes
+    # this lookup fast. phraseto_tsquery finds the other forms of the words and ranks the results.
+    PHRASE_CONDITION = "(esv.{vector} @@ {query} OR esv.{text} ILIKE %s)"
+    # Exact phrase match is much more valuable
+    PHRASE_BONUS = " + CASE WHEN esv.{text} ILIKE %s THEN 10 ELSE 0 END"
+    VECTOR = 'text_vector'
+    TEXT = 'text'
+    # Field of the inverted index searched instead of the vector, if it's the search backend
+    INDEX_FIELD = 'text'
+    # Matches of this filter are marked in excerpts of the results
+    HIGHLIGHTED = True
     GET_PARAM_NAME = 'query'
     LABEL = _('Search for text:')
+    FUZZY_LABEL = _('Find similar words')
 
     def __init__(self):
         self.search_phrase = ''
-        self.search_tokens = []
-        self.exact_search_tokens = []
+        self.query_tree = None
+        self.fuzzy = False
+        self.in_memory = False
 
-    def as_url_param(self) -> str:
-        return urlencode({self.GET_PARAM_NAME: self.search_phrase})
+    @classmethod
+    def get_param_names(cls) -> tuple:
+        return cls.GET_PARAM_NAME,
 
-    def _get_cache_key(self):
-        return "text_search_" + str(hash(" ".join(sorted(self.search_tokens))))
-
-    def _get_results_for_token(self, token):
-        token_results = {}
-        if ' ' in token:
-            # Currently, this should never happen
-            query = " <-> ".join(token.split(' '))
-        else:
-            query = token
-
-        try:
-            for esv in EntrySearchVector.objects.raw(self.SQL_QUERY, [query, query]):
-                token_results[esv.entry_id] = esv.rank
-        except ProgrammingError:
-            token_results = {}
+    @property
+    def fuzzy_param_name(self) -> str:
+        return self.GET_PARAM_NAME + '_fuzzy'
 
-        return token_results
-
-    def _get_normal_search_results(self) -> defaultdict:
-        results = defaultdict(float)
-
-        for token in self.search_tokens:
-            cache_key = "search_text_" + str(hash(token))
-            token_results = SEARCH_CACHE.get(cache_key)
+    def as_url_param(self) -> str:
+        params = {self.GET_PARAM_NAME: self.search_phrase}
+        if self.fuzzy:
+            params[self.fuzzy_param_name] = 'on'
+        return urlencode(params)
 
-            if not token_results:
-                token_results = self._get_results_for_token(token)
-                SEARCH_CACHE.set(cache_key, token_results, SEARCH_CACHE_TTL)
+    def _get_cache_key(self):
+        return json.dumps([self.GET_PARAM_NAME, self.query_tree, self.fuzzy])
 
-            for entry_id, rank in token_results.items():
-                results[entry_id] += rank
+    @staticmethod
+    def _like_pattern(text: str) -> str:
+        """
+        Escape the text, so it can be safely used as a part of LIKE pattern.
+        """
+        for special in ('\\', '%', '_'):
+            text = text.replace(special, '\\' + special)
+        return '%{}%'.format(text)
 
-        return results
+    def _compile_condition(self, node) -> tuple:
+        """
+        Compile the syntax tree into a (sql, params) condition matching the phrases against the text too.
+        """
+        kind = node[0]
+        if kind in ('and', 'or'):
+            parts = [self._compile_condition(child) for child in node[1]]
+            operator = ' AND ' if kind == 'and' else ' OR '
+            return "({})".format(operator.join(sql for sql, _params in parts)), \
+                [param for _sql, params in parts for param in params]
+        if kind == 'not':
+            sql, params = self._compile_condition(node[1])
+            return "NOT {}".format(sql), params
+
+        query_sql, query_params = SearchQueryParser.compile(node)
+        if kind == 'phrase':
+            return self.PHRASE_CONDITION.format(vector=self.VECTOR, text=self.TEXT, query=query_sql), \
+                query_params + [self._like_pattern(node[1])]
+        return "esv.{} @@ {}".format(self.VECTOR, query_sql), query_params
+
+    def get_sql(self) -> tuple:
+        """
+        The whole query is compiled into one tsquery, matched against the search vector with one rank expression.
+        Queries with phrases are matched node by node, so the phrases can be looked up in the text.
+        """
+        if self.query_tree is None:
+            return "SELECT NULL::integer AS entry_id, 0 AS rank WHERE False", []
 
-    def _get_exact_search_results(self) -> defaultdict:
-        results = defaultdict(float)
+        query_sql, query_params = SearchQueryParser.compile(self.query_tree)
+        phrases = SearchQueryParser.phrases(self.query_tree)
+        terms = " ".join(SearchQueryParser.terms(self.query_tree))
+        names = {'vector': self.VECTOR, 'text': self.TEXT, 'query': query_sql}
 
-        for token in self.exact_search_tokens:
-            cache_key = "exact_search_text_" + str(hash(token))
-            token_results = SEARCH_CACHE.get(cache_key)
+        if phrases:
+            condition, condition_params = self._compile_condition(self.query_tree)
+        else:
+            condition, condition_params = "esv.{vector} @@ {query}".format(**names), query_params
 
-            if not token_results:
-                token_results = {}
-                entries_with_token = EntryVersion.newest.filter(
-                    lines__text__icontains=token, entry__searchable=True).values_list('entry_id', flat=True)
-                # Need to accept only the newest versions of entries! I need to make that newest flag happen!
-                for entry_id in entries_with_token:
-                    token_results[entry_id] = 10  # Exact match is much more valuable
-                SEARCH_CACHE.set(cache_key, token_results, SEARCH_CACHE_TTL)
+        if self.fuzzy and terms and trigram_search_available():
+            rank = self.FUZZY_RANK.format(condition=condition, **names)
+            rank_params = condition_params + query_params + [terms]
+            condition = self.FUZZY_CONDITION.format(condition=condition, **names)
+            condition_params = condition_params + [terms]
+        else:
+            rank = self.RANK.format(**names)
+            rank_params = query_params
 
-            for entry_id, rank in token_results.items():
-                results[entry_id] += rank
-        return results
+        sql = self.SQL_QUERY.format(
+            rank=rank, condition=condition, variant=_get_version_variant(),
+            bonus="".join(self.PHRASE_BONUS.format(**names) for _phrase in phrases)
+        )
+        return sql, rank_params + [self._like_pattern(phrase) for phrase in phrases] + condition_params
 
-    def get_entry_ids(self) -> frozenset:
-        results = self._get_normal_search_results()
-        for key, value in self._get_exact_search_results().items():
-            results[key] += value
-        return frozenset((entry_id, rank) for entry_id, rank in results.items())
+    def get_highlight_query(self):
+        if not self.HIGHLIGHTED or self.query_tree is None:
+            return None
+        return SearchQueryParser.compile(self.query_tree)
 
     def init_from_get_params(self, get_params: QueryDict):
         self.search_phrase: str = get_params.get(self.GET_PARAM_NAME, '').strip()
@@ -156,23 +505,27 @@ class TextSearchFilter(SearchFilter):
         if not self.search_phrase:
             return False
 
-        self.search_phrase = self.search_phrase.replace("+", "&")
-
-        for quoted_text in self.QUOTE_REGEXP.findall(self.search_phrase):
-            self.exact_search_tokens.append(quoted_text[1])
-
-        for word in self.QUOTE_REGEXP.sub('', self.search_phrase).split(' '):
-            self.search_tokens.append(word)
-
+        self.query_tree = SearchQueryParser(self.search_phrase).parse()
+        self.fuzzy = bool(get_params.get(self.fuzzy_param_name))
+        # Fuzzy matching needs trigrams of the text and exact phrases need the text, only the database has them
+        self.in_memory = inverted_index.is_enabled() and not self.fuzzy and not (
+            self.query_tree is not None and SearchQueryParser.phrases(self.query_tree))
         return True
 
+    def get_entry_ids(self) -> ScoredEntries:
+        index = inverted_index.get_inverted_index() if self.in_memory else None
+        if index is None:
+            return super().get_entry_ids()
+        return index.search(self.INDEX_FIELD, self.query_tree, _get_version_variant())
+
     def __bool__(self):
         return bool(self.search_phrase)
 
     def to_tr(self) -> str:
         return render_to_string(
             'palanaeum/search/filters/text_filter.html',
-            {'field_name': self.GET_PARAM_NAME, 'value': self.search_phrase, 'label_text': self.LABEL}
+            {'field_name': self.GET_PARAM_NAME, 'value': self.search_phrase, 'label_text': self.LABEL,
+             'fuzzy_field_name': self.fuzzy_param_name, 'fuzzy': self.fuzzy, 'fuzzy_label_text': self.FUZZY_LABEL}
         )
 
 
@@ -184,31 +537,38 @@ class DateSearchFilter(SearchFilter):
     GET_DATE_TO = 'date_to'
 
     def __init__(self):
-        try:
-            self.min = EntryVersion.objects.order_by('entry_date').only('entry_date').first().entry_date
-        except AttributeError:
-            self.min = date.today()
-        self.date_from = self.min
-        self.max = date.today()
-        self.date_to = self.max
+        self.date_from = None
+        self.date_to = None
         self._active = False
 
+    @classmethod
+    def get_param_names(cls) -> tuple:
+        return cls.GET_DATE_FROM, cls.GET_DATE_TO
+
+    @property
+    def min(self) -> date:
+        return get_archive_stats()['min_date'] or date.today()
+
+    @property
+    def max(self) -> date:
+        return date.today()
+
     def as_url_param(self) -> str:
         return urlencode({
-            self.GET_DATE_FROM: self.date_from.strftime('%Y-%m-%d'),
-            self.GET_DATE_TO: self.date_to.strftime('%Y-%m-%d')
+            self.GET_DATE_FROM: (self.date_from or self.min).strftime('%Y-%m-%d'),
+            self.GET_DATE_TO: (self.date_to or self.max).strftime('%Y-%m-%d')
         })
 
     def _get_cache_key(self):
-        return "date_search_{}_{}".format(self.date_from, self.date_to)
+        return json.dumps(['date', self.date_from.strftime('%Y-%m-%d'), self.date_to.strftime('%Y-%m-%d')])
 
-    def get_entry_ids(self) -> frozenset:
-        # Search through the newest versions
+    def get_sql(self) -> tuple:
+        # Search through the dates of current versions, it's a range scan of an index
         # Date search ignores searchability on purpose!
-        entries = EntryVersion.objects.filter(entry_date__range=(self.date_from, self.date_to)).distinct('entry_id')
-        entries = entries & EntryVersion.newest.all()
-
-        return frozenset((eid, 0) for eid in entries.values_list('entry_id', flat=True))
+        sql = "SELECT id AS entry_id, 0 AS rank FROM palanaeum_entry WHERE {} BETWEEN %s AND %s".format(
+            ENTRY_DATE_FIELDS[_get_version_variant()]
+        )
+        return sql, [self.date_from, self.date_to]
 
     def init_from_get_params(self, get_params: QueryDict):
         try:
@@ -227,12 +587,13 @@ class DateSearchFilter(SearchFilter):
         return self._active
 
     def to_tr(self) -> str:
+        min_date = self.min
         return render_to_string(
             'palanaeum/search/filters/date_range_filter.html',
             {
-                'from_value': self.date_from.strftime('%Y-%m-%d'),
-                'to_value': self.date_to.strftime('%Y-%m-%d'),
-                'min_value': self.min.strftime('%Y-%m-%d'),
+                'from_value': (self.date_from or min_date).strftime('%Y-%m-%d'),
+                'to_value': (self.date_to or self.max).strftime('%Y-%m-%d'),
+                'min_value': min_date.strftime('%Y-%m-%d'),
                 'max_value': self.max.strftime('%Y-%m-%d'),
                 'from_field_name': self.GET_DATE_FROM,
                 'to_field_name': self.GET_DATE_TO,
@@ -241,22 +602,35 @@ class DateSearchFilter(SearchFilter):
 
 
 class SpeakerSearchFilter(TextSearchFilter):
-    GET_PARAM_NAME = 'speaker'
+    """
+    Search for entries with speakers matching given text query. Canonical names and aliases
+    of speakers are matched, the entries are found through the normalized speakers table.
+    """
+    # Names of speakers are aliased like the search vectors, so the rank expressions of text search apply
     SQL_QUERY = """\
-        SELECT esv.id, esv.entry_id, ts_rank(esv.speaker_vector, to_tsquery(%s), 32) + 1 as rank
-        FROM palanaeum_entrysearchvector esv
-        JOIN palanaeum_entry pe on esv.entry_id = pe.id
-        WHERE esv.speaker_vector @@ to_tsquery(%s) AND pe.searchable = True
+        SELECT es.entry_id, MAX({rank}{bonus}) AS rank
+        FROM (
+            SELECT s.id, to_tsvector('english', s.name || ' ' || array_to_string(s.aliases, ' ')) AS speaker_vector,
+                s.name || ' ' || array_to_string(s.aliases, ' ') AS speakers
+            FROM palanaeum_speaker s
+        ) esv
+        JOIN palanaeum_entryspeaker es ON es.speaker_id = esv.id AND es.{variant}
+        JOIN palanaeum_entry e ON es.entry_id = e.id
+        WHERE ({condition}) AND e.searchable = True
+        GROUP BY es.entry_id
         """
+    GET_PARAM_NAME = 'speaker'
+    VECTOR = 'speaker_vector'
+    TEXT = 'speakers'
+    INDEX_FIELD = 'speakers'
+    HIGHLIGHTED = False
     LABEL = _('Search for speaker:')
 
-    def __init__(self):
-        super(SpeakerSearchFilter, self).__init__()
-
 
 class TagSearchFilter(SearchFilter):
     GET_TAG_SEARCH = 'tags'
     LABEL = 'Search for tags:'
+    in_memory = True
 
     def __init__(self):
         self.tags = []
@@ -264,6 +638,10 @@ class TagSearchFilter(SearchFilter):
     def __bool__(self):
         return bool(self.tags)
 
+    @classmethod
+    def get_param_names(cls) -> tuple:
+        return cls.GET_TAG_SEARCH,
+
     def as_url_param(self) -> str:
         return "&".join(urlencode({self.GET_TAG_SEARCH: tag.name}) for tag in self.tags)
 
@@ -272,42 +650,26 @@ class TagSearchFilter(SearchFilter):
         self.tags = Tag.objects.annotate(name_lower=Lower('name')).filter(name_lower__in=tags)
         return bool(self.tags)
 
-    def get_entry_ids(self) -> frozenset:
+    def get_entry_ids(self) -> ScoredEntries:
         """
         Find entries that have at least one tag that we're looking for.
         Every tag gives +1 search rank. Tags are powerful!
         """
-        results = defaultdict(int)
-        cache_key = "search_tag_{}"
-        for tag in self.tags:
-            entries_with_tag = SEARCH_CACHE.get(cache_key.format(tag))
-
-            if not entries_with_tag:
-                # Tag search on purpose ignores the searchable attribute of entries!
-                # The `newest` managers filter gets joined with tags filter and as a result
-                # gives you the newest versions of entries that have the tag, not the
-                # entries that have the tag on their newest version.
-                entries_with_tag = EntryVersion.newest.filter(tags=tag).values_list('entry_id', flat=True)
-                real_entries_with_tag = set()
-                # So we need to check if the newest versions actually have the tag or not
-                for ev in EntryVersion.newest.filter(entry_id__in=entries_with_tag):
-                    if tag in ev.tags.all():
-                        real_entries_with_tag.add(ev.entry_id)
-
-                entries_with_tag = list(real_entries_with_tag)
-
-                SEARCH_CACHE.set(cache_key.format(tag), entries_with_tag, SEARCH_CACHE_TTL)
-
-            for entry_id in entries_with_tag:
-                results[entry_id] += 1
-
-        return frozenset(results.items())
+        # Tag search on purpose ignores the searchable attribute of entries!
+        variant = _get_version_variant()
+        mapped_index = inverted_index.get_inverted_index()
+        if mapped_index is not None:
+            return ScoredEntries.union_all(mapped_index.entries_with_term('tags', str(tag.id), variant, 1)
+                                           for tag in self.tags)
+        index = get_tag_index()
+        return ScoredEntries.union_all(ScoredEntries.from_bitmap(index.get_bitmap(tag.id, variant), 1)
+                                       for tag in self.tags)
+
+    def get_sql(self) -> tuple:
+        return self.get_entry_ids().as_sql()
 
     def _get_cache_key(self):
-        """
-        No general cache for this filter.
-        """
-        return None
+        return json.dumps([self.GET_TAG_SEARCH, sorted(tag.id for tag in self.tags)])
 
     def to_tr(self) -> str:
         return render_to_string(
@@ -327,15 +689,7 @@ class AntiTagSearchFilter(TagSearchFilter):
     """
     GET_TAG_SEARCH = 'antitag'
     LABEL = _('Exclude those tags:')
-
-    def get_entry_ids(self) -> frozenset:
-        """
-        Return only those Entries that don't have any required tags.
-        """
-        entries_that_have_tags = {i[0] for i in super(AntiTagSearchFilter, self).get_entry_ids()}
-        entries = Entry.objects.exclude(id__in=entries_that_have_tags).values_list('id', flat=True)
-
-        return frozenset((entry_id, 0) for entry_id in entries)
+    NEGATED = True
 
 
 SEARCH_FILTERS = [
@@ -347,11 +701,13 @@ SEARCH_FILTERS = [
 ]
 
 
-def init_filters(request) -> list:
+def init_filters(request, form: bool = False) -> list:
     """
     Read request params and load them into SearchFilter objects.
+    Only filters with their params present are created, unless all of them are needed to display the search form.
     """
-    filters = [search_filter() for search_filter in SEARCH_FILTERS]
+    filters = [search_filter() for search_filter in SEARCH_FILTERS
+               if form or any(param in request.GET for param in search_filter.get_param_names())]
 
     for search_filter in filters:
         search_filter.init_from_get_params(request.GET)
@@ -359,76 +715,591 @@ def init_filters(request) -> list:
     return filters
 
 
-def execute_filters(filters: list) -> dict:
+def execute_filters(filters: list) -> ScoredEntries:
     """
-    Execute provided filters, returning a map of entry_it -> score.
+    Execute provided filters, returning entries fulfilling all of them with summed scores.
     """
-    entries_scores = defaultdict(float)
-    entries_by_filter = defaultdict(set)
+    filters = [search_filter for search_filter in filters if search_filter]
+    required = [search_filter for search_filter in filters if not search_filter.NEGATED]
+
+    if required:
+        results = required[0].get_entry_ids()
+        for search_filter in required[1:]:
+            if not results:
+                break
+            results = results.intersection(search_filter.get_entry_ids())
+    elif filters:
+        results = ScoredEntries.from_ids(Entry.objects.values_list('id', flat=True))
+    else:
+        return ScoredEntries()
 
     for search_filter in filters:
-        if not search_filter:
-            continue
+        if search_filter.NEGATED and results:
+            results = results.difference(search_filter.get_entry_ids())
+    return results
 
-        search_filter_entry_ids = search_filter.get_entry_ids()
-        if not search_filter_entry_ids:
-            entries_by_filter.clear()
-            break
 
-        for entry_id, score in search_filter_entry_ids:
-            entries_by_filter[search_filter].add(entry_id)
-            entries_scores[entry_id] += score
+class SearchResults(Sequence):
+    """
+    Ordered sequence of (entry_id, rank) pairs matching a set of search filters.
 
-    if entries_by_filter:
-        good_ids = set.intersection(*entries_by_filter.values())
-    else:
-        good_ids = set()
-    entries_scores = {entry_id: score for entry_id, score in entries_scores.items() if entry_id in good_ids}
+    All filters are compiled into a single SQL query, that intersects and excludes
+    the results of filters, checks visibility, sums the scores and orders the results.
+    Only the requested slice of results is fetched from the database, the total count is
+    fetched (and cached) separately. Slices can be addressed by offset or by a keyset cursor
+    pointing to a result (see get_cursor).
+    """
+    SQL_QUERY = """\
+        {ctes}
+        SELECT e.id, {rank} AS rank, {sort_key} AS sort_key
+        FROM ({visible}) e
+        {joins}
+        WHERE {conditions}
+        """
+    ORDER_BY = " ORDER BY sort_key {direction} NULLS LAST, e.id"
+    # Results before a cursor are read backwards
+    REVERSED_ORDER_BY = " ORDER BY sort_key {direction} NULLS FIRST, e.id DESC"
+    REVERSED_DIRECTIONS = {'ASC': 'DESC', 'DESC': 'ASC'}
+    # ordering: (sort key, direction)
+    ORDERINGS = {
+        'rank': ('rank', 'DESC'),
+        '+date': ('date', 'ASC'),
+        '-date': ('date', 'DESC'),
+    }
+    # Conditions selecting results placed after or before the result with given (sort key, id)
+    KEYSET_AFTER = {
+        'DESC': "({key} < %s OR {key} IS NULL OR ({key} = %s AND e.id > %s))",
+        'ASC': "({key} > %s OR {key} IS NULL OR ({key} = %s AND e.id > %s))",
+    }
+    KEYSET_BEFORE = {
+        'DESC': "({key} > %s OR ({key} = %s AND e.id < %s))",
+        'ASC': "({key} < %s OR ({key} = %s AND e.id < %s))",
+    }
+    KEYSET_AFTER_NULL = "({key} IS NULL AND e.id > %s)"
+    KEYSET_BEFORE_NULL = "({key} IS NOT NULL OR e.id < %s)"
+    # Ids of the cached results, used by FACETS_QUERY instead of running the search again
+    CACHED_RESULTS_SQL = "SELECT unnest(%s::integer[]) AS id"
+    # Counts of results grouped by tags, speakers and events of current versions and by entry years,
+    # and the total count of results, all from one run of the search query
+    FACETS_QUERY = """\
+        WITH results AS MATERIALIZED (
+            SELECT e.id, e.event_id, e.{pointer} AS version_id, e.{date_field} AS entry_date
+            FROM ({sql}) search_results
+            JOIN palanaeum_entry e ON e.id = search_results.id
+        ),
+        facets AS (
+            SELECT 'tags' AS facet, t.name AS value, t.name AS label, COUNT(*) AS count
+            FROM results
+            JOIN palanaeum_entryversion_tags evt ON evt.entryversion_id = results.version_id
+            JOIN palanaeum_tag t ON t.id = evt.tag_id
+            GROUP BY t.name
+            UNION ALL
+            SELECT 'speakers', s.name, s.name, COUNT(*)
+            FROM results
+            JOIN palanaeum_entryspeaker es ON es.entry_id = results.id AND es.{variant}
+            JOIN palanaeum_speaker s ON s.id = es.speaker_id
+            GROUP BY s.id
+            UNION ALL
+            SELECT 'events', ev.id::text, ev.name, COUNT(*)
+            FROM results
+            JOIN palanaeum_event ev ON ev.id = results.event_id
+            GROUP BY ev.id
+            UNION ALL
+            SELECT 'years', year::text, year::text, COUNT(*)
+            FROM results
+            CROSS JOIN LATERAL CAST(EXTRACT(YEAR FROM results.entry_date) AS integer) AS year
+            WHERE results.entry_date IS NOT NULL
+            GROUP BY year
+            UNION ALL
+            SELECT 'total', NULL, NULL, COUNT(*)
+            FROM results
+        )
+        SELECT facet, value, label, count FROM (
+            SELECT facets.*, ROW_NUMBER() OVER (
+                PARTITION BY facet ORDER BY CASE WHEN facet = 'years' THEN label END, count DESC, label
+            ) AS number
+            FROM facets
+        ) ranked_facets
+        WHERE number <= %s OR facet = 'years'
+        ORDER BY facet, number
+        """
+    FACETS = ('tags', 'speakers', 'events', 'years')
+    FACETS_LIMIT = 10
+
+    def __init__(self, filters: list, ordering: str = 'rank'):
+        self.filters = [search_filter for search_filter in filters if search_filter]
+        self.ordering = ordering if ordering in self.ORDERINGS else 'rank'
+        self._total = None
+        self._offset = 0
+        self._rows = []
+        self._keys = []
+        self._cached = None
+        self._facets = None
+
+    def get_sql(self, keyset: str = None, keyset_params: list = ()) -> tuple:
+        """
+        Compose the SQL query returning all the results with their rank and sort key. The optional keyset
+        condition (see KEYSET_AFTER) limits them to the ones placed after or before a result.
+        The query isn't ordered, see ORDER_BY.
+        """
+        params = []
+        ctes = []
+        joins = []
+        conditions = ['True']
+        ranks = []
+
+        parts = [(search_filter.get_sql(), search_filter.NEGATED) for search_filter in self.filters
+                 if not search_filter.in_memory]
+        in_memory = [search_filter for search_filter in self.filters if search_filter.in_memory]
+        if any(not search_filter.NEGATED for search_filter in in_memory):
+            # Intersections, exclusions and scores of those are computed before asking the database
+            parts.append((execute_filters(in_memory).as_sql(), False))
+        else:
+            parts.extend((search_filter.get_sql(), search_filter.NEGATED) for search_filter in in_memory)
+
+        for i, ((filter_sql, filter_params), negated) in enumerate(parts):
+            name = 'filter_{}'.format(i)
+            ctes.append("{} AS ({})".format(name, filter_sql))
+            params.extend(filter_params)
+
+            if negated:
+                conditions.append("NOT EXISTS (SELECT 1 FROM {0} WHERE {0}.entry_id = e.id)".format(name))
+            else:
+                joins.append("JOIN {0} ON {0}.entry_id = e.id".format(name))
+                ranks.append("{}.rank".format(name))
+
+        # Ranks are sent back to the database in cursors, so they have to survive the round trip unchanged
+        rank = "({})::float8".format(" + ".join(ranks) or "0")
+        sort_key, direction = self.ORDERINGS[self.ordering]
+        date_field = ENTRY_DATE_FIELDS[_get_version_variant()]
+        if sort_key == 'date':
+            sort_key = 'e.{}'.format(date_field)
+        else:
+            sort_key = rank
+
+        visible_sql, visible_params = Entry.all_visible.order_by().values('id', date_field).query.sql_with_params()
+        params.extend(visible_params)
+        if keyset:
+            conditions.append(keyset.format(key=sort_key))
+            params.extend(keyset_params)
+
+        sql = self.SQL_QUERY.format(
+            ctes="WITH " + ",\n".join(ctes) if ctes else "", visible=visible_sql,
+            rank=rank, sort_key=sort_key, joins="\n".join(joins), conditions=" AND ".join(conditions)
+        )
+        return sql, params
+
+    def get_ordered_sql(self, keyset: str = None, keyset_params: list = (), reverse: bool = False) -> tuple:
+        """
+        Compose the SQL query returning the results in order (see get_sql).
+        """
+        sql, params = self.get_sql(keyset, keyset_params)
+        direction = self.ORDERINGS[self.ordering][1]
+        if reverse:
+            order_by = self.REVERSED_ORDER_BY.format(direction=self.REVERSED_DIRECTIONS[direction])
+        else:
+            order_by = self.ORDER_BY.format(direction=direction)
+        return sql + order_by, params
+
+    def _execute(self, sql: str, params: list) -> list:
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+        except ProgrammingError:
+            # Happens when users provide a text query that is not a correct tsquery
+            logger.warning("Search query failed to execute.", exc_info=True)
+            return []
+
+    def _store(self, rows: list, offset: int):
+        self._offset = offset
+        self._rows = [(entry_id, float(rank)) for entry_id, rank, _key in rows]
+        self._keys = [(key, entry_id) for entry_id, _rank, key in rows]
 
-    return entries_scores
+    def get_cache_key(self) -> str:
+        """
+        Return a key of the cached results, that is the same in every process for the same search.
+        """
+        filter_keys = sorted(search_filter._get_cache_key() for search_filter in self.filters)
+        key = json.dumps([get_search_generation(), _get_audience(), self.ordering, filter_keys])
+        return 'search_results_' + hashlib.sha1(key.encode()).hexdigest()
 
+    def _encode(self, rows: list) -> tuple:
+        """
+        Pack the full list of results into arrays of ids, ranks and, for date orderings, date ordinals.
+        """
+        ids = np.fromiter((row[0] for row in rows), dtype=np.uint32, count=len(rows))
+        ranks = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+        if self.ORDERINGS[self.ordering][0] == 'date':
+            keys = np.fromiter((row[2].toordinal() if row[2] else 0 for row in rows),
+                               dtype=np.int32, count=len(rows)).tobytes()
+        else:
+            keys = None
+        return ids.tobytes(), ranks.tobytes(), keys
 
-def get_search_results(entries_scores: dict, ordering: str) -> list:
+    def _load_cached_results(self) -> bool:
+        """
+        Load the full ranked list of results from the search cache, running the query on a miss.
+        Return False if the search cache is disabled.
+        """
+        # The backend may be wrapped in profiling.ProfilingCache
+        if isinstance(getattr(SEARCH_CACHE, 'cache', SEARCH_CACHE), DummyCache):
+            return False
+        if self._cached is None:
+            cache_key = self.get_cache_key()
+            data = SEARCH_CACHE.get(cache_key)
+            if data is None:
+                sql, params = self.get_ordered_sql()
+                data = self._encode(self._execute(sql, params))
+                SEARCH_CACHE.set(cache_key, data, SEARCH_CACHE_TTL)
+
+            ids = np.frombuffer(data[0], dtype=np.uint32)
+            ranks = np.frombuffer(data[1], dtype=np.float64)
+            keys = ranks if data[2] is None else np.frombuffer(data[2], dtype=np.int32)
+            self._cached = ids, ranks, keys
+            self._total = len(ids)
+        return True
+
+    def _store_cached(self, start: int, stop: int):
+        ids, ranks, keys = self._cached
+        start = max(start, 0)
+        stop = max(stop, start)
+        if keys is ranks:
+            window_keys = ranks[start:stop].tolist()
+        else:
+            window_keys = [date.fromordinal(key) if key else None for key in keys[start:stop].tolist()]
+        self._store(list(zip(ids[start:stop].tolist(), ranks[start:stop].tolist(), window_keys)),
+                    min(start, len(ids)))
+
+    def _find_cached(self, key, entry_id: int):
+        """
+        Return the index of the cached result with given sort key and entry id, or None.
+        """
+        ids, ranks, keys = self._cached
+        matches = np.flatnonzero(ids == entry_id)
+        if not len(matches):
+            return None
+        index = int(matches[0])
+        cached_key = keys[index].item()
+        if keys is not ranks:
+            cached_key = date.fromordinal(cached_key) if cached_key else None
+        return index if cached_key == key else None
+
+    def fetch(self, offset: int, limit: int) -> list:
+        """
+        Load `limit` results starting from `offset` and remember them with the total count.
+        """
+        offset = max(offset, 0)
+        if self._load_cached_results():
+            self._store_cached(offset, offset + limit)
+            return self._rows
+
+        sql, params = self.get_ordered_sql()
+        rows = self._execute(sql + " LIMIT %s OFFSET %s", params + [limit, offset])
+        if not rows and offset == 0:
+            self._total = 0
+        self._store(rows, offset)
+        return self._rows
+
+    def fetch_from_cursor(self, cursor: str, limit: int) -> int:
+        """
+        Load `limit` results placed after (or before) the result the cursor points to.
+        Return the offset of the first loaded result. Raise ValueError if the cursor is invalid.
+        """
+        key, entry_id, before, index = self.decode_cursor(cursor)
+
+        if self._load_cached_results():
+            index = self._find_cached(key, entry_id)
+            # When the result is gone, the cursor was created for an older generation of results
+            if index is not None:
+                if before:
+                    self._store_cached(index - limit, index)
+                else:
+                    self._store_cached(index + 1, index + 1 + limit)
+                return self._offset
+
+        if key is None:
+            keyset = self.KEYSET_BEFORE_NULL if before else self.KEYSET_AFTER_NULL
+            keyset_params = [entry_id]
+        else:
+            _sort_key, direction = self.ORDERINGS[self.ordering]
+            keyset = (self.KEYSET_BEFORE if before else self.KEYSET_AFTER)[direction]
+            keyset_params = [key, key, entry_id]
+
+        sql, params = self.get_ordered_sql(keyset, keyset_params, reverse=before)
+        rows = self._execute(sql + " LIMIT %s", params + [limit])
+        # Positions of results aren't computed, the cursor remembers the one it was made for
+        if before:
+            rows.reverse()
+            self._store(rows, max(index - len(rows), 0))
+        else:
+            self._store(rows, index + 1)
+        return self._offset
+
+    def get_cursor(self, index: int, before: bool = False) -> str:
+        """
+        Return a cursor pointing to the result at the given index. The cursor selects results placed
+        after that result, or before it if `before` is set.
+        """
+        if not (self._offset <= index < self._offset + len(self._keys)):
+            self.fetch(index, 1)
+        key, entry_id = self._keys[index - self._offset]
+        if isinstance(key, date):
+            key = key.isoformat()
+        data = json.dumps([self.ordering, key, entry_id, before, index], separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor: str) -> tuple:
+        """
+        Decode a cursor created by get_cursor into a (sort key, entry id, before, index) tuple.
+        Raise ValueError if the cursor is malformed or was created for another ordering.
+        """
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            ordering, key, entry_id, before, index = json.loads(data.decode())
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise ValueError("Malformed search cursor.")
+
+        if ordering != self.ordering or not isinstance(entry_id, int) or not isinstance(index, int) or index < 0:
+            raise ValueError("Search cursor doesn't match the ordering.")
+        if key is not None:
+            if self.ORDERINGS[ordering][0] == 'date':
+                key = date.fromisoformat(key)
+            elif isinstance(key, (int, float)):
+                key = float(key)
+            else:
+                raise ValueError("Malformed search cursor.")
+        return key, entry_id, bool(before), index
+
+    def get_facets(self) -> dict:
+        """
+        Return counts of all the results grouped by facets: the most common tags, speakers and events,
+        and all years of entries in order. Facets are cached together with the results.
+        The search query runs once for the facets and the total count, so call this before paginating.
+        """
+        if self._facets is not None:
+            return self._facets
+
+        cache_key = self.get_cache_key() + '_facets'
+        facets = SEARCH_CACHE.get(cache_key)
+        if facets is None:
+            variant = _get_version_variant()
+            if self._load_cached_results():
+                sql, params = self.CACHED_RESULTS_SQL, [self._cached[0].tolist()]
+            else:
+                sql, params = self.get_sql()
+            facets = {facet: [] for facet in self.FACETS}
+            for facet, value, label, count in self._execute(self.FACETS_QUERY.format(
+                    sql=sql, pointer=VARIANTS[variant], date_field=ENTRY_DATE_FIELDS[variant], variant=variant
+            ), params + [self.FACETS_LIMIT]):
+                if facet == 'total':
+                    if self._total is None:
+                        self._total = count
+                        SEARCH_CACHE.set(self.get_cache_key() + '_count', count, SEARCH_CACHE_TTL)
+                else:
+                    facets[facet].append({'value': value, 'label': label, 'count': count})
+            SEARCH_CACHE.set(cache_key, facets, SEARCH_CACHE_TTL)
+
+        self._facets = facets
+        return facets
+
+    def count(self) -> int:
+        if self._total is None and not self._load_cached_results():
+            cache_key = self.get_cache_key() + '_count'
+            self._total = SEARCH_CACHE.get(cache_key)
+            if self._total is None:
+                sql, params = self.get_sql()
+                rows = self._execute("SELECT COUNT(*) FROM ({}) results".format(sql), params)
+                self._total = rows[0][0] if rows else 0
+                SEARCH_CACHE.set(cache_key, self._total, SEARCH_CACHE_TTL)
+        return self._total
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            results = self[item:item + 1]
+            if not results:
+                raise IndexError(item)
+            return results[0]
+
+        start, stop, step = item.indices(self.count())
+        if start >= stop:
+            return []
+        if not (self._offset <= start and stop <= self._offset + len(self._rows)):
+            self.fetch(start, stop - start)
+        return self._rows[start - self._offset:stop - self._offset:step]
+
+
+class SearchPage(Page):
     """
-    Convert a map of {entry_id -> score} to an ordered list of (entry_id, score) pairs.
+    Page of search results, that may start at any offset when it was loaded from a cursor.
+    Provides cursors pointing to the next and previous pages.
     """
-    search_results = list(entries_scores.items())
+    def __init__(self, object_list, offset: int, paginator):
+        super().__init__(object_list, offset // paginator.per_page + 1, paginator)
+        self.offset = offset
+
+    def has_next(self):
+        return self.offset + len(self.object_list) < self.paginator.count
+
+    def has_previous(self):
+        return self.offset > 0
+
+    def previous_page_number(self):
+        return max(self.number - 1, 1)
 
-    # Show only visible entries
-    visible_entries_ids = set(Entry.all_visible.filter(pk__in=entries_scores.keys()).values_list('id', flat=True))
-    search_results = [sr for sr in search_results if sr[0] in visible_entries_ids]
+    def start_index(self):
+        return self.offset + 1 if self.object_list else 0
 
-    if ordering == 'rank':
-        search_results.sort(key=lambda i: i[1], reverse=True)
-    elif ordering in ('-date', '+date'):
-        entry_dates = {eid: edate for eid, edate in
-                       EntryVersion.newest.filter(entry_id__in=entries_scores.keys()).
-                       values_list('entry_id', 'entry_date')
-                       }
-        search_results.sort(key=lambda entry: entry_dates[entry[0]], reverse=ordering == '-date')
+    def end_index(self):
+        return self.offset + len(self.object_list)
 
-    return search_results
+    @property
+    def next_cursor(self):
+        if not self.has_next():
+            return None
+        return self.paginator.object_list.get_cursor(self.end_index() - 1)
 
+    @property
+    def previous_cursor(self):
+        if not (self.has_previous() and self.object_list):
+            return None
+        return self.paginator.object_list.get_cursor(self.offset, before=True)
 
-def paginate_search_results(request, search_results: list) -> tuple:
+
+class SearchPaginator(Paginator):
+    """
+    Paginator for SearchResults, that loads only the requested page and the total count.
+    Pages can also be loaded from keyset cursors, which stay stable when results are added or removed.
+    """
+    def page(self, number):
+        try:
+            page_number = max(int(number), 1)
+        except (TypeError, ValueError):
+            page_number = 1
+
+        if isinstance(self.object_list, SearchResults):
+            self.object_list.fetch((page_number - 1) * self.per_page, self.per_page + self.orphans)
+
+        return super().page(number)
+
+    def page_from_cursor(self, cursor: str) -> SearchPage:
+        """
+        Load the page of results the cursor points to. Raise ValueError if the cursor is invalid.
+        """
+        offset = self.object_list.fetch_from_cursor(cursor, self.per_page)
+        return SearchPage(self.object_list[offset:offset + self.per_page], offset, self)
+
+    def _get_page(self, object_list, number, paginator):
+        return SearchPage(object_list, (number - 1) * self.per_page, paginator)
+
+
+def get_search_results(filters: list, ordering: str) -> SearchResults:
+    """
+    Return a lazy, ordered sequence of (entry_id, score) pairs matching given filters.
+    """
+    return SearchResults(filters, ordering)
+
+
+def paginate_search_results(request, search_results: SearchResults, excerpts: bool = False) -> tuple:
     """
     Preload a page of search results. Return loaded entries, paginator object and page object.
+    With `excerpts` set, entries are loaded without their content, with highlighted excerpts instead
+    (see prefetch_excerpts).
     """
     page_length = UserSettings.get_page_length(request)
-    paginator = Paginator(search_results, page_length, orphans=page_length // 10)
+    paginator = SearchPaginator(search_results, page_length, orphans=page_length // 10)
 
     page_num = request.GET.get('page', '1')
+    cursor = request.GET.get('cursor')
 
     try:
-        page = paginator.page(page_num)
-    except PageNotAnInteger:
+        if cursor:
+            page = paginator.page_from_cursor(cursor)
+        else:
+            page = paginator.page(page_num)
+    except (PageNotAnInteger, ValueError):
         page = paginator.page(1)
     except EmptyPage:
         page = paginator.page(paginator.num_pages)
 
     entries_ids = [entry[0] for entry in page]
-    entries_map = Entry.prefetch_entries(entries_ids)
+    if excerpts:
+        entries_map = prefetch_excerpts(search_results.filters, entries_ids)
+    else:
+        entries_map = load_entries(entries_ids)
+        render_entries(entries_map.values(), request)
 
-    entries = [(entries_map[entry_id], rank) for entry_id, rank in page]
+    entries = [(entries_map[entry_id], rank) for entry_id, rank in page if entry_id in entries_map]
 
     return entries, paginator, page
+
+
+# Lines of a version are stripped from HTML, like in the search vectors, and highlighted all at once.
+# Stray angle brackets left after stripping are escaped, so highlights are the only markup in excerpts.
+EXCERPTS_SQL = """\
+    SELECT v.id, ts_headline('{config}', coalesce(lines.texts, ''), {query}, %s)
+    FROM palanaeum_entryversion v
+    LEFT JOIN LATERAL (
+        SELECT string_agg(replace(replace(regexp_replace(l.text, '<[^>]*>', ' ', 'g'), '<', '&lt;'), '>', '&gt;'),
+                          ' ' ORDER BY l."order") AS texts
+        FROM palanaeum_entryline l
+        WHERE l.entry_version_id = v.id
+    ) lines ON True
+    WHERE v.id = ANY(%s)
+    """
+EXCERPT_OPTIONS = 'StartSel=<mark>, StopSel=</mark>, MaxWords=35, MinWords=15'
+
+
+def _get_highlight_query(filters: list) -> tuple:
+    """
+    Return a (sql, params) tsquery of terms to highlight and a digest identifying it.
+    Without a text query, excerpts show the beginning of entries.
+    """
+    for search_filter in filters:
+        if search_filter and not search_filter.NEGATED:
+            query = search_filter.get_highlight_query()
+            if query is not None:
+                sql, params = query
+                digest = hashlib.sha1(json.dumps([sql, params]).encode()).hexdigest()
+                return (sql, params), digest
+    return ("''::tsquery", []), 'none'
+
+
+def prefetch_excerpts(filters: list, entries_ids: list) -> dict:
+    """
+    Load entries with highlighted excerpts of their current versions, instead of whole contents.
+    Return a map: entry_id -> entry, with the `excerpt` (HTML) and `excerpt_date` attributes set.
+
+    Excerpts are made by ts_headline in one query for all versions missing from the cache.
+    They're cached per query and version, the version date changes every time the version is edited.
+    """
+    variant = _get_version_variant()
+    version_field = VARIANTS[variant][:-len('_id')]
+    entries_map = {entry.id: entry for entry in Entry.all_visible.filter(id__in=entries_ids)
+                   .select_related('event', version_field)}
+    versions = {entry_id: getattr(entry, version_field) for entry_id, entry in entries_map.items()}
+
+    (query_sql, query_params), digest = _get_highlight_query(filters)
+    keys = {version.id: 'excerpt_{}_{}_{}'.format(digest, version.id, int(version.date.timestamp() * 1000))
+            for version in versions.values() if version is not None}
+    cached = SEARCH_CACHE.get_many(keys.values())
+    excerpts = {version_id: cached[key] for version_id, key in keys.items() if key in cached}
+
+    missing = [version_id for version_id in keys if version_id not in excerpts]
+    if missing:
+        with connection.cursor() as cursor:
+            cursor.execute(EXCERPTS_SQL.format(config=SearchQueryParser.CONFIG, query=query_sql),
+                           list(query_params) + [EXCERPT_OPTIONS, missing])
+            fresh = dict(cursor.fetchall())
+        excerpts.update(fresh)
+        SEARCH_CACHE.set_many({keys[version_id]: excerpt for version_id, excerpt in fresh.items()},
+                              SEARCH_CACHE_TTL)
+
+    for entry_id, entry in entries_map.items():
+        version = versions[entry_id]
+        entry.excerpt = mark_safe(excerpts.get(version.id, '')) if version is not None else ''
+        entry.excerpt_date = version.entry_date if version is not None else None
+    return entries_map
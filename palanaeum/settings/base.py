@@ -59,6 +59,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'palanaeum.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'palanaeum.middleware.TimezoneMiddleware',
@@ -71,7 +72,8 @@ ROOT_URLCONF = 'palanaeum.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django templates measured in profiled requests, see palanaeum.profiling
+        'BACKEND': 'palanaeum.profiling.ProfilingTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -165,18 +167,44 @@ CELERY_BEAT_SCHEDULE = {
     'upload_audio_sources_to_cloud': {
         'task': 'palanaeum.tasks.upload_new_sources_to_cloud',
         'schedule': timedelta(hours=1)
+    },
+    'update_search_index': {
+        'task': 'palanaeum.tasks.update_search_index',
+        'schedule': timedelta(minutes=1)
+    },
+    'clean_tag_index_changes': {
+        'task': 'palanaeum.tasks.clean_tag_index_changes',
+        'schedule': timedelta(hours=1)
+    },
+    'build_inverted_index': {
+        'task': 'palanaeum.tasks.build_inverted_index',
+        'schedule': timedelta(hours=1)
     }
 }
 
+# Backends are wrapped in ProfilingCache, so their hits are shown on the staff profiling page
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        'BACKEND': 'palanaeum.profiling.ProfilingCache',
+        'PROFILED_BACKEND': 'django.core.cache.backends.dummy.DummyCache',
     },
     'search': {
-        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        'BACKEND': 'palanaeum.profiling.ProfilingCache',
+        'PROFILED_BACKEND': 'django.core.cache.backends.dummy.DummyCache',
     },
     'config': {
-        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        'BACKEND': 'palanaeum.profiling.ProfilingCache',
+        'PROFILED_BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+    # Rendered entries, see palanaeum.fragments
+    'fragments': {
+        'BACKEND': 'palanaeum.profiling.ProfilingCache',
+        'PROFILED_BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+    # Rendered event pages, see palanaeum.page_cache
+    'pages': {
+        'BACKEND': 'palanaeum.profiling.ProfilingCache',
+        'PROFILED_BACKEND': 'django.core.cache.backends.dummy.DummyCache',
     }
 }
 
@@ -195,6 +223,18 @@ except FileExistsError:
 
 LOGIN_REDIRECT_URL = '/'
 
+# Search engine used by text, speaker and tag filters: 'postgres' or 'inverted_index'.
+# The inverted index has to be built with the build_inverted_index command (and is rebuilt hourly).
+SEARCH_BACKEND = 'postgres'
+INVERTED_INDEX_DIR = os.path.join(BASE_DIR, 'search_index')
+
+# Fraction of requests profiled by ProfilingMiddleware, summarized on the staff profiling page.
+# Profiles are kept in memory of every process, the last PROFILING_BUFFER_SIZE of them.
+PROFILING_SAMPLE_RATE = 0.0
+PROFILING_BUFFER_SIZE = 1000
+# Interval of stack samples of ?profile=1 requests, in seconds
+PROFILING_INTERVAL = 0.001
+
 # Fine Uploader settings
 UPLOAD_DIRECTORY = '/tmp/palanaeum_uploads/done/'
 CHUNKS_DIRECTORY = '/tmp/palanaeum_uploads/chunks/'
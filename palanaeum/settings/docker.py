@@ -41,15 +41,29 @@ THUMBNAIL_REDIS_HOST = 'redis'
 # Set a proper cache backend
 # https://docs.djangoproject.com/en/1.10/ref/settings/#caches
 # I suggest using Redis with django-redis-cache
+# Backends are wrapped in ProfilingCache, so their hits are shown on the staff profiling page
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.dummy.DummyCache'
+        'BACKEND': 'palanaeum.profiling.ProfilingCache',
+        'PROFILED_BACKEND': 'django.core.cache.backends.dummy.DummyCache',
     },
     'search': {
-        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        'BACKEND': 'palanaeum.profiling.ProfilingCache',
+        'PROFILED_BACKEND': 'django.core.cache.backends.dummy.DummyCache',
     },
     'config': {
-        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        'BACKEND': 'palanaeum.profiling.ProfilingCache',
+        'PROFILED_BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+    # Rendered entries, see palanaeum.fragments
+    'fragments': {
+        'BACKEND': 'palanaeum.profiling.ProfilingCache',
+        'PROFILED_BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+    # Rendered event pages, see palanaeum.page_cache
+    'pages': {
+        'BACKEND': 'palanaeum.profiling.ProfilingCache',
+        'PROFILED_BACKEND': 'django.core.cache.backends.dummy.DummyCache',
     }
 }
 
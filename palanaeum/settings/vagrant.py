@@ -37,10 +37,12 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 # Set a proper cache backend
 # https://docs.djangoproject.com/en/1.10/ref/settings/#caches
 # I suggest using Redis with django-redis-cache
+# Backends are wrapped in ProfilingCache, so their hits are shown on the staff profiling page
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
-        # 'BACKEND': 'redis_cache.RedisCache',
+        'BACKEND': 'palanaeum.profiling.ProfilingCache',
+        'PROFILED_BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        # 'PROFILED_BACKEND': 'redis_cache.RedisCache',
         # 'LOCATION': '/var/run/redis/redis.sock',
         # 'OPTIONS': {
         #     'DB': 1,
@@ -50,10 +52,22 @@ CACHES = {
         # },
     },
     'search': {
-        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        'BACKEND': 'palanaeum.profiling.ProfilingCache',
+        'PROFILED_BACKEND': 'django.core.cache.backends.dummy.DummyCache',
     },
     'config': {
-        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        'BACKEND': 'palanaeum.profiling.ProfilingCache',
+        'PROFILED_BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+    # Rendered entries, see palanaeum.fragments
+    'fragments': {
+        'BACKEND': 'palanaeum.profiling.ProfilingCache',
+        'PROFILED_BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+    # Rendered event pages, see palanaeum.page_cache
+    'pages': {
+        'BACKEND': 'palanaeum.profiling.ProfilingCache',
+        'PROFILED_BACKEND': 'django.core.cache.backends.dummy.DummyCache',
     }
 }
 
@@ -1,11 +1,13 @@
 # coding=utf-8
 import json
 import logging
+import os
 import re
 from collections import defaultdict
 from datetime import datetime
 
 import bleach
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
@@ -22,12 +24,12 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST, require_GET
 from lxml.html.diff import htmldiff
 
-from palanaeum import tasks
+from palanaeum import tasks, profiling
 from palanaeum.configuration import get_config
 from palanaeum.decorators import json_response, AjaxException
 from palanaeum.forms import EventForm, ImageRenameForm, HelpPageForm
 from palanaeum.models import Event, AudioSource, Entry, Snippet, EntryLine, \
-    EntryVersion, URLSource, ImageSource, HelpPage
+    EntryVersion, URLSource, ImageSource, HelpPage, SearchIndexUpdate, Speaker
 from palanaeum.utils import is_contributor
 
 
@@ -106,8 +108,10 @@ def move_entry(request, entry_id):
     if request.method == 'POST':
         new_event = get_object_or_404(Event, pk=request.POST['event_id'])
         entry.order = Entry.objects.filter(event=new_event).order_by('-order').first().order + 1
+        old_event_id = entry.event_id
         entry.event = new_event
         entry.save()
+        Speaker.recount_events([old_event_id, new_event.id])
         messages.success(request, _("Entry moved successfully."))
         return redirect('view_event_no_title', new_event.id)
 
@@ -731,7 +735,6 @@ def _save_entry_url_sources(request, entry_version: EntryVersion):
             url_obj.save()
 
         url_obj.entry_versions.add(entry_version)
-        url_obj.save()
 
     URLSource.remove_unused()
 
@@ -810,6 +813,8 @@ def save_entry(request):
     # Save by staff member approves by default
     if request.user.is_staff:
         entry_version.approve(request.user)
+    else:
+        entry.update_version_pointers()
 
     logging.getLogger('palanaeum.staff').info("Entry %s updated by %s", entry.id, request.user)
 
@@ -1135,7 +1140,24 @@ def staff_cp(request):
 
     help_pages = HelpPage.objects.order_by('path', '-date').distinct('path')
 
-    return render(request, 'palanaeum/staff/staff_cp.html', {'page': 'index', 'help_pages': help_pages})
+    return render(request, 'palanaeum/staff/staff_cp.html',
+                  {'page': 'index', 'help_pages': help_pages,
+                   'search_index_queue': SearchIndexUpdate.objects.count(),
+                   'search_index_lag': SearchIndexUpdate.get_lag().total_seconds()})
+
+
+@staff_member_required(login_url='auth_login')
+def staff_cp_profiling(request):
+    """
+    Display the slowest endpoints among the requests profiled by this process, with their most repeated queries.
+    """
+    records = profiling.get_records()
+    slowest = sorted(records, key=lambda record: -record.total_ms)[:20]
+
+    return render(request, 'palanaeum/staff/staff_cp_profiling.html',
+                  {'page': 'profiling', 'endpoints': profiling.summarize(records), 'slowest': slowest,
+                   'records_count': len(records), 'sample_rate': settings.PROFILING_SAMPLE_RATE,
+                   'process_id': os.getpid()})
 
 
 @staff_member_required(login_url='auth_login')
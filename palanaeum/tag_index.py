@@ -0,0 +1,278 @@
+"""
+In-memory index of tags of the current versions of entries.
+
+For every tag the index keeps a bitmap (a Python int) with bits of entries having that tag set,
+so combinations of tags are answered by a few bitwise operations instead of a database query.
+There are two variants of the index: the newest versions, seen by logged in users,
+and the newest approved versions, seen by everybody else.
+
+The index is loaded once per process (from a snapshot shared in the search cache if possible)
+and then patched incrementally using the TagIndexChange log, that's written every time
+the tags or the current versions of entries change. The log is read at most every TAG_INDEX_REFRESH_INTERVAL
+seconds, unless this process made a change itself (see changes_recorded). Other in-memory indexes of entries
+can follow the same log by subclassing ChangeLogIndex.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.core.cache import caches
+from django.db import connection, transaction
+
+from palanaeum.scoring import bitmap_to_array
+
+logger = logging.getLogger('palanaeum.tag_index')
+
+# Version pointer columns of entries, that define the current versions in each variant
+VARIANTS = {
+    'newest': 'newest_version_id',
+    'approved': 'newest_approved_version_id',
+}
+# After that many seconds the index is loaded from scratch, older change log records can be dropped
+TAG_INDEX_MAX_AGE = 60 * 60
+# Changes committed that many seconds after they were logged are still noticed
+TAG_INDEX_CHANGE_WINDOW = timedelta(minutes=1)
+# Changes recorded by other processes are noticed after up to that many seconds
+TAG_INDEX_REFRESH_INTERVAL = 5
+
+TAGS_SQL = """\
+    SELECT e.id, evt.tag_id
+    FROM palanaeum_entry e
+    JOIN palanaeum_entryversion_tags evt ON evt.entryversion_id = e.{pointer}
+    """
+LAST_CHANGE_SQL = "SELECT now(), COALESCE(MAX(id), 0) FROM palanaeum_tagindexchange"
+CHANGES_SQL = """\
+    SELECT now(), COALESCE(MAX(id), 0), array_agg(id), array_agg(entry_id)
+    FROM palanaeum_tagindexchange
+    WHERE id > %s OR date >= %s
+    """
+
+
+def bitmap_to_ids(bitmap: int) -> list:
+    """
+    Return a sorted list of positions of set bits.
+    """
+    return bitmap_to_array(bitmap).tolist()
+
+
+def ids_to_bitmap(ids: np.ndarray) -> int:
+    """
+    Return a bitmap with bits of given positions set, built at once instead of bit by bit.
+    """
+    if not len(ids):
+        return 0
+    bits = np.zeros(ids.max() + 1, dtype=bool)
+    bits[ids] = True
+    return int.from_bytes(np.packbits(bits, bitorder='little').tobytes(), 'little')
+
+
+class ChangeLogIndex:
+    """
+    Base class of in-memory indexes of entries, that are patched using the TagIndexChange log.
+    Subclasses implement loading of all entries and of the given ones.
+    """
+    def __init__(self):
+        self.last_change_id = 0
+        self.checked_date = None
+        self.loaded = time.time()
+        self._applied_changes = set()
+
+    def load(self):
+        """
+        Load the whole index from the database.
+        """
+        with connection.cursor() as cursor:
+            # Changes logged while loading are applied again later, that's harmless
+            cursor.execute(LAST_CHANGE_SQL)
+            self.checked_date, self.last_change_id = cursor.fetchone()
+        self.load_entries()
+        self.loaded = time.time()
+
+    def load_entries(self):
+        raise NotImplementedError
+
+    def update_entries(self, entries_ids: list):
+        """
+        Reload given entries.
+        """
+        raise NotImplementedError
+
+    def refresh(self):
+        """
+        Apply changes logged since the last refresh.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(CHANGES_SQL, [self.last_change_id, self.checked_date - TAG_INDEX_CHANGE_WINDOW])
+            checked_date, last_change_id, change_ids, entries_ids = cursor.fetchone()
+
+        # Older changes are read again for a while, in case their transactions committed late
+        changed = {entry_id for change_id, entry_id in zip(change_ids or [], entries_ids or [])
+                   if change_id not in self._applied_changes}
+        self._applied_changes = set(change_ids or [])
+        self.checked_date = checked_date
+        self.last_change_id = max(self.last_change_id, last_change_id)
+        if changed:
+            self.update_entries(list(changed))
+
+
+class TagIndex(ChangeLogIndex):
+    """
+    Bitmaps of entries having each tag, in each variant of current versions.
+    """
+    def __init__(self):
+        super().__init__()
+        self.bitmaps = {variant: defaultdict(int) for variant in VARIANTS}
+        self.entry_tags = {variant: {} for variant in VARIANTS}
+
+    def load_entries(self):
+        with connection.cursor() as cursor:
+            for variant, pointer in VARIANTS.items():
+                cursor.execute(TAGS_SQL.format(pointer=pointer))
+                rows = cursor.fetchall()
+                entry_tags = defaultdict(set)
+                for entry_id, tag_id in rows:
+                    entry_tags[entry_id].add(tag_id)
+                self.entry_tags[variant] = {entry_id: frozenset(tags) for entry_id, tags in entry_tags.items()}
+
+                # Entries are grouped by tag, every bitmap is built once
+                pairs = np.array(rows, dtype=np.int64).reshape(-1, 2)
+                pairs = pairs[np.argsort(pairs[:, 1], kind='stable')]
+                tags_ids, starts = np.unique(pairs[:, 1], return_index=True)
+                self.bitmaps[variant] = defaultdict(int, {
+                    tag_id: ids_to_bitmap(entries_ids)
+                    for tag_id, entries_ids in zip(tags_ids.tolist(), np.split(pairs[:, 0], starts[1:]))
+                })
+
+    def update_entries(self, entries_ids: list):
+        with connection.cursor() as cursor:
+            for variant, pointer in VARIANTS.items():
+                cursor.execute(TAGS_SQL.format(pointer=pointer) + " WHERE e.id = ANY(%s)", [entries_ids])
+                new_tags = defaultdict(set)
+                for entry_id, tag_id in cursor.fetchall():
+                    new_tags[entry_id].add(tag_id)
+
+                bitmaps = self.bitmaps[variant]
+                entry_tags = self.entry_tags[variant]
+                for entry_id in entries_ids:
+                    old = entry_tags.pop(entry_id, frozenset())
+                    new = frozenset(new_tags.get(entry_id, ()))
+                    if new:
+                        entry_tags[entry_id] = new
+                    for tag_id in old - new:
+                        bitmaps[tag_id] &= ~(1 << entry_id)
+                    for tag_id in new - old:
+                        bitmaps[tag_id] |= 1 << entry_id
+
+    def get_bitmap(self, tag_id: int, variant: str) -> int:
+        return self.bitmaps[variant].get(tag_id, 0)
+
+    def union(self, tags_ids, variant: str) -> int:
+        """
+        Return a bitmap of entries having at least one of given tags.
+        """
+        bitmap = 0
+        for tag_id in tags_ids:
+            bitmap |= self.get_bitmap(tag_id, variant)
+        return bitmap
+
+    def intersection(self, tags_ids, variant: str) -> int:
+        """
+        Return a bitmap of entries having all given tags.
+        """
+        tags_ids = list(tags_ids)
+        if not tags_ids:
+            return 0
+        bitmap = self.get_bitmap(tags_ids[0], variant)
+        for tag_id in tags_ids[1:]:
+            bitmap &= self.get_bitmap(tag_id, variant)
+        return bitmap
+
+
+# Indexes held by this process, see changes_recorded
+_shared_indexes = []
+
+
+class SharedIndex:
+    """
+    Holds the index of this process. A fresh index is loaded from a snapshot shared by all processes
+    in the search cache, or from the database if there's no recent snapshot.
+    """
+    def __init__(self, index_class, cache_key: str, refresh_interval: float = TAG_INDEX_REFRESH_INTERVAL):
+        self.index_class = index_class
+        self.cache_key = cache_key
+        self.refresh_interval = refresh_interval
+        self._index = None
+        self._refreshed = 0.0
+        self._lock = threading.Lock()
+        _shared_indexes.append(self)
+
+    def get(self):
+        """
+        Return the index, up to date with the changes committed by this process
+        and with the ones committed by others until the last refresh.
+        """
+        with self._lock:
+            if self._index is None or time.time() - self._index.loaded > TAG_INDEX_MAX_AGE:
+                self._index = self._load()
+                self._refreshed = 0.0
+            if time.time() - self._refreshed > self.refresh_interval:
+                self._index.refresh()
+                self._refreshed = time.time()
+            return self._index
+
+    def _load(self):
+        search_cache = caches['search']
+        index = search_cache.get(self.cache_key)
+        if index is not None and time.time() - index.loaded <= TAG_INDEX_MAX_AGE:
+            return index
+
+        start = time.time()
+        index = self.index_class()
+        index.load()
+        logger.info("%s loaded in %.3f s.", self.index_class.__name__, time.time() - start)
+        search_cache.set(self.cache_key, index, TAG_INDEX_MAX_AGE)
+        return index
+
+    def reset(self):
+        """
+        Forget the index of this process, it will be loaded again when needed.
+        """
+        with self._lock:
+            self._index = None
+
+    def expire(self):
+        """
+        Make the next use of the index read the change log.
+        """
+        self._refreshed = 0.0
+
+
+_tag_index = SharedIndex(TagIndex, 'tag_index_snapshot')
+
+
+def get_tag_index() -> TagIndex:
+    """
+    Return the tag index of this process, refreshed if needed (see SharedIndex.get).
+    """
+    return _tag_index.get()
+
+
+def reset_tag_index():
+    _tag_index.reset()
+
+
+def _expire_indexes():
+    for shared_index in _shared_indexes:
+        shared_index.expire()
+
+
+def changes_recorded():
+    """
+    Make all indexes of this process apply the changes, that it has just made, right away and after the commit.
+    Other processes notice them after their refresh interval.
+    """
+    _expire_indexes()
+    transaction.on_commit(_expire_indexes)
@@ -1,6 +1,7 @@
 # coding=utf-8
 import datetime
 import logging
+import operator
 import os.path
 import pathlib
 import re
@@ -9,18 +10,33 @@ import subprocess
 import tempfile
 import time
 import zipfile
+from functools import reduce
 
 from django.conf import settings
 from django.core import management
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from kombu.exceptions import OperationalError
 
+from palanaeum import inverted_index
 from palanaeum.celery import app
 from palanaeum.cloud import get_cloud_backend
 from palanaeum.cloud.exceptions import PalanaeumCloudError
 from palanaeum.configuration import get_config
-from palanaeum.models import AudioSource, Snippet
+from palanaeum.models import AudioSource, Snippet, EntrySearchVector, SearchIndexUpdate, TagIndexChange
+from palanaeum.related import update_signatures
+from palanaeum.tag_index import TAG_INDEX_MAX_AGE
 
 logger = logging.getLogger('palanaeum.celery')
 
+# Changes queued within this many seconds are reindexed by a single task run
+SEARCH_INDEX_UPDATE_WINDOW = 2
+SEARCH_INDEX_UPDATE_BATCH = 100
+# Entries claimed by a worker which didn't finish them in this many seconds are processed again
+SEARCH_INDEX_CLAIM_TIMEOUT = 10 * 60
+
 
 @app.task(ignore_result=True)
 def transcode_source(audio_source_id: int):
@@ -227,3 +243,74 @@ def upload_new_sources_to_cloud():
                 logger.info("File %s deleted.", source.raw_file.path)
         except PalanaeumCloudError:
             logger.exception("An error occurred while uploading source %s", source)
+
+
+def schedule_search_index_update():
+    """
+    Make sure that the search index update queue is processed in a moment.
+    """
+    if not caches['default'].add('search_index_update_scheduled', True, SEARCH_INDEX_UPDATE_WINDOW):
+        return
+    try:
+        update_search_index.apply_async(countdown=SEARCH_INDEX_UPDATE_WINDOW)
+    except OperationalError:
+        # The periodic run of the task will take care of the queue
+        logger.warning("Couldn't schedule a search index update.", exc_info=True)
+
+
+@app.task(ignore_result=True)
+def update_search_index(batch_size: int = SEARCH_INDEX_UPDATE_BATCH):
+    """
+    Recalculate search vectors and similarity signatures of all queued entries, processing them in batches.
+    """
+    logger.info("Search index lag: %.1f seconds.", SearchIndexUpdate.get_lag().total_seconds())
+    updated = 0
+
+    while True:
+        with transaction.atomic():
+            # Entries queued by uncommitted transactions or claimed by other workers are skipped
+            claim_cutoff = timezone.now() - datetime.timedelta(seconds=SEARCH_INDEX_CLAIM_TIMEOUT)
+            batch = list(SearchIndexUpdate.objects.select_for_update(skip_locked=True)
+                         .filter(Q(claimed_date__isnull=True) | Q(claimed_date__lt=claim_cutoff))
+                         .order_by('queued_date')[:batch_size])
+            if not batch:
+                break
+            SearchIndexUpdate.objects.filter(id__in=[update.id for update in batch]).update(claimed_date=timezone.now())
+
+        # The queue isn't locked anymore, changed entries are queued again without waiting for the batch
+        with transaction.atomic():
+            entries_ids = [update.entry_id for update in batch]
+            EntrySearchVector.update_entries(entries_ids)
+            update_signatures(entries_ids)
+            # Entries queued again while their vectors were being calculated have a new queued_date and stay
+            SearchIndexUpdate.objects.filter(
+                reduce(operator.or_, (Q(id=update.id, queued_date=update.queued_date) for update in batch))
+            ).delete()
+            updated += len(batch)
+
+    if updated:
+        logger.info("Search vectors of %d entries updated.", updated)
+
+
+@app.task(ignore_result=True)
+def clean_tag_index_changes():
+    """
+    Delete changes of tags, that every process has already applied to its tag index.
+    """
+    # Indexes older than TAG_INDEX_MAX_AGE are loaded from scratch, so they don't need the log
+    cutoff = timezone.now() - datetime.timedelta(seconds=2 * TAG_INDEX_MAX_AGE)
+    deleted, _ = TagIndexChange.objects.filter(date__lt=cutoff).delete()
+    logger.info("Deleted %d tag index changes.", deleted)
+
+
+@app.task(ignore_result=True)
+def build_inverted_index():
+    """
+    Export a new build of the inverted index, if it's the search backend.
+    Processes switch to it before the change log of the previous build gets cleaned.
+    """
+    if not inverted_index.is_enabled():
+        return
+    start = time.time()
+    path = inverted_index.build_index()
+    logger.info("Inverted index %s built in %.3f s.", path, time.time() - start)
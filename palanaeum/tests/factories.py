@@ -36,6 +36,12 @@ class EntryVersionFactory(factory.django.DjangoModelFactory):
     entry = factory.SubFactory(EntryFactory)
     user = factory.SubFactory(UserFactory)
 
+    @factory.post_generation
+    def version_pointers(self, create, extracted, **kwargs):
+        # Like the editor does after saving a version
+        if create:
+            self.entry.update_version_pointers()
+
 
 class EntryLineFactory(factory.django.DjangoModelFactory):
     class Meta:
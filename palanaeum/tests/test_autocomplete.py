@@ -0,0 +1,99 @@
+import json
+import time
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.urls import reverse
+
+from palanaeum.autocomplete import AUTOCOMPLETE_REFRESH_INTERVAL, AutocompleteIndex, autocomplete, \
+    reset_autocomplete
+from palanaeum.models import Entry, Event, Tag
+from palanaeum.tests.factories import EventFactory, EntryFactory, EntryVersionFactory, EntryLineFactory
+
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        reset_autocomplete()
+        for name in ('shards', 'stormlight archive'):
+            Tag.objects.create(name=name)
+        event = EventFactory()
+        event.tags.add(Tag.objects.create(name='shardblade'))
+        self.entry = EntryFactory(event=event)
+        self.version = EntryVersionFactory(entry=self.entry, is_approved=True)
+        EntryLineFactory(entry_version=self.version, speaker='Brandon Sanderson')
+        self.version.update_tags('shardblade, shards, stormlight archive')
+        self.other = EntryFactory(event=event)
+        self.other_version = EntryVersionFactory(entry=self.other, is_approved=True)
+        EntryLineFactory(entry_version=self.other_version, speaker='Brandon Sanderson')
+        EntryLineFactory(entry_version=self.other_version, speaker='Questioner')
+        self.other_version.update_tags('shards')
+
+    def tearDown(self):
+        reset_autocomplete()
+        Entry.objects.all().delete()
+        Event.objects.all().delete()
+
+    def test_lookup(self):
+        index = AutocompleteIndex()
+        index.load()
+        self.assertEqual(index.lookup('tags', 'Shard'), [('shardblade', 2), ('shards', 2)])
+        self.assertEqual(index.lookup('tags', 'shard', 1), [('shardblade', 2)])
+        self.assertEqual(index.lookup('tags', 'arch'), [('stormlight archive', 1)])
+        self.assertEqual(index.lookup('speakers', 'sanderson'), [('Brandon Sanderson', 2)])
+        self.assertEqual(index.lookup('speakers', 'x'), [])
+
+    def test_edits_are_applied(self):
+        self.assertEqual(autocomplete('tags', 'shards'), [('shards', 2)])
+        self.other_version.add_tag('stormlight archive')
+        self.version.remove_tag('shards')
+        self.assertEqual(autocomplete('tags', 'shards'), [('shards', 1)])
+        self.assertEqual(autocomplete('tags', 'storm'), [('stormlight archive', 2)])
+
+    def test_unapproved_versions(self):
+        self.assertEqual(autocomplete('tags', 'storm'), [('stormlight archive', 1)])
+        version = EntryVersionFactory(entry=self.other, is_approved=False)
+        version.update_tags('stormlight archive')
+        self.assertEqual(autocomplete('tags', 'storm'), [('stormlight archive', 1)])
+        version.approve(None)
+        self.assertEqual(autocomplete('tags', 'storm'), [('stormlight archive', 2)])
+
+    def test_tags_and_events(self):
+        self.assertEqual(autocomplete('tags', 'cosm'), [])
+        Tag.objects.create(name='cosmere')
+        self.assertEqual(autocomplete('tags', 'cosm'), [('cosmere', 0)])
+        self.entry.event.add_tag('cosmere')
+        self.assertEqual(autocomplete('tags', 'cosm'), [('cosmere', 1)])
+
+        # Tags used only on unapproved versions are suggested too
+        Tag.objects.create(name='unapproved tag')
+        version = EntryVersionFactory(entry=self.other, is_approved=False)
+        version.update_tags('shards, unapproved tag')
+        self.assertEqual(autocomplete('tags', 'unappr'), [('unapproved tag', 0)])
+
+        # Unused tags are deleted
+        self.entry.event.remove_tag('shardblade')
+        self.assertEqual(autocomplete('tags', 'shardb'), [('shardblade', 1)])
+        self.version.remove_tag('shardblade')
+        self.assertEqual(autocomplete('tags', 'shardb'), [])
+
+    def test_changes_of_other_processes(self):
+        autocomplete('tags', 'cosm')
+        Tag.objects.bulk_create([Tag(name='cosmere')])
+        self.assertEqual(autocomplete('tags', 'cosm'), [])
+        with patch('palanaeum.tag_index.time.time', return_value=time.time() + AUTOCOMPLETE_REFRESH_INTERVAL + 1):
+            self.assertEqual(autocomplete('tags', 'cosm'), [('cosmere', 0)])
+
+    def test_refresh_interval(self):
+        autocomplete('tags', 'shard')
+        with self.assertNumQueries(0):
+            autocomplete('tags', 'shards')
+
+    def test_views(self):
+        response = self.client.get(reverse('get_tags'), {'q': 'shard'})
+        self.assertEqual(json.loads(response.content.decode())['results'],
+                         [{'id': 'shardblade', 'text': 'shardblade (2)'}, {'id': 'shards', 'text': 'shards (2)'}])
+        response = self.client.get(reverse('autocomplete', args=('speakers',)), {'q': 'quest'})
+        self.assertEqual(json.loads(response.content.decode())['results'],
+                         [{'id': 'Questioner', 'text': 'Questioner', 'count': 1}])
+        response = self.client.get(reverse('autocomplete', args=('events',)), {'q': 'quest'})
+        self.assertEqual(response.status_code, 404)
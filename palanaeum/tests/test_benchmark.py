@@ -0,0 +1,48 @@
+from django.http import QueryDict
+from django.test import TestCase
+
+from palanaeum.benchmark import SCENARIOS, SEARCHES, clear_archive, generate_archive, run_benchmarks, \
+    format_measurements
+from palanaeum.models import Entry, EntrySearchVector, EntryVersion, Event, URLSource
+from palanaeum.search import SearchResults, TextSearchFilter
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        progress = []
+        self.created = generate_archive(60, batch_size=25, progress=progress.append, entries_per_event=20)
+        self.progress = progress
+
+    def tearDown(self):
+        Entry.objects.all().delete()
+        Event.objects.all().delete()
+
+    def test_generate_archive(self):
+        self.assertEqual(self.created, 60)
+        self.assertEqual(self.progress, [25, 50, 60])
+        self.assertEqual(Entry.objects.count(), 60)
+        self.assertEqual(Event.objects.count(), 3)
+        self.assertGreaterEqual(EntryVersion.objects.count(), 60)
+        self.assertEqual(EntrySearchVector.objects.count(), 60)
+        self.assertFalse(Entry.objects.filter(newest_version=None).exists())
+        self.assertTrue(URLSource.objects.exists())
+
+        search_filter = TextSearchFilter()
+        search_filter.init_from_get_params(QueryDict('query=hoid'))
+        self.assertGreater(len(SearchResults([search_filter])), 0)
+
+    def test_same_seed_same_archive(self):
+        texts = list(EntryVersion.objects.order_by('id', 'lines__order').values_list('lines__text', flat=True))
+        clear_archive()
+        self.assertFalse(Entry.objects.exists())
+        generate_archive(60, batch_size=25, entries_per_event=20)
+        self.assertEqual(list(EntryVersion.objects.order_by('id', 'lines__order').values_list('lines__text', flat=True)), texts)
+
+    def test_run_benchmarks(self):
+        measurements = run_benchmarks(repeat=2)
+        self.assertEqual({measurement.scenario for measurement in measurements}, set(SCENARIOS))
+        self.assertEqual(len(measurements), (len(SCENARIOS) - 1) * len(SEARCHES) + 1)
+        for measurement in measurements:
+            self.assertGreater(measurement.queries, 0)
+            self.assertLessEqual(measurement.p50, measurement.p95)
+        self.assertIn('view_event', format_measurements(measurements))
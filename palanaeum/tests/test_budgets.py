@@ -0,0 +1,35 @@
+import os
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from palanaeum.benchmark import generate_archive
+from palanaeum.budgets import BUDGET_DATASET, REQUESTS, check_budgets, count_duplicates, get_signature, \
+    load_budgets, replay_requests, save_budgets
+
+
+class BudgetTests(TestCase):
+    def test_signatures(self):
+        self.assertEqual(get_signature("SELECT * FROM t WHERE a = 12 AND b = 'it''s' AND c IN (1, 2, 3)"),
+                         "SELECT * FROM t WHERE a = ? AND b = ? AND c IN (?)")
+        duplicates = count_duplicates([{'sql': "SELECT 1 FROM t WHERE id = 1"}, {'sql': "SELECT 1 FROM t WHERE id = 2"},
+                                       {'sql': "SELECT 2"}])
+        self.assertEqual(duplicates, {"SELECT ? FROM t WHERE id = ?": 2})
+
+    def test_check_budgets(self):
+        measurements = replay_requests(['tags', 'api_events'])
+        budgets = {'tags': {'queries': 0, 'duplicates': 0, 'ms': 0}}
+        violations = check_budgets(measurements, budgets, timings=False)
+        self.assertEqual(len(violations), 3)
+        self.assertIn('api_events: no budget', violations)
+
+    def test_views_within_budgets(self):
+        generate_archive(**BUDGET_DATASET)
+        staff_user = User.objects.create(username='budgets_staff', is_staff=True, is_superuser=True)
+        measurements = replay_requests(staff_user=staff_user)
+        self.assertEqual({measurement.name for measurement in measurements}, set(REQUESTS))
+        if os.environ.get('UPDATE_BUDGETS'):
+            save_budgets(replay_requests(staff_user=staff_user, repeat=5))
+        # Wall time depends on the machine, it's checked by the check_performance_budgets command
+        self.maxDiff = None
+        self.assertEqual(check_budgets(measurements, load_budgets(), timings=False), [])
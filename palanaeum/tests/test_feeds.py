@@ -0,0 +1,30 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.text import slugify
+
+from palanaeum.tests.test_prefetch import EntriesTestCase
+
+
+class FeedsTests(EntriesTestCase):
+    def count_queries(self, url) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_titles(self):
+        response = self.client.get(reverse('event_feed', args=(self.event.id, slugify(self.event.name))))
+        self.assertContains(response, '<title>[{}] Entry #{}</title>'.format(self.event.name, self.entries[0].id))
+        self.assertContains(response, 'Line 0 of 0')
+
+    def test_constant_number_of_queries(self):
+        urls = (reverse('event_feed', args=(self.event.id, slugify(self.event.name))),
+                reverse('recent_entries_feed'))
+        # The current site is cached by the first request
+        for url in urls:
+            self.client.get(url)
+        counts = [self.count_queries(url) for url in urls]
+        for entry in self.entries[1:]:
+            entry.delete()
+        self.assertEqual([self.count_queries(url) for url in urls], counts)
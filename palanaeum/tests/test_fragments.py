@@ -0,0 +1,126 @@
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache.backends.locmem import LocMemCache
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+
+from palanaeum import fragments
+from palanaeum.models import AudioSource, Entry, Event, Snippet, URLSource
+from palanaeum.read_models import load_entries
+from palanaeum.tests.factories import EntryVersionFactory, EntryLineFactory
+from palanaeum.tests.test_prefetch import EntriesTestCase
+
+
+class FragmentsTests(EntriesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = LocMemCache('fragments', {})
+        patcher = mock.patch.object(fragments, 'FRAGMENTS_CACHE', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.request = RequestFactory().get('/')
+        self.request.user = AnonymousUser()
+
+    def tearDown(self):
+        self.cache.clear()
+        Snippet.objects.all().delete()
+        AudioSource.objects.all().delete()
+        super().tearDown()
+
+    def get_key(self, entry):
+        entry_data = load_entries([entry.id])[entry.id]
+        return fragments.get_fragment_key(entry_data, fragments.BODY_TEMPLATE, 'anonymous')
+
+    def test_same_rendering(self):
+        entries = list(load_entries([entry.id for entry in self.entries]).values())
+        fragments.render_entries(entries, self.request)
+        for entry in entries:
+            self.assertEqual(str(entry.fragment),
+                             render_to_string('palanaeum/elements/entry_body.html', {'entry': entry}))
+            self.assertEqual(render_to_string('palanaeum/elements/entry_li.html', {'entry': entry, 'number': 1}),
+                             render_to_string('palanaeum/elements/entry_li.html',
+                                              {'entry': Entry.prefetch_entries([entry.id])[entry.id], 'number': 1}))
+
+    def test_single_round_trip(self):
+        entries_ids = [entry.id for entry in self.entries]
+        with mock.patch.object(self.cache, 'get_many', wraps=self.cache.get_many) as get_many, \
+                mock.patch.object(self.cache, 'set_many', wraps=self.cache.set_many) as set_many:
+            fragments.render_entries(list(load_entries(entries_ids).values()), self.request)
+            self.assertEqual((get_many.call_count, set_many.call_count), (1, 1))
+
+            entries = list(load_entries(entries_ids).values())
+            with mock.patch('palanaeum.fragments.get_template') as get_template:
+                fragments.render_entries(entries, self.request)
+            get_template.return_value.render.assert_not_called()
+            self.assertEqual((get_many.call_count, set_many.call_count), (2, 1))
+        self.assertTrue(all(entry.fragment for entry in entries))
+
+    def test_invalidation(self):
+        entry = self.entries[0]
+        keys = [self.get_key(entry)]
+
+        audio = AudioSource.objects.create(event=self.event, length=600)
+        snippet = Snippet.objects.create(source=audio, entry=entry, length=10)
+        keys.append(self.get_key(entry))
+
+        snippet.hide()
+        keys.append(self.get_key(entry))
+
+        version = EntryVersionFactory(entry=entry, is_approved=False)
+        EntryLineFactory(entry_version=version, text='Suggested line')
+
+        version.approve(User.objects.create(username='fragments_staff', is_staff=True))
+        keys.append(self.get_key(entry))
+
+        # Edited like in the editor
+        version.archive_version()
+        version.note = 'Edited'
+        version.save()
+        entry.update_version_pointers()
+        keys.append(self.get_key(entry))
+
+        self.event.review_state = Event.REVIEW_PENDING
+        self.event.save()
+        keys.append(self.get_key(entry))
+
+        self.assertEqual(len(set(keys)), len(keys))
+
+    def test_url_source_changes(self):
+        entry = self.entries[0]
+        source = URLSource.objects.create(url='https://example.com/interview', text='Interview')
+        source.entry_versions.add(entry.versions.last())
+        keys = [self.get_key(entry)]
+
+        source.hide()
+        keys.append(self.get_key(entry))
+
+        source.show()
+        source.text = 'Renamed interview'
+        source.save()
+        keys.append(self.get_key(entry))
+
+        source.delete()
+        keys.append(self.get_key(entry))
+        self.assertEqual(len(set(keys)), len(keys))
+
+    def test_viewer_classes(self):
+        entry = self.entries[0]
+        contributor = User.objects.create(username='fragments_contributor')
+        staff = User.objects.create(username='fragments_staff', is_staff=True)
+        for user, viewer_class in ((AnonymousUser(), 'anonymous'), (contributor, 'contributor'), (staff, 'staff')):
+            self.request.user = user
+            self.assertEqual(fragments.get_viewer_class(self.request), viewer_class)
+
+        audio = AudioSource.objects.create(event=self.event, length=600)
+        snippet = Snippet.objects.create(source=audio, entry=entry, length=10, is_approved=False,
+                                         created_by=contributor)
+        entry_data = load_entries([entry.id])[entry.id]
+        # Unapproved sources depend on the contributor, they aren't cached
+        self.assertIsNone(fragments.get_fragment_key(entry_data, fragments.BODY_TEMPLATE, 'contributor'))
+        self.assertIsNotNone(fragments.get_fragment_key(entry_data, fragments.BODY_TEMPLATE, 'staff'))
+
+        snippet.is_approved = True
+        snippet.save()
+        entry_data = load_entries([entry.id])[entry.id]
+        self.assertIsNotNone(fragments.get_fragment_key(entry_data, fragments.BODY_TEMPLATE, 'contributor'))
@@ -0,0 +1,106 @@
+import shutil
+import tempfile
+from datetime import date
+from unittest.mock import patch
+
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+
+from palanaeum import inverted_index
+from palanaeum.inverted_index import build_index, get_current_build, get_inverted_index, reset_inverted_index
+from palanaeum.models import Entry, Event, EntrySearchVector, Tag
+from palanaeum.search import SearchResults, TextSearchFilter, SpeakerSearchFilter, TagSearchFilter
+from palanaeum.tests.factories import EventFactory, EntryFactory, EntryVersionFactory, EntryLineFactory
+
+
+class InvertedIndexTests(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.settings_override = override_settings(SEARCH_BACKEND='inverted_index', INVERTED_INDEX_DIR=self.path)
+        self.settings_override.enable()
+        self.interval_patch = patch.object(inverted_index, 'REFRESH_INTERVAL', 0)
+        self.interval_patch.start()
+        reset_inverted_index()
+
+        self.event = EventFactory(date=date(2020, 5, 1))
+        self.tag_magic = Tag.objects.create(name='magic')
+        self.entry_allomancy = self.make_entry('Tell me about allomancy and metals.', tags=[self.tag_magic])
+        self.entry_surgebinding = self.make_entry('How does surgebinding work?', speaker='Peter Ahlstrom')
+        self.entry_hoid = self.make_entry('Where is Hoid now? Hoid knows allomancy.')
+        build_index()
+
+    def tearDown(self):
+        reset_inverted_index()
+        self.interval_patch.stop()
+        self.settings_override.disable()
+        shutil.rmtree(self.path, ignore_errors=True)
+        Entry.objects.all().delete()
+        Event.objects.all().delete()
+
+    def make_entry(self, text, speaker='Brandon Sanderson', tags=()):
+        entry = EntryFactory(event=self.event)
+        version = EntryVersionFactory(entry=entry, is_approved=True)
+        EntryLineFactory(entry_version=version, text=text, speaker=speaker)
+        for tag in tags:
+            version.tags.add(tag)
+        version.save()
+        EntrySearchVector.objects.get_or_create(entry=entry)[0].update()
+        return entry
+
+    @staticmethod
+    def make_filter(filter_class, query_string):
+        search_filter = filter_class()
+        search_filter.init_from_get_params(QueryDict(query_string))
+        return search_filter
+
+    def search(self, query_string, filter_class=TextSearchFilter):
+        return {entry_id for entry_id, rank in SearchResults([self.make_filter(filter_class, query_string)])}
+
+    def test_build(self):
+        build = get_current_build()
+        self.assertIsNotNone(build)
+        index = get_inverted_index()
+        self.assertEqual(index.build, build)
+        self.assertEqual(index.stem('Metals'), 'metal')
+        self.assertEqual(index.stem('the'), '')
+
+        # A new build replaces the current one
+        self.assertNotEqual(build_index(), build)
+        self.assertNotEqual(get_inverted_index().build, build)
+
+    def test_text_search(self):
+        self.assertEqual(self.search('query=allomancy'), {self.entry_allomancy.id, self.entry_hoid.id})
+        self.assertEqual(self.search('query=allomancy -hoid'), {self.entry_allomancy.id})
+        self.assertEqual(self.search('query=surge*'), {self.entry_surgebinding.id})
+        self.assertEqual(self.search('query="the metals"'), {self.entry_allomancy.id})
+        self.assertEqual(self.search('query=hoid AND metal'), set())
+
+        # Entries with more matches rank higher, like with ts_rank
+        results = SearchResults([self.make_filter(TextSearchFilter, 'query=allomancy | hoid')])
+        self.assertEqual(results[0][0], self.entry_hoid.id)
+
+    def test_speaker_and_tag_search(self):
+        self.assertEqual(self.search('speaker=ahlstrom', SpeakerSearchFilter), {self.entry_surgebinding.id})
+        self.assertEqual(self.search('tags=magic', TagSearchFilter), {self.entry_allomancy.id})
+
+    def test_changes_after_build(self):
+        entry = self.make_entry('Allomancy is a metallic art.')
+        self.entry_hoid.last_version.lines.update(text='Where is Hoid now?')
+        EntrySearchVector.update_entries([self.entry_hoid.id])
+
+        self.assertEqual(self.search('query=allomancy'), {self.entry_allomancy.id, entry.id})
+        self.assertEqual(self.search('query=hoid'), {self.entry_hoid.id})
+        self.assertEqual(self.search('query=knows'), set())
+
+        self.entry_allomancy.delete()
+        self.assertEqual(self.search('query=allomancy'), {entry.id})
+
+    def test_fallback_to_database(self):
+        shutil.rmtree(self.path)
+        reset_inverted_index()
+        self.assertIsNone(get_inverted_index())
+        self.assertEqual(self.search('query=allomancy'), {self.entry_allomancy.id, self.entry_hoid.id})
+
+        with override_settings(SEARCH_BACKEND='postgres'):
+            self.assertFalse(self.make_filter(TextSearchFilter, 'query=hoid').in_memory)
+        self.assertFalse(self.make_filter(TextSearchFilter, 'query=hoid&query_fuzzy=on').in_memory)
@@ -0,0 +1,130 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import Http404
+
+from palanaeum import page_cache
+from palanaeum.models import AudioSource, Snippet
+from palanaeum.tests.factories import EntryLineFactory
+from palanaeum.tests.test_prefetch import EntriesTestCase
+
+
+class EventPageCacheTests(EntriesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = LocMemCache('pages', {})
+        patcher = mock.patch.object(page_cache, 'PAGES_CACHE', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.url = self.event.get_absolute_url()
+
+    def tearDown(self):
+        self.cache.clear()
+        Snippet.objects.all().delete()
+        AudioSource.objects.all().delete()
+        super().tearDown()
+
+    def edit_entry(self, text):
+        with self.captureOnCommitCallbacks(execute=True):
+            EntryLineFactory(entry_version=self.entries[0].versions.first(), order=2, text=text)
+
+    def test_dummy_cache(self):
+        with mock.patch.object(page_cache, 'PAGES_CACHE', DummyCache('pages', {})):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+    def test_cached_page(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Line 0 of 0')
+        with self.assertNumQueries(0):
+            cached_response = self.client.get(self.url)
+        self.assertEqual(cached_response.content, response.content)
+        self.assertEqual(cached_response['ETag'], response['ETag'])
+
+        self.edit_entry('New line')
+        response = self.client.get(self.url)
+        self.assertContains(response, 'New line')
+        self.assertNotEqual(response['ETag'], cached_response['ETag'])
+
+    def test_conditional_get(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.edit_entry('New line')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_stale_page_while_rendering(self):
+        self.client.get(self.url)
+        self.edit_entry('New line')
+        cache = page_cache.EventPageCache(self.client.get(self.url).wsgi_request, self.event.id)
+
+        # Another request is rendering the page
+        self.edit_entry('Newer line')
+        self.cache.add(cache.lock_key, True)
+        response = self.client.get(self.url)
+        self.assertContains(response, 'New line')
+        self.assertNotContains(response, 'Newer line')
+
+        self.cache.delete(cache.lock_key)
+        self.assertContains(self.client.get(self.url), 'Newer line')
+        self.assertIsNone(self.cache.get(cache.lock_key))
+
+    def test_hidden_event(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        cache = page_cache.EventPageCache(self.client.get(self.url).wsgi_request, self.event.id)
+        # Another request is rendering the page, stale copies of a hidden event aren't served anyway
+        self.cache.add(cache.lock_key, True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.event.hide()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+        self.cache.delete(cache.lock_key)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.assertIsNone(self.cache.get(cache.key))
+        self.assertIsNone(self.cache.get(cache.lock_key))
+
+    def test_removed_event(self):
+        self.client.get(self.url)
+        cache = page_cache.EventPageCache(self.client.get(self.url).wsgi_request, self.event.id)
+        self.edit_entry('New line')
+        with mock.patch('palanaeum.views.get_object_or_404', side_effect=Http404):
+            self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertIsNone(self.cache.get(cache.key))
+        self.assertIsNone(self.cache.get(cache.lock_key))
+
+    def test_audiences(self):
+        anonymous_content = self.client.get(self.url).content
+
+        # Pages of logged in users are rendered for them, only the entries are cached
+        staff = User.objects.create(username='pages_staff', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(self.url)
+        self.assertNotEqual(response.content, anonymous_content)
+        self.assertNotIn('ETag', response)
+        self.assertContains(response, 'USER_NAME: "pages_staff"')
+        with mock.patch('palanaeum.views.render_entries') as render_entries:
+            response = self.client.get(self.url)
+        render_entries.assert_not_called()
+        self.assertContains(response, 'Line 0 of 0')
+
+        other_staff = User.objects.create(username='pages_other_staff', is_staff=True)
+        self.client.force_login(other_staff)
+        response = self.client.get(self.url)
+        self.assertContains(response, 'USER_NAME: "pages_other_staff"')
+        self.assertNotContains(response, 'USER_NAME: "pages_staff"')
+
+        # Unapproved sources are shown only to their authors, such entries aren't cached for contributors
+        contributor = User.objects.create(username='pages_contributor')
+        audio = AudioSource.objects.create(event=self.event, length=600)
+        with self.captureOnCommitCallbacks(execute=True):
+            Snippet.objects.create(source=audio, entry=self.entries[0], length=10, is_approved=False,
+                                   created_by=staff)
+        self.client.force_login(contributor)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        cache = page_cache.EventPageCache(self.client.get(self.url).wsgi_request, self.event.id)
+        self.assertIsNone(self.cache.get(cache.key))
@@ -0,0 +1,105 @@
+from datetime import date
+
+from django.template.loader import render_to_string
+from django.test import TestCase
+
+from palanaeum.models import Entry, Event, ImageSource, Tag, URLSource
+from palanaeum.read_models import load_entries
+from palanaeum.tests.factories import EventFactory, EntryFactory, EntryVersionFactory, EntryLineFactory
+
+
+class EntriesTestCase(TestCase):
+    def setUp(self):
+        self.event = EventFactory(date=date(2020, 5, 1))
+        self.entries = [self.make_entry(i) for i in range(5)]
+
+    def tearDown(self):
+        ImageSource.objects.all().delete()
+        URLSource.objects.all().delete()
+        Entry.objects.all().delete()
+        Event.objects.all().delete()
+
+    def make_entry(self, number):
+        entry = EntryFactory(event=self.event)
+        version = EntryVersionFactory(entry=entry, is_approved=True, entry_date=date(2020, 5, number + 1),
+                                      note='Note {}'.format(number))
+        for order in (1, 0):
+            EntryLineFactory(entry_version=version, order=order, text='Line {} of {}'.format(order, number))
+        version.tags.add(Tag.objects.get_or_create(name='tag{}'.format(number))[0],
+                         Tag.objects.get_or_create(name='common')[0])
+        version.url_sources.add(URLSource.get_or_create('https://example.com/{}'.format(number), 'Source'))
+        return entry
+
+
+class PrefetchEntriesTests(EntriesTestCase):
+    def test_prefetched_data(self):
+        entry = self.entries[2]
+        ImageSource.objects.create(event=self.event, entry=entry, file='sources/image.png', name='Image')
+
+        entries_map = Entry.prefetch_entries([entry.id])
+        with self.assertNumQueries(0):
+            prefetched = entries_map[entry.id]
+            self.assertEqual(prefetched.event.name, self.event.name)
+            self.assertEqual(prefetched.date, date(2020, 5, 3))
+            self.assertEqual(prefetched.note, 'Note 2')
+            self.assertEqual([line.text for line in prefetched.lines], ['Line 0 of 2', 'Line 1 of 2'])
+            self.assertEqual([tag.name for tag in prefetched.tags.all()], ['common', 'tag2'])
+            self.assertTrue(prefetched.tags.exists())
+            self.assertEqual([source.url for source in prefetched.all_url_sources()], ['https://example.com/2'])
+            self.assertEqual([image.name for image in prefetched.image_sources.all()], ['Image'])
+            self.assertEqual(list(prefetched.snippets.all()), [])
+            self.assertFalse(prefetched.direct_entry)
+            self.assertFalse(prefetched.is_suggestion)
+
+    def test_unapproved_versions(self):
+        entry = self.entries[0]
+        version = EntryVersionFactory(entry=entry, is_approved=False)
+        EntryLineFactory(entry_version=version, text='Suggested line')
+
+        self.assertEqual([line.text for line in Entry.prefetch_entries([entry.id])[entry.id].lines],
+                         ['Line 0 of 0', 'Line 1 of 0'])
+        prefetched = Entry.prefetch_entries([entry.id], show_unapproved=True)[entry.id]
+        self.assertEqual([line.text for line in prefetched.lines], ['Suggested line'])
+        self.assertTrue(prefetched.is_suggestion)
+        self.assertEqual(list(prefetched.tags.all()), [])
+
+    def test_constant_number_of_queries(self):
+        for entries in (self.entries[:1], self.entries):
+            with self.assertNumQueries(2):
+                entries_map = Entry.prefetch_entries([entry.id for entry in entries])
+                for entry in entries_map.values():
+                    list(entry.lines)
+                    list(entry.tags.all())
+                    entry.all_url_sources()
+                    entry.direct_entry
+            self.assertEqual(set(entries_map), {entry.id for entry in entries})
+
+
+class LoadEntriesTests(EntriesTestCase):
+    def test_same_rendering_as_models(self):
+        entries_ids = [entry.id for entry in self.entries]
+        models = Entry.prefetch_entries(entries_ids)
+        projections = load_entries(entries_ids)
+        self.assertEqual(set(projections), set(entries_ids))
+
+        for entry_id in entries_ids:
+            self.assertEqual(str(projections[entry_id]), str(models[entry_id]))
+            self.assertEqual(
+                render_to_string('palanaeum/elements/entry_li.html', {'entry': projections[entry_id], 'number': 1}),
+                render_to_string('palanaeum/elements/entry_li.html', {'entry': models[entry_id], 'number': 1})
+            )
+
+    def test_constant_number_of_queries(self):
+        for entries in (self.entries[:1], self.entries):
+            entries_ids = [entry.id for entry in entries]
+            with self.assertNumQueries(3):
+                entries_map = load_entries(entries_ids)
+            with self.assertNumQueries(2):
+                load_entries(entries_ids, events={self.event.id: self.event})
+            with self.assertNumQueries(0):
+                for entry in entries_map.values():
+                    self.assertEqual(entry.event, self.event)
+                    self.assertEqual(len(entry.lines), 2)
+                    self.assertTrue(entry.tags.exists())
+                    self.assertEqual(len(entry.all_url_sources()), 1)
+                    self.assertFalse(entry.direct_entry)
@@ -0,0 +1,84 @@
+import os
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.template.backends.django import Template
+from django.test import TestCase, override_settings
+
+from palanaeum.models import Event
+from palanaeum.profiling import clear_records, get_records, get_signature, summarize
+from palanaeum.tests.factories import EventFactory
+
+LOCMEM_CACHES = {
+    alias: {'BACKEND': 'palanaeum.profiling.ProfilingCache',
+            'PROFILED_BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    for alias in ('search', 'config', 'fragments', 'pages')
+}
+LOCMEM_CACHES['default'] = {'BACKEND': 'palanaeum.profiling.ProfilingCache', 'LOCATION': 'profiling',
+                            'PROFILED_BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+LOCMEM_GET = LocMemCache.get
+TEMPLATE_RENDER = Template.render
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        clear_records()
+        self.event = EventFactory()
+
+    def tearDown(self):
+        clear_records()
+        Event.objects.all().delete()
+
+    def test_signature(self):
+        self.assertEqual(get_signature('SELECT "a" FROM "t" WHERE "id" = %s AND "b" IN (%s, %s)'),
+                         'SELECT "a" FROM "t" WHERE "id" = ? AND "b" IN (?)')
+
+    def test_no_sampling(self):
+        with override_settings(PROFILING_SAMPLE_RATE=0):
+            self.client.get(self.event.get_absolute_url())
+        self.assertEqual(get_records(), [])
+
+    def test_sampled_request(self):
+        with override_settings(PROFILING_SAMPLE_RATE=1, CACHES=LOCMEM_CACHES):
+            caches['default'].clear()
+            self.client.get(self.event.get_absolute_url())
+
+        record, = get_records()
+        self.assertEqual(record.endpoint, 'view_event')
+        self.assertEqual(record.status, 200)
+        self.assertGreater(record.sql_count, 0)
+        self.assertGreater(record.template_ms, 0)
+        self.assertGreaterEqual(record.total_ms, record.template_ms)
+        self.assertIn('pages', record.caches)
+        # Cache backends and templates are measured through the settings, not patched
+        self.assertIs(LocMemCache.get, LOCMEM_GET)
+        self.assertIs(Template.render, TEMPLATE_RENDER)
+        for signature, count, duration in record.duplicates:
+            self.assertGreater(count, 1)
+
+        endpoint, = summarize(get_records())
+        self.assertEqual(endpoint['endpoint'], 'view_event')
+        self.assertEqual(endpoint['requests'], 1)
+        self.assertEqual(endpoint['max_ms'], record.total_ms)
+
+    def test_dashboard(self):
+        with override_settings(PROFILING_SAMPLE_RATE=1):
+            self.client.get(self.event.get_absolute_url())
+            self.assertEqual(self.client.get('/staff/profiling/').status_code, 302)
+
+            self.client.force_login(User.objects.create(username='profiling_staff', is_staff=True))
+            response = self.client.get('/staff/profiling/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'view_event')
+        self.assertContains(response, 'only process {}'.format(os.getpid()))
+
+    def test_sampling_profiler(self):
+        # Only staff members can profile a request
+        response = self.client.get(self.event.get_absolute_url() + '?profile=1')
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+
+        self.client.force_login(User.objects.create(username='profiling_staff', is_staff=True))
+        response = self.client.get(self.event.get_absolute_url() + '?profile=1')
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertContains(response, 'Folded stacks:')
@@ -0,0 +1,86 @@
+from datetime import date
+
+from django.test import TestCase
+
+from palanaeum import tasks
+from palanaeum.models import Entry, Event, EntrySearchVector, EntrySignature, SearchIndexUpdate, Tag
+from palanaeum.related import find_related, get_signature, update_signatures, NUM_HASHES
+from palanaeum.tests.factories import EventFactory, EntryFactory, EntryVersionFactory, EntryLineFactory
+
+
+class RelatedEntriesTests(TestCase):
+    def setUp(self):
+        self.event = EventFactory(date=date(2020, 5, 1))
+        self.tag_hoid = Tag.objects.create(name='hoid')
+        self.tag_magic = Tag.objects.create(name='magic')
+
+        self.entry_hoid = self.make_entry('Where is Hoid now? Hoid travels between the worlds of the cosmere.',
+                                          tags=[self.tag_hoid])
+        self.entry_hoid_again = self.make_entry('Is Hoid travelling between the cosmere worlds now?',
+                                                tags=[self.tag_hoid])
+        self.entry_magic = self.make_entry('How does surgebinding work with spren bonds?', tags=[self.tag_magic])
+        update_signatures([self.entry_hoid.id, self.entry_hoid_again.id, self.entry_magic.id])
+
+    def tearDown(self):
+        Entry.objects.all().delete()
+        Event.objects.all().delete()
+
+    def make_entry(self, text, tags=()):
+        entry = EntryFactory(event=self.event)
+        version = EntryVersionFactory(entry=entry, is_approved=True)
+        EntryLineFactory(entry_version=version, speaker='Questioner', text=text)
+        for tag in tags:
+            version.tags.add(tag)
+        EntrySearchVector.objects.get_or_create(entry=entry)[0].update()
+        return entry
+
+    def test_signature(self):
+        signature = get_signature(['hoid', 'cosmere'])
+        self.assertEqual(len(signature), NUM_HASHES)
+        self.assertTrue((signature == get_signature(['cosmere', 'hoid'])).all())
+        self.assertIsNone(get_signature([]))
+
+    def test_find_related(self):
+        related = find_related(self.entry_hoid.id)
+        self.assertEqual([entry_id for entry_id, similarity in related], [self.entry_hoid_again.id])
+        self.assertGreater(related[0][1], 0.3)
+        self.assertEqual(find_related(self.entry_magic.id), [])
+
+    def test_hidden_entries_are_not_related(self):
+        self.entry_hoid_again.hide()
+        self.assertEqual(find_related(self.entry_hoid.id), [])
+
+    def test_signatures_follow_search_index(self):
+        version = self.entry_magic.last_version
+        version.lines.update(text='Where is Hoid now? Hoid travels between the worlds of the cosmere.')
+        version.tags.add(self.tag_hoid)
+        SearchIndexUpdate.objects.create(entry=self.entry_magic)
+        tasks.update_search_index()
+        self.assertIn(self.entry_magic.id, [entry_id for entry_id, similarity in find_related(self.entry_hoid.id)])
+
+        Entry.objects.filter(pk=self.entry_magic.pk).update(newest_approved_version=None)
+        update_signatures([self.entry_magic.id])
+        self.assertFalse(EntrySignature.objects.filter(entry=self.entry_magic).exists())
+
+    def test_unapproved_versions_are_ignored(self):
+        version = EntryVersionFactory(entry=self.entry_magic, is_approved=False)
+        EntryLineFactory(entry_version=version, speaker='Questioner',
+                         text='Where is Hoid now? Hoid travels between the worlds of the cosmere.')
+        version.tags.add(self.tag_hoid)
+        self.entry_magic.refresh_from_db()
+        self.assertNotEqual(self.entry_magic.newest_version_id, self.entry_magic.newest_approved_version_id)
+        update_signatures([self.entry_magic.id])
+        self.assertNotIn(self.entry_magic.id, [entry_id for entry_id, similarity in find_related(self.entry_hoid.id)])
+
+        Entry.objects.filter(pk=self.entry_hoid_again.pk).update(is_approved=False)
+        self.assertEqual(find_related(self.entry_hoid.id), [])
+
+    def test_views(self):
+        response = self.client.get('/entry/{}/related/'.format(self.entry_hoid.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Is Hoid travelling', response.content.decode())
+        self.assertNotIn('surgebinding', response.content.decode())
+
+        data = self.client.get('/api/entry/{}/related/'.format(self.entry_hoid.id)).json()
+        self.assertEqual([entry['id'] for entry in data], [self.entry_hoid_again.id])
+        self.assertIn('similarity', data[0])
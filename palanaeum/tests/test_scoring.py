@@ -0,0 +1,37 @@
+from django.test import SimpleTestCase
+
+from palanaeum.scoring import ScoredEntries
+
+
+class ScoredEntriesTests(SimpleTestCase):
+    def setUp(self):
+        self.first = ScoredEntries.from_pairs([(5, 1.0), (1, 2.0), (3, 0.5), (1, 1.0)])
+        self.second = ScoredEntries.from_pairs([(3, 1.0), (5, 4.0), (7, 1.0)])
+
+    def test_from_pairs(self):
+        self.assertEqual(list(self.first), [(1, 3.0), (3, 0.5), (5, 1.0)])
+        self.assertFalse(ScoredEntries.from_pairs([]))
+
+    def test_from_bitmap(self):
+        entries = ScoredEntries.from_bitmap(0b101010 | 1 << 70000, 2)
+        self.assertEqual(list(entries), [(1, 2.0), (3, 2.0), (5, 2.0), (70000, 2.0)])
+        self.assertFalse(ScoredEntries.from_bitmap(0))
+
+    def test_intersection(self):
+        self.assertEqual(list(self.first.intersection(self.second)), [(3, 1.5), (5, 5.0)])
+
+    def test_union(self):
+        self.assertEqual(list(self.first.union(self.second)), [(1, 3.0), (3, 1.5), (5, 5.0), (7, 1.0)])
+        self.assertFalse(ScoredEntries.union_all([]))
+
+    def test_difference(self):
+        self.assertEqual(list(self.first.difference(self.second)), [(1, 3.0)])
+        self.assertIn(5, self.first)
+        self.assertNotIn(4, self.first)
+
+    def test_top(self):
+        entries = ScoredEntries.from_pairs([(1, 1.0), (2, 3.0), (3, 2.0), (4, 3.0), (5, 2.0)])
+        self.assertEqual(entries.top(3), [(2, 3.0), (4, 3.0), (3, 2.0)])
+        self.assertEqual(entries.top(4), [(2, 3.0), (4, 3.0), (3, 2.0), (5, 2.0)])
+        self.assertEqual(entries.top(), entries.top(10))
+        self.assertEqual(entries.top(0), [])
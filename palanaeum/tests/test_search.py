@@ -0,0 +1,366 @@
+import time
+from datetime import date, timedelta
+from unittest.mock import patch
+
+from django.core.cache import caches
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from palanaeum.models import Entry, Event, EntrySearchVector, Tag
+from palanaeum.search import SearchResults, SearchPaginator, TextSearchFilter, TagSearchFilter, \
+    AntiTagSearchFilter, DateSearchFilter, SpeakerSearchFilter, SearchQueryParser, trigram_search_available, \
+    TRIGRAM_CHECK_TTL, execute_filters, get_archive_stats, init_filters, prefetch_excerpts
+from palanaeum.tests.factories import EventFactory, EntryFactory, EntryVersionFactory, EntryLineFactory
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.event = EventFactory(date=date(2020, 5, 1))
+        self.tag_magic = Tag.objects.create(name='magic')
+        self.tag_cosmere = Tag.objects.create(name='cosmere')
+
+        self.entry_allomancy = self.make_entry('Tell me about allomancy and metals.', date(2020, 5, 1),
+                                               tags=[self.tag_magic, self.tag_cosmere])
+        self.entry_surgebinding = self.make_entry('How does surgebinding work?', date(2020, 6, 1),
+                                                  tags=[self.tag_magic])
+        self.entry_hoid = self.make_entry('Where is Hoid now? Hoid knows allomancy.', date(2020, 7, 1))
+
+    def tearDown(self):
+        Entry.objects.all().delete()
+        Event.objects.all().delete()
+
+    def make_entry(self, text, entry_date, tags=(), is_visible=True):
+        entry = EntryFactory(event=self.event, is_visible=is_visible)
+        version = EntryVersionFactory(entry=entry, is_approved=True, entry_date=entry_date)
+        EntryLineFactory(entry_version=version, text=text)
+        for tag in tags:
+            version.tags.add(tag)
+        EntrySearchVector.objects.get_or_create(entry=entry)[0].update()
+        return entry
+
+    @staticmethod
+    def search(ordering='rank', **params):
+        query = QueryDict(mutable=True)
+        for key, value in params.items():
+            query.setlist(key, value if isinstance(value, list) else [value])
+
+        filters = []
+        for filter_class in (TextSearchFilter, SpeakerSearchFilter, DateSearchFilter, TagSearchFilter,
+                             AntiTagSearchFilter):
+            search_filter = filter_class()
+            search_filter.init_from_get_params(query)
+            filters.append(search_filter)
+        return SearchResults(filters, ordering)
+
+    def test_text_search(self):
+        results = self.search(query='allomancy')
+        self.assertEqual({entry_id for entry_id, rank in results},
+                         {self.entry_allomancy.id, self.entry_hoid.id})
+        self.assertEqual(len(results), 2)
+
+    def test_exact_search(self):
+        results = self.search(query='"Hoid now"')
+        self.assertEqual([entry_id for entry_id, rank in results], [self.entry_hoid.id])
+        self.assertGreaterEqual(results[0][1], 10)
+
+    def test_tag_search_ranks_by_matched_tags(self):
+        results = self.search(tags=['magic', 'cosmere'])
+        self.assertEqual([entry_id for entry_id, rank in results],
+                         [self.entry_allomancy.id, self.entry_surgebinding.id])
+        self.assertEqual([rank for entry_id, rank in results], [2, 1])
+
+    def test_tag_search_uses_newest_version(self):
+        version = EntryVersionFactory(entry=self.entry_surgebinding, is_approved=True,
+                                      date=timezone.now() + timedelta(seconds=10))
+        EntryLineFactory(entry_version=version, text='Untagged now.')
+        results = self.search(tags='magic')
+        self.assertEqual([entry_id for entry_id, rank in results], [self.entry_allomancy.id])
+
+    def test_query_operators(self):
+        results = self.search(query='allomancy AND NOT hoid')
+        self.assertEqual([entry_id for entry_id, rank in results], [self.entry_allomancy.id])
+        results = self.search(query='surgebind* | (hoid -metals)')
+        self.assertEqual({entry_id for entry_id, rank in results}, {self.entry_surgebinding.id, self.entry_hoid.id})
+
+    def test_phrase_search(self):
+        results = self.search(query='"knows allomancy" metals')
+        self.assertEqual([entry_id for entry_id, rank in results], [self.entry_hoid.id, self.entry_allomancy.id])
+        self.assertFalse(self.search(query='"allomancy knows"'))
+
+    def test_stop_words_phrase_search(self):
+        results = self.search(query='"how does"')
+        self.assertEqual([entry_id for entry_id, rank in results], [self.entry_surgebinding.id])
+        results = self.search(query='"how does" OR hoid')
+        self.assertEqual({entry_id for entry_id, rank in results}, {self.entry_surgebinding.id, self.entry_hoid.id})
+        self.assertFalse(self.search(query='"does how"'))
+        self.assertFalse(self.search(query='"how does" -surgebinding'))
+
+    def test_exact_phrase_bonus(self):
+        results = self.search(query='"Hoid knows allomancy" OR metals')
+        self.assertEqual(results[0][0], self.entry_hoid.id)
+        self.assertGreaterEqual(results[0][1], 10)
+        # Stemmed phrase match without the exact text doesn't get the bonus
+        self.assertLess(self.search(query='"Hoid knowing allomancy"')[0][1], 10)
+
+    def test_fuzzy_search(self):
+        if not trigram_search_available():
+            self.skipTest("pg_trgm extension is not installed.")
+        self.assertFalse(self.search(query='allomancyy'))
+        results = self.search(query='allomancyy', query_fuzzy='on')
+        self.assertEqual({entry_id for entry_id, rank in results}, {self.entry_allomancy.id, self.entry_hoid.id})
+
+    @patch('palanaeum.search._trigram_search_available', (None, 0.0))
+    def test_trigram_check_expires(self):
+        trigram_search_available()
+        with self.assertNumQueries(0):
+            trigram_search_available()
+        with patch('palanaeum.search.time.time', return_value=time.time() + TRIGRAM_CHECK_TTL + 1), \
+                self.assertNumQueries(1):
+            trigram_search_available()
+
+    def test_text_and_anti_tag_search(self):
+        results = self.search(query='allomancy', antitag='cosmere')
+        self.assertEqual([entry_id for entry_id, rank in results], [self.entry_hoid.id])
+
+    def test_tag_and_anti_tag_search(self):
+        results = self.search(tags='magic', antitag='cosmere')
+        self.assertEqual([entry_id for entry_id, rank in results], [self.entry_surgebinding.id])
+
+    def test_execute_filters(self):
+        filters = self.search(query='allomancy', tags=['magic', 'cosmere']).filters
+        self.assertEqual([entry_id for entry_id, rank in execute_filters(filters)], [self.entry_allomancy.id])
+        filters = self.search(antitag='magic').filters
+        self.assertEqual(list(execute_filters(filters)), [(self.entry_hoid.id, 0)])
+
+    def test_date_search_and_ordering(self):
+        results = self.search(ordering='-date', date_from='2020-05-15', date_to='2020-12-31')
+        self.assertEqual([entry_id for entry_id, rank in results],
+                         [self.entry_hoid.id, self.entry_surgebinding.id])
+
+    def test_date_search_uses_current_version(self):
+        EntryVersionFactory(entry=self.entry_hoid, is_approved=True, entry_date=date(2019, 1, 1),
+                            date=timezone.now() + timedelta(seconds=10))
+        self.entry_hoid.refresh_from_db()
+        self.assertEqual(self.entry_hoid.newest_approved_entry_date, date(2019, 1, 1))
+        results = self.search(date_from='2020-05-15', date_to='2020-12-31')
+        self.assertEqual({entry_id for entry_id, rank in results}, {self.entry_surgebinding.id})
+        self.assertEqual(get_archive_stats()['min_date'], date(2019, 1, 1))
+
+    def test_init_filters_skips_unused_filters(self):
+        request = RequestFactory().get('/api/search_entry/', {'tags': 'magic'})
+        with CaptureQueriesContext(connection) as context:
+            filters = init_filters(request)
+        self.assertEqual([type(search_filter) for search_filter in filters], [TagSearchFilter])
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(len(init_filters(request, form=True)), 5)
+
+    def test_hidden_entries_are_not_found(self):
+        hidden = self.make_entry('Hidden allomancy entry.', date(2020, 5, 1), is_visible=False)
+        results = self.search(query='allomancy')
+        self.assertNotIn(hidden.id, [entry_id for entry_id, rank in results])
+
+    def get_search_queries(self, results, offset, limit):
+        with CaptureQueriesContext(connection) as context:
+            page = results.fetch(offset, limit)
+            self.assertEqual(len(results), 2)
+        # The tag index checks its change log and may load itself, that's not a part of the search query
+        queries = [query['sql'] for query in context.captured_queries
+                   if 'SAVEPOINT' not in query['sql'] and 'palanaeum_tagindexchange' not in query['sql']
+                   and 'JOIN palanaeum_entryversion_tags evt ON evt.entryversion_id = e.' not in query['sql']]
+        return page, queries
+
+    def test_slicing_fetches_page_and_count(self):
+        page, queries = self.get_search_queries(self.search(ordering='+date', tags='magic'), 1, 1)
+        self.assertEqual(len(queries), 2)
+        self.assertIn('LIMIT', queries[0])
+        self.assertNotIn('OVER', queries[0])
+        self.assertEqual(page, [(self.entry_surgebinding.id, 1.0)])
+
+    def test_adv_search_view(self):
+        response = self.client.get('/adv_search/', {'query': 'surgebinding'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('How does surgebinding work?', response.content.decode())
+        self.assertNotIn('Hoid', response.content.decode())
+
+    def test_api_search(self):
+        response = self.client.get('/api/search_entry/', {'tags': 'magic', 'ordering': '-date'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['count'], 2)
+        self.assertEqual([entry['id'] for entry in data['results']],
+                         [self.entry_surgebinding.id, self.entry_allomancy.id])
+
+    def test_facets(self):
+        facets = self.search(query='allomancy OR surgebinding').get_facets()
+        self.assertEqual(facets['tags'], [{'value': 'magic', 'label': 'magic', 'count': 2},
+                                          {'value': 'cosmere', 'label': 'cosmere', 'count': 1}])
+        self.assertEqual(len(facets['speakers']), 3)
+        self.assertEqual(facets['events'], [{'value': str(self.event.id), 'label': self.event.name, 'count': 3}])
+        self.assertEqual([(year['value'], year['count']) for year in facets['years']], [('2020', 3)])
+
+    def test_facets_count_results(self):
+        results = self.search(query='allomancy OR surgebinding')
+        with CaptureQueriesContext(connection) as context:
+            results.get_facets()
+            self.assertEqual(len(results), 3)
+        # The search query runs once, cached results are counted from their ids
+        queries = [query['sql'] for query in context.captured_queries if 'filter_0' in query['sql']]
+        self.assertEqual(len(queries), 1)
+
+    def test_facets_in_views(self):
+        response = self.client.get('/adv_search/', {'query': 'allomancy'})
+        self.assertIn('search-facets', response.content.decode())
+        response = self.client.get('/api/search_entry/', {'tags': 'magic', 'facets': '1'})
+        self.assertEqual(response.json()['facets']['tags'][0], {'value': 'magic', 'label': 'magic', 'count': 2})
+        self.assertNotIn('facets', self.client.get('/api/search_entry/', {'tags': 'magic'}).json())
+
+    def test_excerpts(self):
+        results = self.search(query='allomancy')
+        excerpts = prefetch_excerpts(results.filters, [self.entry_hoid.id, self.entry_surgebinding.id])
+        self.assertEqual(excerpts[self.entry_hoid.id].excerpt, 'Where is Hoid now? Hoid knows <mark>allomancy</mark>.')
+        self.assertEqual(excerpts[self.entry_hoid.id].excerpt_date, date(2020, 7, 1))
+        self.assertEqual(excerpts[self.entry_surgebinding.id].excerpt, 'How does surgebinding work?')
+
+    def test_excerpts_in_view(self):
+        response = self.client.get('/adv_search/', {'query': 'surgebinding', 'excerpts': 'on'})
+        self.assertIn('How does <mark>surgebinding</mark> work?', response.content.decode())
+        self.assertIn('excerpts=on', response.context['search_params'])
+
+    def test_cursor_pages(self):
+        for ordering in ('rank', '+date', '-date'):
+            expected = [entry_id for entry_id, rank in self.search(ordering=ordering, query='allomancy hoid work')]
+            paginator = SearchPaginator(self.search(ordering=ordering, query='allomancy hoid work'), 1)
+            page = paginator.page(1)
+            found = [entry_id for entry_id, rank in page]
+            while page.has_next():
+                page = paginator.page_from_cursor(page.next_cursor)
+                found.extend(entry_id for entry_id, rank in page)
+            self.assertEqual(found, expected)
+            self.assertEqual(page.start_index(), 3)
+
+            page = paginator.page_from_cursor(page.previous_cursor)
+            self.assertEqual([entry_id for entry_id, rank in page], expected[1:2])
+            self.assertEqual(page.number, 2)
+
+    def test_invalid_cursor(self):
+        paginator = SearchPaginator(self.search(query='allomancy'), 1)
+        cursor = SearchPaginator(self.search(ordering='-date', query='allomancy'), 1).page(1).next_cursor
+        for invalid in ('garbage', cursor):
+            with self.assertRaises(ValueError):
+                paginator.page_from_cursor(invalid)
+        response = self.client.get('/api/search_entry/', {'query': 'allomancy', 'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_api_search_cursor(self):
+        response = self.client.get('/api/search_entry/', {'tags': 'magic', 'ordering': '-date', 'page_size': 1})
+        data = response.json()
+        self.assertIn('cursor=', data['next'])
+        data = self.client.get(data['next']).json()
+        self.assertEqual(data['count'], 2)
+        self.assertEqual([entry['id'] for entry in data['results']], [self.entry_allomancy.id])
+        self.assertIsNone(data['next'])
+        self.assertIn('cursor=', data['previous'])
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    'search': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'search-tests'},
+    'config': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+})
+class SearchCacheTests(SearchTests):
+    """
+    Run all search tests once more with the results served from the search cache.
+    """
+    def setUp(self):
+        self.cache_patcher = patch('palanaeum.search.SEARCH_CACHE', caches['search'])
+        self.cache_patcher.start()
+        caches['search'].clear()
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        self.cache_patcher.stop()
+
+    def test_slicing_fetches_page_and_count(self):
+        # The full ranked list is loaded once and cached
+        page, queries = self.get_search_queries(self.search(ordering='+date', tags='magic'), 1, 1)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(page, [(self.entry_surgebinding.id, 1.0)])
+
+    def test_results_are_cached(self):
+        self.search(query='allomancy').fetch(0, 10)
+        with CaptureQueriesContext(connection) as context:
+            results = self.search(query='allomancy')
+            self.assertEqual(len(results.fetch(0, 10)), 2)
+        self.assertFalse([query for query in context.captured_queries if 'entrysearchvector' in query['sql']])
+
+    def test_excerpts_are_cached(self):
+        filters = self.search(query='allomancy').filters
+        prefetch_excerpts(filters, [self.entry_hoid.id])
+        with CaptureQueriesContext(connection) as context:
+            excerpts = prefetch_excerpts(filters, [self.entry_hoid.id])
+        self.assertIn('<mark>allomancy</mark>', excerpts[self.entry_hoid.id].excerpt)
+        self.assertFalse([query for query in context.captured_queries if 'ts_headline' in query['sql']])
+
+        version = self.entry_hoid.last_version
+        version.archive_version()
+        version.save()
+        with CaptureQueriesContext(connection) as context:
+            prefetch_excerpts(filters, [self.entry_hoid.id])
+        self.assertTrue([query for query in context.captured_queries if 'ts_headline' in query['sql']])
+
+    def test_cache_key_is_deterministic(self):
+        self.assertEqual(self.search(query='hoid allomancy').get_cache_key(),
+                         self.search(query='allomancy hoid').get_cache_key())
+        self.assertNotEqual(self.search(query='allomancy').get_cache_key(),
+                            self.search(speaker='allomancy').get_cache_key())
+
+    def test_changes_invalidate_cache(self):
+        self.assertEqual(len(self.search(query='allomancy').fetch(0, 10)), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.entry_hoid.hide()
+        self.assertEqual(len(self.search(query='allomancy').fetch(0, 10)), 1)
+
+        self.assertEqual(len(self.search(tags='cosmere').fetch(0, 10)), 1)
+        with self.captureOnCommitCallbacks(execute=True), patch('palanaeum.tasks.schedule_search_index_update'):
+            self.entry_surgebinding.last_version.add_tag('cosmere')
+        self.assertEqual(len(self.search(tags='cosmere').fetch(0, 10)), 2)
+
+
+class SearchQueryParserTests(TestCase):
+    def parse(self, text):
+        return SearchQueryParser(text).parse()
+
+    def test_words_and_operators(self):
+        self.assertEqual(self.parse('hoid'), ('word', 'hoid'))
+        self.assertEqual(self.parse('hoid kelsier'), ('or', [('word', 'hoid'), ('word', 'kelsier')]))
+        self.assertEqual(self.parse('hoid AND kelsier OR vin'),
+                         ('or', [('and', [('word', 'hoid'), ('word', 'kelsier')]), ('word', 'vin')]))
+        self.assertEqual(self.parse('hoid+(kelsier | vin)'),
+                         ('and', [('or', [('word', 'kelsier'), ('word', 'vin')]), ('word', 'hoid')]))
+        self.assertEqual(self.parse('hoid vin -cosmere'),
+                         ('and', [('not', ('word', 'cosmere')), ('or', [('word', 'hoid'), ('word', 'vin')])]))
+        self.assertEqual(self.parse('hoid OR -cosmere'), ('or', [('not', ('word', 'cosmere')), ('word', 'hoid')]))
+        self.assertEqual(self.parse('NOT !hoid'), ('not', ('not', ('word', 'hoid'))))
+
+    def test_phrases_and_prefixes(self):
+        self.assertEqual(self.parse('"Hoid now" allom*'), ('or', [('phrase', 'Hoid now'), ('prefix', 'allom')]))
+        self.assertEqual(self.parse("'Hoid now'"), ('phrase', 'Hoid now'))
+        self.assertEqual(self.parse("spren-bond"), ('phrase', 'spren-bond'))
+        self.assertEqual(self.parse("Hoid's"), ('phrase', "Hoid's"))
+
+    def test_malformed_queries(self):
+        self.assertIsNone(self.parse(''))
+        self.assertIsNone(self.parse('AND ) ( | "'))
+        self.assertEqual(self.parse('(hoid OR'), ('word', 'hoid'))
+        self.assertEqual(self.parse('hoid) vin'), ('or', [('word', 'hoid'), ('word', 'vin')]))
+        self.assertEqual(self.parse('"unclosed phrase'), ('phrase', 'unclosed phrase'))
+
+    def test_compile(self):
+        sql, params = SearchQueryParser.compile(self.parse('hoid AND NOT "Hoid now" | allom*'))
+        self.assertEqual(sql, "((!!phraseto_tsquery('english', %s) && plainto_tsquery('english', %s))"
+                              " || to_tsquery('english', %s))")
+        self.assertEqual(params, ['Hoid now', 'hoid', 'allom:*'])
@@ -0,0 +1,159 @@
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from palanaeum import middleware, tasks
+from palanaeum.models import Entry, Event, EntrySearchVector, SearchIndexUpdate, Tag
+from palanaeum.tests.factories import EventFactory, EntryFactory, EntryVersionFactory, EntryLineFactory
+
+
+class SearchIndexQueueTests(TestCase):
+    def setUp(self):
+        self.event = EventFactory()
+        self.entry = EntryFactory(event=self.event)
+        self.version = EntryVersionFactory(entry=self.entry, is_approved=False)
+        EntryLineFactory(entry_version=self.version, text='Queued allomancy.')
+        self.staff = User.objects.create_user(username='staffer', password='pass', is_staff=True)
+
+    def tearDown(self):
+        Entry.objects.all().delete()
+        Event.objects.all().delete()
+
+    def test_approve_queues_entry(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.version.approve(self.staff)
+            self.version.approve(self.staff)
+        self.assertEqual(SearchIndexUpdate.objects.filter(entry=self.entry).count(), 1)
+        self.assertFalse(EntrySearchVector.objects.filter(entry=self.entry).exists())
+        self.assertIn(tasks.schedule_search_index_update, [callback for callback in callbacks])
+
+    def test_event_tags_queue_entries(self):
+        Tag.objects.create(name='cosmere')
+        self.event.add_tag('cosmere')
+        self.assertTrue(SearchIndexUpdate.objects.filter(entry=self.entry).exists())
+
+    def test_update_search_index(self):
+        other = EntryFactory(event=self.event)
+        SearchIndexUpdate.enqueue([self.entry.id, other.id])
+        tasks.update_search_index(batch_size=1)
+        self.assertFalse(SearchIndexUpdate.objects.exists())
+        self.assertTrue(EntrySearchVector.objects.filter(entry=self.entry, text_vector='allomancy').exists())
+        self.assertTrue(EntrySearchVector.objects.filter(entry=other).exists())
+
+    def test_requeued_during_update(self):
+        update_entries = EntrySearchVector.update_entries
+
+        def edit_and_update(entries_ids):
+            if not calls:
+                SearchIndexUpdate.enqueue([self.entry.id])
+            calls.append(entries_ids)
+            update_entries(entries_ids)
+
+        calls = []
+        SearchIndexUpdate.enqueue([self.entry.id])
+        with patch.object(EntrySearchVector, 'update_entries', side_effect=edit_and_update):
+            tasks.update_search_index()
+        self.assertEqual(calls, [[self.entry.id], [self.entry.id]])
+        self.assertFalse(SearchIndexUpdate.objects.exists())
+
+    def test_lag(self):
+        self.assertEqual(SearchIndexUpdate.get_lag(), timedelta(0))
+        SearchIndexUpdate.objects.create(entry=self.entry, queued_date=timezone.now() - timedelta(seconds=30))
+        self.assertGreaterEqual(SearchIndexUpdate.get_lag(), timedelta(seconds=30))
+
+    def test_schedule_is_deduplicated(self):
+        with patch('palanaeum.tasks.caches') as caches, \
+                patch.object(tasks.update_search_index, 'apply_async') as apply_async:
+            caches.__getitem__.return_value.add.side_effect = [True, False]
+            tasks.schedule_search_index_update()
+            tasks.schedule_search_index_update()
+        apply_async.assert_called_once_with(countdown=tasks.SEARCH_INDEX_UPDATE_WINDOW)
+
+
+class SearchIndexConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        # Requests of previous tests stay in the global box, their users are gone from the committed tables
+        middleware._GLOBAL_REQUEST_BOX.__dict__.pop('request', None)
+        self.entry = EntryFactory(event=EventFactory())
+        EntryVersionFactory(entry=self.entry, is_approved=True)
+        patcher = patch.object(tasks, 'schedule_search_index_update')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_requeued_by_other_transaction(self):
+        update_entries = EntrySearchVector.update_entries
+
+        def requeue():
+            try:
+                SearchIndexUpdate.enqueue([self.entry.id])
+            finally:
+                connection.close()
+
+        def requeue_and_update(entries_ids):
+            if not calls:
+                # The entry is changed by another request while the batch is being processed
+                thread = threading.Thread(target=requeue)
+                thread.start()
+                thread.join(timeout=5)
+                self.assertFalse(thread.is_alive(), "Queueing waits for the batch to be processed.")
+            calls.append(entries_ids)
+            update_entries(entries_ids)
+
+        calls = []
+        SearchIndexUpdate.enqueue([self.entry.id])
+        with patch.object(EntrySearchVector, 'update_entries', side_effect=requeue_and_update):
+            tasks.update_search_index()
+        self.assertEqual(calls, [[self.entry.id], [self.entry.id]])
+        self.assertFalse(SearchIndexUpdate.objects.exists())
+
+    def test_claimed_entries(self):
+        SearchIndexUpdate.objects.create(entry=self.entry, claimed_date=timezone.now())
+        tasks.update_search_index()
+        self.assertTrue(SearchIndexUpdate.objects.exists())
+
+        # Claims of workers which didn't finish expire
+        SearchIndexUpdate.objects.update(claimed_date=timezone.now() - timedelta(
+            seconds=tasks.SEARCH_INDEX_CLAIM_TIMEOUT + 1))
+        tasks.update_search_index()
+        self.assertFalse(SearchIndexUpdate.objects.exists())
+
+
+class RebuildSearchIndexTests(TestCase):
+    def setUp(self):
+        self.event = EventFactory()
+        self.entries = []
+        for text in ('Allomancy is cool.', 'Hoid is <b>everywhere</b>.', 'Nothing to see.'):
+            entry = EntryFactory(event=self.event)
+            version = EntryVersionFactory(entry=entry, is_approved=True)
+            EntryLineFactory(entry_version=version, text=text, speaker='Brandon Sanderson')
+            self.entries.append(entry)
+
+    def tearDown(self):
+        Entry.objects.all().delete()
+        Event.objects.all().delete()
+
+    def test_rebuild(self):
+        stale = EntrySearchVector.objects.create(entry=self.entries[2], text_vector='stale', speaker_vector='')
+        output = StringIO()
+        call_command('rebuild_search_index', chunk_size=2, stdout=output)
+        self.assertIn('3 entries', output.getvalue())
+
+        self.assertEqual(EntrySearchVector.objects.count(), 3)
+        self.assertEqual(set(EntrySearchVector.objects.filter(text_vector='allomancy').values_list('entry', flat=True)),
+                         {self.entries[0].id})
+        self.assertTrue(EntrySearchVector.objects.filter(entry=self.entries[1], text_vector='everywhere').exists())
+        self.assertEqual(EntrySearchVector.objects.filter(speaker_vector='sanderson').count(), 3)
+        self.assertFalse(EntrySearchVector.objects.filter(pk=stale.pk, text_vector='stale').exists())
+
+    def test_update_matches_rebuild(self):
+        EntrySearchVector.update_entries(entry.id for entry in self.entries)
+        vectors = dict(EntrySearchVector.objects.values_list('entry_id', 'text_vector'))
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(dict(EntrySearchVector.objects.values_list('entry_id', 'text_vector')), vectors)
@@ -0,0 +1,77 @@
+from django.test import TestCase
+
+from palanaeum.models import AudioSource, Entry, Event, ImageSource, Snippet, URLSource
+from palanaeum.read_models import load_entries
+from palanaeum.tests.factories import EventFactory, EntryFactory, EntryVersionFactory
+
+
+class SourceFlagsTests(TestCase):
+    def setUp(self):
+        self.event = EventFactory()
+        self.entry = EntryFactory(event=self.event)
+        self.version = EntryVersionFactory(entry=self.entry, is_approved=True, direct_entry=True)
+        self.audio = AudioSource.objects.create(event=self.event, length=600)
+
+    def tearDown(self):
+        Snippet.objects.all().delete()
+        AudioSource.objects.all().delete()
+        ImageSource.objects.all().delete()
+        URLSource.objects.all().delete()
+        Entry.objects.all().delete()
+        Event.objects.all().delete()
+
+    def assertFlags(self, entry, **flags):
+        entry = Entry.objects.get(pk=entry.pk)
+        self.assertEqual({flag: getattr(entry, flag) for flag in flags}, flags)
+
+    def test_snippets(self):
+        snippet = Snippet.objects.create(source=self.audio, entry=self.entry, length=10)
+        Snippet.objects.create(source=self.audio, entry=self.entry, beginning=10, length=10)
+        self.assertFlags(self.entry, has_snippet=True, snippet_count=2)
+
+        snippet.hide()
+        self.assertFlags(self.entry, has_snippet=True, snippet_count=1)
+
+        other_entry = EntryFactory(event=self.event)
+        snippet.entry = other_entry
+        snippet.save()
+        self.assertFlags(self.entry, has_snippet=True, snippet_count=1)
+        self.assertFlags(other_entry, has_snippet=True, snippet_count=0)
+
+        snippet.entry = None
+        snippet.save()
+        self.assertFlags(other_entry, has_snippet=False, snippet_count=0)
+
+        Snippet.objects.get(entry=self.entry).delete()
+        self.assertFlags(self.entry, has_snippet=False, snippet_count=0)
+
+    def test_image_sources(self):
+        image = ImageSource.objects.create(event=self.event, entry=self.entry, file='sources/image.png', name='Image')
+        self.assertFlags(self.entry, has_image=True)
+
+        image.entry = None
+        image.save()
+        self.assertFlags(self.entry, has_image=False)
+
+    def test_url_sources(self):
+        source = URLSource.get_or_create('https://example.com/', 'Source')
+        source.entry_versions.add(self.version)
+        Entry.update_source_flags(Entry.objects.filter(pk=self.entry.pk))
+        self.assertFlags(self.entry, has_url=True)
+
+        # URL sources of any version count, the removed version takes them away
+        self.version.delete()
+        self.entry.update_version_pointers()
+        self.assertFlags(self.entry, has_url=False)
+
+    def test_direct_entry_without_queries(self):
+        entry = Entry.prefetch_entries([self.entry.id])[self.entry.id]
+        with self.assertNumQueries(0):
+            self.assertTrue(entry.direct_entry)
+        self.assertTrue(load_entries([self.entry.id])[self.entry.id].direct_entry)
+
+        Snippet.objects.create(source=self.audio, entry=self.entry, length=10)
+        entry = Entry.prefetch_entries([self.entry.id])[self.entry.id]
+        with self.assertNumQueries(0):
+            self.assertFalse(entry.direct_entry)
+        self.assertFalse(load_entries([self.entry.id])[self.entry.id].direct_entry)
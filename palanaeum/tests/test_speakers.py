@@ -0,0 +1,104 @@
+from importlib import import_module
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.http import QueryDict
+from django.test import TestCase
+from django.urls import reverse
+
+from palanaeum import middleware
+from palanaeum.models import Entry, Event, EntrySpeaker, Speaker
+from palanaeum.search import SearchResults, SpeakerSearchFilter
+from palanaeum.tests.factories import EventFactory, EntryFactory, EntryVersionFactory, EntryLineFactory
+
+
+class SpeakerTests(TestCase):
+    def setUp(self):
+        self.event = EventFactory()
+        self.entry = self.make_entry(['Brandon Sanderson', 'Questioner', 'Brandon Sanderson'])
+        self.other = self.make_entry(['brandon  sanderson', 'Questioner 2'])
+        self.third = self.make_entry(['Brandon Sanderson'])
+
+    def tearDown(self):
+        Entry.objects.all().delete()
+        Event.objects.all().delete()
+
+    def make_entry(self, speakers, is_approved=True, entry=None):
+        entry = entry or EntryFactory(event=self.event)
+        version = EntryVersionFactory(entry=entry, is_approved=is_approved)
+        for speaker in speakers:
+            EntryLineFactory(entry_version=version, speaker=speaker)
+        # The editor updates the entry after saving the lines of its version
+        entry.update_version_pointers()
+        return entry
+
+    def test_speakers_are_normalized(self):
+        speaker = Speaker.objects.get(key='brandon sanderson')
+        self.assertEqual(speaker.name, 'Brandon Sanderson')
+        self.assertEqual(speaker.aliases, ['brandon  sanderson'])
+        self.assertEqual(speaker.entries_count, 3)
+        self.assertEqual(Speaker.objects.get(name='Questioner').entries_count, 1)
+
+    def test_all_speakers(self):
+        self.assertEqual(list(self.event.all_speakers()),
+                         ['Brandon Sanderson', 'Questioner', 'Questioner 2'])
+
+    def test_unapproved_versions(self):
+        self.make_entry(['Peter Ahlstrom'], is_approved=False, entry=self.third)
+        speaker = Speaker.objects.get(name='Peter Ahlstrom')
+        self.assertEqual(speaker.entries_count, 0)
+        self.assertEqual(Speaker.objects.get(key='brandon sanderson').entries_count, 3)
+        self.assertEqual(list(EntrySpeaker.objects.filter(entry=self.third).order_by('name')
+                              .values_list('name', 'newest', 'approved')),
+                         [('Brandon Sanderson', False, True), ('Peter Ahlstrom', True, False)])
+        self.assertNotIn('Peter Ahlstrom', self.event.all_speakers())
+
+        self.third.versions.last().approve(None)
+        self.assertEqual(Speaker.objects.get(name='Peter Ahlstrom').entries_count, 1)
+        self.assertEqual(Speaker.objects.get(key='brandon sanderson').entries_count, 2)
+
+    def test_saved_entries(self):
+        contributor = User.objects.create_user(username='speakers_contributor', password='pass')
+        staff = User.objects.create_user(username='speakers_staff', password='pass', is_staff=True)
+        # Requests stay in the global box, the next tests shouldn't see this staff member
+        self.addCleanup(delattr, middleware._GLOBAL_REQUEST_BOX, 'request')
+        for user, entry in ((contributor, self.third), (staff, self.other)):
+            self.client.force_login(user)
+            with patch.object(Speaker, 'update_entries', wraps=Speaker.update_entries) as update_entries:
+                response = self.client.post(reverse('save_entry'), {
+                    'entry_id': entry.id, 'line-1-id': '', 'line-1-order': 1, 'line-1-speaker': 'Peter Ahlstrom',
+                    'line-1-text': 'Hello.', 'date': '2020-01-01',
+                })
+            self.assertEqual(response.status_code, 200)
+            # Speakers are updated once, after the lines are saved
+            update_entries.assert_called_once_with([entry.id])
+            self.assertIn('Peter Ahlstrom', EntrySpeaker.objects.filter(entry=entry, newest=True)
+                          .values_list('name', flat=True))
+
+    def test_deleted_entries(self):
+        self.other.delete()
+        self.assertFalse(Speaker.objects.filter(name='Questioner 2').exists())
+        speaker = Speaker.objects.get(key='brandon sanderson')
+        self.assertEqual((speaker.entries_count, speaker.aliases), (2, []))
+        self.assertEqual(list(self.event.all_speakers()), ['Brandon Sanderson', 'Questioner'])
+
+    def test_speaker_search(self):
+        search_filter = SpeakerSearchFilter()
+        search_filter.init_from_get_params(QueryDict('speaker=sanderson'))
+        self.assertEqual({entry_id for entry_id, rank in SearchResults([search_filter])},
+                         {self.entry.id, self.other.id, self.third.id})
+
+        search_filter.init_from_get_params(QueryDict('speaker=questioner'))
+        self.assertEqual({entry_id for entry_id, rank in SearchResults([search_filter])},
+                         {self.entry.id, self.other.id})
+
+    def test_migration_backfill(self):
+        migration = import_module('palanaeum.migrations.0026_speakers')
+        speakers = list(Speaker.objects.values_list('key', 'name', 'aliases', 'entries_count'))
+        Speaker.objects.all().delete()
+        self.assertEqual(list(self.event.all_speakers()), [])
+
+        migration.backfill_speakers(None, None)
+        self.assertEqual(list(Speaker.objects.values_list('key', 'name', 'aliases', 'entries_count')), speakers)
+        self.assertEqual(list(self.event.all_speakers()),
+                         ['Brandon Sanderson', 'Questioner', 'Questioner 2'])
@@ -0,0 +1,96 @@
+import pickle
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+import numpy as np
+
+from django.test import TestCase
+from django.utils import timezone
+
+from palanaeum import tasks
+from palanaeum.models import Entry, Event, Tag, TagIndexChange
+from palanaeum.tag_index import TAG_INDEX_REFRESH_INTERVAL, TagIndex, bitmap_to_ids, get_tag_index, \
+    ids_to_bitmap, reset_tag_index
+from palanaeum.tests.factories import EventFactory, EntryFactory, EntryVersionFactory
+
+
+class TagIndexTests(TestCase):
+    def setUp(self):
+        reset_tag_index()
+        self.tag_magic = Tag.objects.create(name='magic')
+        self.tag_cosmere = Tag.objects.create(name='cosmere')
+        event = EventFactory()
+        self.entry = EntryFactory(event=event)
+        self.version = EntryVersionFactory(entry=self.entry, is_approved=True)
+        self.version.update_tags('magic, cosmere')
+        self.other = EntryFactory(event=event)
+        self.other_version = EntryVersionFactory(entry=self.other, is_approved=True)
+        self.other_version.update_tags('magic')
+
+    def tearDown(self):
+        reset_tag_index()
+        Entry.objects.all().delete()
+        Event.objects.all().delete()
+
+    def entries(self, tags, variant='approved'):
+        return bitmap_to_ids(get_tag_index().union((tag.id for tag in tags), variant))
+
+    def test_bitmap_to_ids(self):
+        self.assertEqual(bitmap_to_ids(0), [])
+        self.assertEqual(bitmap_to_ids(0b100101), [0, 2, 5])
+        self.assertEqual(bitmap_to_ids(1 << 100000), [100000])
+
+    def test_ids_to_bitmap(self):
+        self.assertEqual(ids_to_bitmap(np.array([], dtype=np.int64)), 0)
+        self.assertEqual(ids_to_bitmap(np.array([0, 2, 5])), 0b100101)
+        self.assertEqual(bitmap_to_ids(ids_to_bitmap(np.array([3, 100000]))), [3, 100000])
+
+    def test_load(self):
+        index = TagIndex()
+        index.load()
+        self.assertEqual(bitmap_to_ids(index.get_bitmap(self.tag_magic.id, 'newest')),
+                         sorted([self.entry.id, self.other.id]))
+        self.assertEqual(bitmap_to_ids(index.intersection([self.tag_magic.id, self.tag_cosmere.id], 'approved')),
+                         [self.entry.id])
+
+    def test_tag_edits_are_applied(self):
+        self.assertEqual(self.entries([self.tag_cosmere]), [self.entry.id])
+        self.other_version.add_tag('cosmere')
+        self.version.remove_tag('cosmere')
+        self.assertEqual(self.entries([self.tag_cosmere]), [self.other.id])
+
+    def test_refresh_interval(self):
+        self.entries([self.tag_cosmere])
+        with self.assertNumQueries(0):
+            self.entries([self.tag_cosmere])
+
+        # Another process changes the tags, its change is noticed after the interval
+        self.other_version.tags.add(self.tag_cosmere)
+        TagIndexChange.objects.create(entry_id=self.other.id)
+        self.assertEqual(self.entries([self.tag_cosmere]), [self.entry.id])
+        with patch('palanaeum.tag_index.time.time', return_value=time.time() + TAG_INDEX_REFRESH_INTERVAL + 1):
+            self.assertEqual(self.entries([self.tag_cosmere]), sorted([self.entry.id, self.other.id]))
+
+    def test_unapproved_versions(self):
+        self.entries([self.tag_magic])
+        version = EntryVersionFactory(entry=self.entry, is_approved=False)
+        version.update_tags('cosmere')
+        self.assertEqual(self.entries([self.tag_magic], 'newest'), [self.other.id])
+        self.assertEqual(self.entries([self.tag_magic], 'approved'), sorted([self.entry.id, self.other.id]))
+
+        version.approve(None)
+        self.assertEqual(self.entries([self.tag_magic], 'approved'), [self.other.id])
+
+    def test_snapshot(self):
+        index = TagIndex()
+        index.load()
+        copy = pickle.loads(pickle.dumps(index))
+        self.assertEqual(copy.last_change_id, index.last_change_id)
+        self.assertEqual(copy.union([self.tag_magic.id], 'approved'), index.union([self.tag_magic.id], 'approved'))
+
+    def test_clean_tag_index_changes(self):
+        TagIndexChange.objects.update(date=timezone.now() - timedelta(days=1))
+        TagIndexChange.record([self.entry.id])
+        tasks.clean_tag_index_changes()
+        self.assertEqual(TagIndexChange.objects.count(), 1)
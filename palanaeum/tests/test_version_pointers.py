@@ -0,0 +1,63 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from palanaeum.models import Entry, EntryVersion, Event
+from palanaeum.tests.factories import EventFactory, EntryFactory, EntryVersionFactory
+
+
+class VersionPointersTests(TestCase):
+    def setUp(self):
+        self.event = EventFactory()
+        self.entry = EntryFactory(event=self.event)
+        self.approved = EntryVersionFactory(entry=self.entry, is_approved=True)
+        self.user = User.objects.create_user(username='staffer', password='pass', is_staff=True)
+
+    def tearDown(self):
+        Entry.objects.all().delete()
+        Event.objects.all().delete()
+
+    def add_suggestion(self):
+        return EntryVersionFactory(entry=self.entry, is_approved=False,
+                                   date=timezone.now() + timedelta(seconds=10))
+
+    def test_new_version_moves_newest_pointer(self):
+        suggestion = self.add_suggestion()
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.newest_version_id, suggestion.id)
+        self.assertEqual(self.entry.newest_approved_version_id, self.approved.id)
+
+    def test_approve_and_reject_update_pointers(self):
+        suggestion = self.add_suggestion()
+        suggestion.approve(self.user)
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.newest_approved_version_id, suggestion.id)
+
+        rejected = self.add_suggestion()
+        rejected.reject()
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.newest_version_id, suggestion.id)
+
+    def test_entry_save_keeps_pointers(self):
+        entry = Entry.objects.get(pk=self.entry.pk)
+        suggestion = self.add_suggestion()
+        entry.save()
+        entry.refresh_from_db()
+        self.assertEqual(entry.newest_version_id, suggestion.id)
+
+    def test_newest_manager_uses_pointers(self):
+        suggestion = self.add_suggestion()
+        self.assertEqual(list(EntryVersion.newest.filter(entry=self.entry)), [self.approved])
+        self.assertNotIn(suggestion, EntryVersion.newest.all())
+
+    def test_backfill_command(self):
+        suggestion = self.add_suggestion()
+        Entry.objects.update(newest_version=None, newest_approved_version=None)
+        call_command('backfill_version_pointers', stdout=StringIO())
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.newest_version_id, suggestion.id)
+        self.assertEqual(self.entry.newest_approved_version_id, self.approved.id)
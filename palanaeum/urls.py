@@ -74,6 +74,7 @@ urlpatterns = [
     path('recent/feed/', RecentEntriesFeed(), name="recent_entries_feed"),
 
     path('entry/<int:entry_id>/', views.view_entry, name="view_entry"),
+    path('entry/<int:entry_id>/related/', views.related_entries, name="related_entries"),
     path('entry/<int:entry_id>/edit/', staff_views.edit_entry, name='edit_entry'),
     path('entry/<int:entry_id>/delete/', staff_views.remove_entry, name='remove_entry'),
     path('entry/<int:entry_id>/history/', staff_views.show_entry_history, name='entry_history'),
@@ -110,6 +111,7 @@ urlpatterns = [
     re_path(r'^source/(?P<source_type>audio|image)/(?P<pk>\d+)/reject/', staff_views.reject_source, name='reject_source'),
 
     path('get_tags/', views.get_tags, name="get_tags"),
+    path('autocomplete/<str:kind>/', views.autocomplete_names, name="autocomplete"),
     path('tags/', views.tags_list, name="tags_list"),
     path('adv_search/', views.adv_search, name="advanced_search"),
     path('todo/', views.untranscribed_snippets, name="todo_snippets"),
@@ -138,6 +140,7 @@ urlpatterns = [
 
     path('staff/', staff_views.staff_cp, name="staff_index"),
     path('staff/suggestions/', staff_views.staff_cp_suggestions, name='staff_suggestions'),
+    path('staff/profiling/', staff_views.staff_cp_profiling, name='staff_profiling'),
     path('staff/help/<path>/edit/', staff_views.edit_help_page, name='help_edit'),
     path('staff/help/<path>/delete/', staff_views.remove_help, name='remove_help'),
 
@@ -7,24 +7,28 @@ from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import Count, Q
+from django.db.models import Count
 from django.http import Http404
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 from django.views.decorators.http import require_POST
-from django.core.cache import cache
 
+from palanaeum.autocomplete import autocomplete, KINDS as AUTOCOMPLETE_KINDS
 from palanaeum.configuration import get_config
 from palanaeum.decorators import json_response, AjaxException
+from palanaeum.fragments import render_entries
 from palanaeum.forms import UserCreationFormWithEmail, UserSettingsForm, \
     EmailChangeForm, SortForm, UsersEntryCollectionForm
 from palanaeum.models import UserSettings, Event, \
     AudioSource, Entry, Tag, ImageSource, RelatedSite, UsersEntryCollection, EntryVersion, Snippet, HelpPage
-from palanaeum.search import init_filters, execute_filters, get_search_results, \
-    paginate_search_results
+from palanaeum.page_cache import EventPageCache
+from palanaeum.read_models import load_entries
+from palanaeum.related import find_related
+from palanaeum.search import init_filters, get_search_results, paginate_search_results
 from palanaeum.utils import is_contributor, page_numbers_to_show
 
 
@@ -142,48 +146,65 @@ def view_entry(request, entry_id):
     return redirect(reverse('view_event', args=(entry.event_id, slugify(entry.event.name))) + '#e{}'.format(entry.id))
 
 
-def view_event(request, event_id):
+def related_entries(request, entry_id):
     """
-    Display single Event page.
+    Display entries most similar to the given one.
     """
-    event = get_object_or_404(Event, pk=event_id)
-
-    if not event.visible():
-        raise PermissionDenied
-
-    # Caching only responses for anonymous users, as that's the majority of
-    # visits and those don't change that much.
-    anonymous_user_cache = "anon_event_view_{}".format(event_id)
-
-    if request.user and request.user.is_anonymous:
-        cached_response = cache.get(anonymous_user_cache)
-        if cached_response is not None:
-            cached_response, cache_timestamp = cached_response
-            if cache_timestamp <= event.modified_date:
-                return cached_response
+    entry = get_object_or_404(Entry.all_visible, pk=entry_id)
+    related = find_related(entry.id)
+    entries_map = load_entries([entry.id] + [related_id for related_id, similarity in related])
+    render_entries(entries_map.values(), request)
 
-    entry_ids = Entry.all_visible.filter(event=event).values_list('id', flat=True)
-    entries_map = Entry.prefetch_entries(entry_ids, show_unapproved=is_contributor(request))
+    return render(request, 'palanaeum/related_entries.html',
+                  {'entry': entries_map.get(entry.id, entry),
+                   'entries': [(entries_map[related_id], similarity) for related_id, similarity in related
+                               if related_id in entries_map]})
 
-    entries = sorted(entries_map.values(), key=lambda e: e.order)
-    sources = list(event.sources_iterator())
 
-    approval_msg = get_config('approval_message')
-    if event.review_state == Event.REVIEW_APPROVED:
-        approval_explanation = get_config('review_reviewed_explanation')
-    elif event.review_state == Event.REVIEW_PENDING:
-        approval_explanation = get_config('review_pending_explanation')
-    else:
-        approval_explanation = ''
+def view_event(request, event_id):
+    """
+    Display single Event page.
+    """
+    page_cache = EventPageCache(request, event_id)
+    cached_response = page_cache.get_response()
+    if cached_response is not None:
+        return cached_response
 
-    response = render(request, 'palanaeum/event.html', {'event': event, 'entries': entries, 'sources': sources,
-                                                    'approval_msg': approval_msg,
-                                                    'review_message': approval_explanation})
+    try:
+        event = get_object_or_404(Event, pk=event_id)
+
+        if not event.visible():
+            raise PermissionDenied
+
+        entries_section = page_cache.entries_section
+        if entries_section is None:
+            entry_ids = Entry.all_visible.filter(event=event).values_list('id', flat=True)
+            entries_map = load_entries(entry_ids, show_unapproved=is_contributor(request), events={event.id: event})
+
+            entries = sorted(entries_map.values(), key=lambda e: e.order)
+            render_entries(entries, request)
+            entries_section = render_to_string('palanaeum/elements/event_entries.html',
+                                               {'entries': entries, 'user': request.user})
+            page_cache.store_entries(entries_section, event, entries)
+        sources = list(event.sources_iterator())
+
+        approval_msg = get_config('approval_message')
+        if event.review_state == Event.REVIEW_APPROVED:
+            approval_explanation = get_config('review_reviewed_explanation')
+        elif event.review_state == Event.REVIEW_PENDING:
+            approval_explanation = get_config('review_pending_explanation')
+        else:
+            approval_explanation = ''
 
-    if request.user and request.user.is_anonymous:
-        cache.set(anonymous_user_cache, (response, event.modified_date))
+        response = render(request, 'palanaeum/event.html', {'event': event, 'entries_section': entries_section,
+                                                            'sources': sources, 'approval_msg': approval_msg,
+                                                            'review_message': approval_explanation})
+    except Exception:
+        # Don't leave the lock taken and stale copies of a hidden or removed event behind
+        page_cache.invalidate()
+        raise
 
-    return response
+    return page_cache.store(response, event)
 
 
 
@@ -273,8 +294,9 @@ def show_collection(request, collection_id):
         messages.info(request, _('You are viewing a private collection as superuser.'))
 
     entries_ids = collection.entries.all().values_list('id', flat=True)
-    entries = Entry.prefetch_entries(entries_ids)
-    entries = [entries[eid] for eid in entries_ids]
+    entries = load_entries(entries_ids)
+    entries = [entries[eid] for eid in entries_ids if eid in entries]
+    render_entries(entries, request)
 
     return render(request, 'palanaeum/collections/collection.html',
                   {'entries': entries, 'collection': collection,
@@ -409,11 +431,14 @@ def adv_search(request):
     """
     Display an advances search form + search results.
     """
-    filters = init_filters(request)
+    filters = init_filters(request, form=True)
 
     ordering = request.GET.get('ordering', 'rank')
+    excerpts = bool(request.GET.get('excerpts'))
 
     search_params = [urlencode({'ordering': ordering})]
+    if excerpts:
+        search_params.append(urlencode({'excerpts': 'on'}))
     for search_filter in filters:
         if search_filter:
             search_params.append(search_filter.as_url_param())
@@ -421,13 +446,17 @@ def adv_search(request):
 
     if any(filters):
         start_time = time.time()
-        entries_scores = execute_filters(filters)
 
-        entries, paginator, page = paginate_search_results(request, get_search_results(entries_scores, ordering))
+        search_results = get_search_results(filters, ordering)
+        # Facets are counted together with the results, before the paginator asks for the count
+        facets = search_results.get_facets()
+        entries, paginator, page = paginate_search_results(request, search_results, excerpts)
         entries_found = paginator.count
+        if not entries_found:
+            facets = None
         search_time = time.time() - start_time
-        
-        if entries_scores:
+
+        if entries_found:
             to_show = page_numbers_to_show(paginator, page.number)
         else:
             to_show = []
@@ -435,6 +464,7 @@ def adv_search(request):
     else:
         entries = []
         entries_found = 0
+        facets = None
         page = None
         search_time = 0
         to_show = []
@@ -443,7 +473,8 @@ def adv_search(request):
                   {'page_numbers_to_show': to_show, 'entries': entries, 'entries_found': entries_found,
                    'filters': filters, 'search_done': any(filters),
                    'query': request.GET.get('query', ''), 'search_params': search_params,
-                   'page': page, 'search_time': search_time, 'ordering': ordering},
+                   'page': page, 'search_time': search_time, 'ordering': ordering, 'facets': facets,
+                   'excerpts': excerpts},
                   status=200 if entries else 404)
 
 
@@ -453,14 +484,27 @@ def get_tags(request):
     Return a tag list suitable for select2.
     """
     query = request.GET.get('q', '')
-    tags = Tag.objects.filter(
-        Q(name__startswith=query) | Q(name__contains=' ' + query)
-    ).annotate(entry_count=Count('versions__entry_id', distinct=True), event_count=Count('events'))
     return {'results': [
         {
-            'id': t.name,
-            'text': "{} ({})".format(t.name, t.entry_count + t.event_count)
-        } for t in sorted(tags, key=lambda tag: -(tag.entry_count + tag.event_count))]}
+            'id': name,
+            'text': "{} ({})".format(name, count)
+        } for name, count in autocomplete('tags', query)]}
+
+
+@json_response
+def autocomplete_names(request, kind):
+    """
+    Return tags or speakers starting with the typed query, in the select2 format.
+    """
+    if kind not in AUTOCOMPLETE_KINDS:
+        raise Http404
+    query = request.GET.get('q', '')
+    return {'results': [
+        {
+            'id': name,
+            'text': name,
+            'count': count
+        } for name, count in autocomplete(kind, query)]}
 
 
 def tags_list(request):
@@ -510,8 +554,9 @@ def recent_entries(request):
 
     to_show = page_numbers_to_show(paginator, page.number)
 
-    entries_map = Entry.prefetch_entries(page, show_unapproved=is_contributor(request))
+    entries_map = load_entries(page, show_unapproved=is_contributor(request))
     entries = [entries_map[entry_id] for entry_id in page]
+    render_entries(entries, request)
 
     return render(request, 'palanaeum/recent_entries.html',
                   {'page_numbers_to_show': to_show, 'page': page, 'entries': entries, 'mode': date_mode,